@@ -0,0 +1,341 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import asyncio
+import os
+import time
+
+import numpy as np
+import serial
+
+import AR4_commands
+import AR4_encoding
+from AR4_api import AR4, params_fingerprint
+from AR4_log import logger, fields
+from AR4_state import X, RZ, J9
+from AR4_transport import SerialTransport, ReplyTimeout, LINE, BYTE, _DEFAULT
+
+
+class AsyncSerialLink(object):
+    """Non-blocking request/reply link on one serial port, driven by the running event loop.
+
+    On POSIX the port is watched with loop.add_reader, elsewhere a reader polls the port from the default executor.
+    Exchanges on one link are serialised by a lock, exchanges on different links run concurrently.
+    With metrics set, every exchange is recorded like on SerialTransport, the wait includes reading the reply.
+    """
+
+    def __init__(self, ser, terminator=b'\n', timeouts=None, default_timeout=5.0, poll_interval=.01,
+                 metrics=None, name='teensy'):
+        self.ser = ser
+        self.metrics = metrics
+        self.name = name
+        self.terminator = terminator
+        self.timeouts = dict(SerialTransport.DEFAULT_TIMEOUTS)
+        if timeouts is not None:
+            self.timeouts.update(timeouts)
+        self.default_timeout = default_timeout
+        self.poll_interval = poll_interval
+        self._buffer = bytearray()
+        self._data = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._loop = None
+        self._fd = None
+        self._poller = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        if os.name == 'posix' and hasattr(self.ser, 'fileno'):
+            self.ser.timeout = 0
+            self._fd = self.ser.fileno()
+            self._loop.add_reader(self._fd, self._on_readable)
+        else:
+            self.ser.timeout = self.poll_interval
+            self._poller = self._loop.create_task(self._poll())
+
+    async def close(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+        self.ser.close()
+
+    def _on_readable(self):
+        data = self.ser.read(self.ser.in_waiting or 1)
+        if data:
+            self._buffer += data
+            self._data.set()
+
+    async def _poll(self):
+        while True:
+            data = await self._loop.run_in_executor(None, self.ser.read, max(1, self.ser.in_waiting))
+            if data:
+                self._buffer += data
+                self._data.set()
+
+    def timeout_for(self, command):
+        if isinstance(command, (bytes, bytearray)):
+            command = command[:2].decode('ascii', 'replace')
+        return self.timeouts.get(command[:2], self.default_timeout)
+
+    async def exchange(self, command, reply=LINE, timeout=_DEFAULT):
+        async with self._lock:
+            self._buffer.clear()
+            self._data.clear()
+            if self.ser.in_waiting:
+                self.ser.reset_input_buffer()
+            start = time.perf_counter()
+            data = command.encode() if isinstance(command, str) else bytes(command)
+            encoded = time.perf_counter()
+            self.ser.write(data)
+            written = time.perf_counter()
+            prefix = data[:2].decode('ascii', 'replace')
+            response = b''
+            if reply is not None:
+                if timeout is _DEFAULT:
+                    timeout = self.timeouts.get(prefix, self.default_timeout)
+                try:
+                    if reply == BYTE:
+                        response = await asyncio.wait_for(self._read_bytes(1), timeout)
+                    else:
+                        response = await asyncio.wait_for(self._read_line(), timeout)
+                except asyncio.TimeoutError:
+                    if self.metrics is not None:
+                        self.metrics.timeout(self.name, prefix)
+                    raise ReplyTimeout("No reply from controller within deadline, received: "
+                                       + repr(bytes(self._buffer)))
+            if self.metrics is not None:
+                self.metrics.exchange(self.name, prefix, encoded - start, written - encoded,
+                                      time.perf_counter() - written, 0.0, len(data),
+                                      len(response) + (reply == LINE) * len(self.terminator))
+            return None if reply is None else response
+
+    async def _read_line(self):
+        while True:
+            index = self._buffer.find(self.terminator)
+            if index >= 0:
+                line = bytes(self._buffer[:index])
+                del self._buffer[:index + len(self.terminator)]
+                return line
+            self._data.clear()
+            await self._data.wait()
+
+    async def _read_bytes(self, size):
+        while len(self._buffer) < size:
+            self._data.clear()
+            await self._data.wait()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class _PortlessAR4(AR4):
+    # AR4 without a port of its own, holds calibration and pose and parses replies for AsyncAR4
+
+    def __init__(self, port, owner):
+        super().__init__(port)
+        self._owner = owner
+
+    def correct_pos(self):
+        # called by error_handler on a collision error, runs as soon as the current exchange is done
+        self._owner.loop.create_task(self._owner.correct_pos())
+
+    def close(self):
+        pass
+
+
+class AsyncAR4(object):
+    """asyncio counterpart of AR4.
+
+    The Teensy and the Arduino IO board each get their own AsyncSerialLink on the same event loop, so gripper
+    commands can be awaited together with a move, e.g. asyncio.gather(robot.move_l(...), robot.servo_cmd(0, 90)).
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.loop = None
+        self.link = None
+        self.link2 = None
+        self.robot = _PortlessAR4(port, self)
+
+    @property
+    def calibration(self):
+        return self.robot.calibration
+
+    @property
+    def calibrated(self):
+        return self.robot.calibrated
+
+    @property
+    def metrics(self):
+        return self.robot.metrics
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self, ser=None):
+        self.loop = asyncio.get_running_loop()
+        ser = ser if ser is not None else serial.Serial(self.port, baudrate=9600)
+        logger.info("SYSTEM READY")
+        await asyncio.sleep(.1)
+        ser.reset_input_buffer()
+        self.link = AsyncSerialLink(ser, metrics=self.robot.metrics)
+        self.link.start()
+        await self.startup()
+
+    async def close(self):
+        self.robot.pos_store.close()
+        if self.link is not None:
+            await self.link.close()
+            self.link = None
+        if self.link2 is not None:
+            await self.link2.close()
+            self.link2 = None
+
+    async def startup(self):
+        self.robot.load_calibration()
+        self.robot.calc_loop_mode()
+        await self.update_params()
+        await self.send_pos()
+        await self.request_pos()
+
+    async def set_com_gripper(self, port):
+        try:
+            ser2 = serial.Serial(port, 115200)
+            self.link2 = AsyncSerialLink(ser2, metrics=self.robot.metrics, name='io')
+            self.link2.start()
+            logger.info("COMMUNICATIONS STARTED WITH ARDUINO IO BOARD")
+        except Exception as e:
+            logger.error("UNABLE TO ESTABLISH COMMUNICATIONS WITH ARDUINO IO BOARD", extra=fields(error=str(e)))
+
+    async def send_command(self, command):
+        response = str((await self.link.exchange(command)).strip(), 'utf-8')
+        if response[:1] == 'E':
+            self.robot.error_handler(response)
+        else:
+            self.robot.parse_response(response)
+        return response
+
+    async def update_params(self):
+        command = AR4_encoding.update_params(self.calibration, self.robot.config)
+        self.robot.params_fingerprint = None
+        await self.link.exchange(command, BYTE)
+        self.robot.params_fingerprint = params_fingerprint(command)
+
+    # ------------------------- #
+    #  Robot Position Commands  #
+    # ------------------------- #
+    async def send_pos(self):
+        return await self.link.exchange(AR4_commands.send_pos(self.robot.state.pose), BYTE)
+
+    async def correct_pos(self):
+        response = str((await self.link.exchange(b"CP\n")).strip(), 'utf-8')
+        self.robot.parse_response(response)
+        return response
+
+    async def request_pos(self):
+        response = str((await self.link.exchange(b"RP\n")).strip(), 'utf-8')
+        self.robot.parse_response(response)
+
+        return tuple(self.robot.state.pose[X:J9 + 1].tolist()) + (self.robot.WC,)
+
+    # ---------------------------- #
+    #  Robot Calibration Commands  #
+    # ---------------------------- #
+    async def _calibrate(self, flags, name):
+        command = AR4_commands.calibrate(self.calibration, flags)
+        response = str((await self.link.exchange(command)).strip(), 'utf-8')
+        if response[:1] == 'A':
+            self.robot.parse_response(response)
+            logger.info(name + " Successful")
+            return True
+        logger.error(name + " Failed", extra=fields(response=response))
+        self.robot.error_handler(response)
+        return False
+
+    async def cal_robot_all(self):
+        await self._calibrate(AR4_commands.cal_stage_flags(self.calibration, 1), "Auto Calibration Stage 1")
+        flags = AR4_commands.cal_stage_flags(self.calibration, 2)
+        if sum(int(flag) for flag in flags) > 0:
+            if await self._calibrate(flags, "Auto Calibration Stage 2"):
+                self.robot.calibrated = True
+
+    async def cal_robot_joint(self, joint: int):
+        if not isinstance(joint, int) or joint < 1 or joint > 9:
+            logger.error("Invalid joint number", extra=fields(joint=joint))
+            return
+        joints_to_cal = [0, 0, 0, 0, 0, 0, 0, 0, 0]
+        joints_to_cal[joint - 1] = 1
+        await self._calibrate(joints_to_cal, "J" + str(joint) + " Calibration")
+
+    # ----------------------- #
+    #  Robot Move Commands    #
+    # ----------------------- #
+    async def move_j(self, x, y, z, rx, ry, rz, j7=0.0, j8=0.0, j9=0.0,
+                     spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100, wrist_config='F'):
+        command = AR4_encoding.move_j(x, y, z, rx, ry, rz, j7, j8, j9, spd_prefix, speed, acceleration, deceleration,
+                                      acc_ramp, wrist_config, self.robot.loop_mode)
+        return await self.send_command(command)
+
+    async def move_l(self, x, y, z, rx, ry, rz, j7=0.0, j8=0.0, j9=0.0,
+                     spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100,
+                     rnd=0, wrist_config='F', dis_wrist=False):
+        if np.sign(rz) != np.sign(self.robot.state.pose[RZ]):
+            rz = rz * -1
+        command = AR4_encoding.move_l(x, y, z, rx, ry, rz, j7, j8, j9, spd_prefix, speed, acceleration, deceleration,
+                                      acc_ramp, rnd, wrist_config, dis_wrist, self.robot.loop_mode)
+        return await self.send_command(command)
+
+    async def move_r(self, j1, j2, j3, j4, j5, j6, j7=0.0, j8=0.0, j9=0.0,
+                     spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100, wrist_config='F'):
+        command = AR4_encoding.move_r(j1, j2, j3, j4, j5, j6, j7, j8, j9, spd_prefix, speed, acceleration,
+                                      deceleration, acc_ramp, wrist_config, self.robot.loop_mode)
+        return await self.send_command(command)
+
+    async def move_c(self, x_center, y_center, z_center, rx, ry, rz,
+                     x_start, y_start, z_start, x_plain, y_plain, z_plain, tr_val,
+                     spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100, wrist_config='F'):
+        command = AR4_encoding.move_c_start(rx, ry, rz, x_start, y_start, z_start, tr_val, spd_prefix, speed,
+                                            acceleration, deceleration, acc_ramp, wrist_config, self.robot.loop_mode)
+        await self.send_command(command)
+        command = AR4_encoding.move_c(x_center, y_center, z_center, rx, ry, rz, x_start, y_start, z_start,
+                                      x_plain, y_plain, z_plain, tr_val, spd_prefix, speed, acceleration,
+                                      deceleration, acc_ramp, wrist_config, self.robot.loop_mode)
+        return await self.send_command(command)
+
+    async def move_a(self, x, y, z, rx, ry, rz, x_end, y_end, z_end, tr_val,
+                     spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100, wrist_config='F'):
+        command = AR4_encoding.move_a(x, y, z, rx, ry, rz, x_end, y_end, z_end, tr_val, spd_prefix, speed,
+                                      acceleration, deceleration, acc_ramp, wrist_config, self.robot.loop_mode)
+        return await self.send_command(command)
+
+    # ----------------------- #
+    #  Robot IO Commands      #
+    # ----------------------- #
+    async def set_io_arduino(self, output, state):
+        await self.link2.exchange(AR4_encoding.set_output(output, state), BYTE)
+
+    async def set_io_teensy(self, output, state):
+        await self.link.exchange(AR4_encoding.set_output(output, state), BYTE)
+
+    async def servo_cmd(self, number, position):
+        await self.link2.exchange(AR4_encoding.servo(number, position), BYTE)
+
+    async def set_tcp(self, x, y, z, rx, ry, rz):
+        # the tool frame of the controller no longer matches the UP command, the next open uploads it again
+        self.robot.params_fingerprint = None
+        await self.link.exchange(AR4_commands.set_tcp(x, y, z, rx, ry, rz), BYTE)
+        if self.robot.config is not None:
+            self.robot.config = self.robot.config.replace(tool_frame=(x, y, z, rz, ry, rx))
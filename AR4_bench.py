@@ -0,0 +1,215 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+# Round trip benchmark of the AR4 API against the simulated controller.
+#
+#   python AR4_bench.py --iterations 1000 --output bench.json
+#   python AR4_bench.py --baseline bench.json        # exit code 1 when slower than the baseline
+#
+# With the default zero latency and time scale the controller answers at once and does not solve the kinematics,
+# so the numbers are the cost of the host side: command encoding, the serial exchange, parsing and persisting
+# the position.
+
+import argparse
+import collections
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import AR4_api
+import AR4_persist
+from AR4_sim import SimController, IOBoardSim, LoopbackSerial, write_calibration
+
+
+COMMANDS = ('move_j', 'move_l', 'request_pos', 'set_io_teensy', 'servo_cmd', 'io_single', 'io_batch')
+PERCENTILES = (50, 95, 99)
+
+# joint angles of the two poses the moves alternate between, within the limits of the default calibration
+_POSE_JOINTS = ((0.0, 10.0, -40.0, 0.0, 60.0, 0.0), (10.0, 20.0, -30.0, 0.0, 50.0, 0.0))
+
+
+def _timed(totals, name, function):
+    # wraps a bound method to add its wall time to totals[name]
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            totals[name] += time.perf_counter() - start
+    return wrapper
+
+
+class Bench(object):
+    """Drives an AR4 connected to a SimController through LoopbackSerial and records every call."""
+
+    def __init__(self, latency=0.0, time_scale=0.0, persist=AR4_persist.OFF, solve=False, io_latency=0.0):
+        self.sim = SimController(latency=latency, time_scale=time_scale, seed=0, solve=solve)
+        self.gripper = IOBoardSim(latency=latency, link_latency=io_latency)
+        self.robot = AR4_api.AR4("sim", log_file=None)
+        self.robot.pos_store = AR4_persist.PositionStore("ARbot2.cal", policy=persist)
+        self.robot.open(LoopbackSerial(self.sim))
+        self.robot.set_com_gripper("sim", LoopbackSerial(self.gripper, baudrate=115200))
+        self.poses = [self.robot.kinematics.fk(joints) for joints in _POSE_JOINTS]
+        self.breakdown = collections.defaultdict(float)
+        robot = self.robot
+        robot.transport.exchange = _timed(self.breakdown, 'exchange', robot.transport.exchange)
+        robot.transport2.exchange = _timed(self.breakdown, 'exchange', robot.transport2.exchange)
+        robot.transport2.exchange_batch = _timed(self.breakdown, 'exchange', robot.transport2.exchange_batch)
+        robot.parse_response = _timed(self.breakdown, 'parse_response', robot.parse_response)
+        robot.save_pos_data = _timed(self.breakdown, 'save_pos_data', robot.save_pos_data)
+
+    def close(self):
+        self.robot.close()
+
+    def call(self, name, i):
+        robot = self.robot
+        if name == 'move_j':
+            robot.move_j(*self.poses[i % 2], speed=100)
+        elif name == 'move_l':
+            robot.move_l(*self.poses[i % 2], speed=100)
+        elif name == 'request_pos':
+            robot.request_pos()
+        elif name == 'set_io_teensy':
+            robot.set_io_teensy(1, i % 2 == 0)
+        elif name == 'servo_cmd':
+            robot.servo_cmd(0, 90 if i % 2 else 0)
+        elif name == 'io_single':
+            # the gripper changes of a pick, one exchange each
+            robot.set_io_arduino(8, i % 2 == 0)
+            robot.set_io_arduino(9, i % 2 == 1)
+            robot.servo_cmd(0, 90 if i % 2 else 0)
+            robot.servo_cmd(1, 0 if i % 2 else 90)
+        elif name == 'io_batch':
+            robot.io.batch().output(8, i % 2 == 0).output(9, i % 2 == 1).servo(0, 90 if i % 2 else 0).servo(
+                1, 0 if i % 2 else 90).send()
+        else:
+            raise ValueError("Unknown benchmark command: " + name)
+
+    def measure(self, name, iterations, warmup):
+        for i in range(warmup):
+            self.call(name, i)
+        self.breakdown.clear()
+        wall = np.empty(iterations)
+        cpu_start = time.thread_time()
+        for i in range(iterations):
+            start = time.perf_counter()
+            self.call(name, i)
+            wall[i] = time.perf_counter() - start
+        cpu = time.thread_time() - cpu_start
+        result = {'count': iterations, 'mean_us': wall.mean() * 1e6, 'max_us': wall.max() * 1e6,
+                  'cpu_us': cpu / iterations * 1e6}
+        for percentile, value in zip(PERCENTILES, np.percentile(wall, PERCENTILES)):
+            result['p{}_us'.format(percentile)] = value * 1e6
+        result['breakdown_us'] = {key: value / iterations * 1e6 for key, value in self.breakdown.items()}
+        return result
+
+    def sustained(self, iterations):
+        # all commands in turn, as fast as the API allows
+        count = iterations * len(COMMANDS)
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        for i in range(iterations):
+            for name in COMMANDS:
+                self.call(name, i)
+        seconds = time.perf_counter() - start
+        cpu = time.thread_time() - cpu_start
+        return {'commands': count, 'seconds': seconds, 'commands_per_s': count / seconds, 'cpu_us': cpu / count * 1e6}
+
+
+def run(iterations=500, warmup=20, latency=0.0, time_scale=0.0, persist=AR4_persist.OFF, solve=False,
+        io_latency=0.0):
+    """Runs the benchmark in a temporary directory and returns the results as a JSON compatible dict."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            write_calibration()
+            bench = Bench(latency, time_scale, persist, solve, io_latency)
+            try:
+                commands = {name: bench.measure(name, iterations, warmup) for name in COMMANDS}
+                throughput = bench.sustained(iterations)
+            finally:
+                bench.close()
+        finally:
+            os.chdir(cwd)
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {'iterations': iterations, 'warmup': warmup, 'latency': latency, 'time_scale': time_scale,
+                     'persist': persist, 'solve': solve, 'io_latency': io_latency},
+        'commands': commands,
+        'throughput': throughput,
+    }
+
+
+def compare(results, baseline, tolerance=0.10):
+    # list of regressions of results against baseline, p95 latency or throughput worse by more than tolerance
+    regressions = []
+    for name, current in results['commands'].items():
+        previous = baseline.get('commands', {}).get(name)
+        if previous and current['p95_us'] > previous['p95_us'] * (1.0 + tolerance):
+            regressions.append("{} p95 {:.1f} us, baseline {:.1f} us".format(name, current['p95_us'],
+                                                                            previous['p95_us']))
+    previous = baseline.get('throughput')
+    current = results['throughput']
+    if previous and current['commands_per_s'] < previous['commands_per_s'] * (1.0 - tolerance):
+        regressions.append("throughput {:.0f} commands/s, baseline {:.0f} commands/s".format(
+            current['commands_per_s'], previous['commands_per_s']))
+    return regressions
+
+
+def report(results):
+    print("{:<16}{:>10}{:>10}{:>10}{:>10}{:>10}".format('command', 'p50 us', 'p95 us', 'p99 us', 'mean us', 'cpu us'))
+    for name, result in results['commands'].items():
+        print("{:<16}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+            name, result['p50_us'], result['p95_us'], result['p99_us'], result['mean_us'], result['cpu_us']))
+        print("{:<16}".format('') + "  ".join("{} {:.1f}".format(key, value)
+                                              for key, value in sorted(result['breakdown_us'].items())))
+    throughput = results['throughput']
+    print("sustained {:.0f} commands/s, {:.1f} us cpu per command".format(throughput['commands_per_s'],
+                                                                         throughput['cpu_us']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AR4 command round trip benchmark against the simulator")
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated controller latency in seconds")
+    parser.add_argument('--io-latency', type=float, default=0.0,
+                        help="simulated round trip of the USB link of the IO board in seconds")
+    parser.add_argument('--time-scale', type=float, default=0.0, help="scale of the simulated motion time")
+    parser.add_argument('--persist', choices=(AR4_persist.OFF, AR4_persist.SYNC, AR4_persist.WRITE_BEHIND),
+                        default=AR4_persist.OFF, help="position store policy")
+    parser.add_argument('--solve', action='store_true', help="let the simulator solve the kinematics of moves")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against the results in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations, args.warmup, args.latency, args.time_scale, args.persist, args.solve,
+                  args.io_latency)
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
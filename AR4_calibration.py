@@ -0,0 +1,305 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import json
+import os
+import pickle
+import threading
+
+from AR4_log import logger, fields
+from AR4_state import POSE_KEYS
+
+
+# Calibration file, JSON lines, schema version 1:
+#
+#   {"schema": "ar4-calibration", "version": 1, "sections": ["pose", "robot", "io", "vision", "gui"]}
+#   {"section": "pose", "values": {"J1AngCur": "0.0", ...}}
+#   {"section": "robot", "values": {"TFx": "0", ...}}
+#   ...
+#
+# One line per section, every section holds all keys SECTIONS lists for it, values are strings or numbers like in
+# the calibration dict of AR4. Sections in LAZY_SECTIONS are only decoded when one of their keys is read, a headless
+# controller never parses the vision and GUI settings. Files of a newer version are refused, not guessed at.
+SCHEMA = "ar4-calibration"
+SCHEMA_VERSION = 1
+
+CALIBRATION_PATH = "ARbot.jsonl"
+LEGACY_PATH = "ARbot.cal"
+
+# keys of the legacy ARbot.cal list, in list order
+CALIBRATION_FIELDS = (
+    'J1AngCur', 'J2AngCur', 'J3AngCur', 'J4AngCur', 'J5AngCur', 'J6AngCur', 'XcurPos', 'YcurPos', 'ZcurPos',
+    'RxcurPos', 'RycurPos', 'RzcurPos', 'comPort', 'Prog', 'Servo0on', 'Servo0off', 'Servo1on', 'Servo1off', 'DO1on',
+    'DO1off', 'DO2on', 'DO2off', 'TFx', 'TFy', 'TFz', 'TFrx', 'TFry', 'TFrz', 'J7PosCur', 'J8PosCur', 'J9PosCur',
+    'VisFileLoc', 'VisProg', 'VisOrigXpix', 'VisOrigXmm', 'VisOrigYpix', 'VisOrigYmm', 'VisEndXpix', 'VisEndXmm',
+    'VisEndYpix', 'VisEndYmm', 'J1calOff', 'J2calOff', 'J3calOff', 'J4calOff', 'J5calOff', 'J6calOff', 'J1OpenLoopVal',
+    'J2OpenLoopVal', 'J3OpenLoopVal', 'J4OpenLoopVal', 'J5OpenLoopVal', 'J6OpenLoopVal', 'com2Port', 'curTheme',
+    'J1CalStatVal', 'J2CalStatVal', 'J3CalStatVal', 'J4CalStatVal', 'J5CalStatVal', 'J6CalStatVal', 'J7PosLim',
+    'J7rotation', 'J7steps', 'J7StepCur', 'J1CalStatVal2', 'J2CalStatVal2', 'J3CalStatVal2', 'J4CalStatVal2',
+    'J5CalStatVal2', 'J6CalStatVal2', 'VisBrightVal', 'VisContVal', 'VisBacColor', 'VisScore', 'VisX1Val', 'VisY1Val',
+    'VisX2Val', 'VisY2Val', 'VisRobX1Val', 'VisRobY1Val', 'VisRobX2Val', 'VisRobY2Val', 'zoom', 'pick180Val',
+    'pickClosestVal', 'curCam', 'fullRotVal', 'autoBGVal', 'mX1val', 'mY1val', 'mX2val', 'mY2val', 'J8length',
+    'J8rotation', 'J8steps', 'J9length', 'J9rotation', 'J9steps', 'J7calOff', 'J8calOff', 'J9calOff', 'GC_ST_E1',
+    'GC_ST_E2', 'GC_ST_E3', 'GC_ST_E4', 'GC_ST_E5', 'GC_ST_E6', 'GC_SToff_E1', 'GC_SToff_E2', 'GC_SToff_E3',
+    'GC_SToff_E4', 'GC_SToff_E5', 'GC_SToff_E6', 'DisableWristRotVal', 'J1MotDir', 'J2MotDir', 'J3MotDir', 'J4MotDir',
+    'J5MotDir', 'J6MotDir', 'J7MotDir', 'J8MotDir', 'J9MotDir', 'J1CalDir', 'J2CalDir', 'J3CalDir', 'J4CalDir',
+    'J5CalDir', 'J6CalDir', 'J7CalDir', 'J8CalDir', 'J9CalDir', 'J1PosLim', 'J1NegLim', 'J2PosLim', 'J2NegLim',
+    'J3PosLim', 'J3NegLim', 'J4PosLim', 'J4NegLim', 'J5PosLim', 'J5NegLim', 'J6PosLim', 'J6NegLim', 'J1StepDeg',
+    'J2StepDeg', 'J3StepDeg', 'J4StepDeg', 'J5StepDeg', 'J6StepDeg', 'J1DriveMS', 'J2DriveMS', 'J3DriveMS',
+    'J4DriveMS', 'J5DriveMS', 'J6DriveMS', 'J1EncCPR', 'J2EncCPR', 'J3EncCPR', 'J4EncCPR', 'J5EncCPR', 'J6EncCPR',
+    'J1ΘDHpar', 'J2ΘDHpar', 'J3ΘDHpar', 'J4ΘDHpar', 'J5ΘDHpar', 'J6ΘDHpar', 'J1αDHpar', 'J2αDHpar', 'J3αDHpar',
+    'J4αDHpar', 'J5αDHpar', 'J6αDHpar', 'J1dDHpar', 'J2dDHpar', 'J3dDHpar', 'J4dDHpar', 'J5dDHpar', 'J6dDHpar',
+    'J1aDHpar', 'J2aDHpar', 'J3aDHpar', 'J4aDHpar', 'J5aDHpar', 'J6aDHpar', 'GC_ST_WC',
+)
+
+IO_FIELDS = ('comPort', 'com2Port', 'Prog', 'Servo0on', 'Servo0off', 'Servo1on', 'Servo1off', 'DO1on', 'DO1off',
+             'DO2on', 'DO2off')
+VISION_FIELDS = tuple(key for key in CALIBRATION_FIELDS if key.startswith('Vis')) + (
+    'pick180Val', 'pickClosestVal', 'curCam', 'fullRotVal', 'autoBGVal', 'mX1val', 'mY1val', 'mX2val', 'mY2val')
+GUI_FIELDS = ('curTheme', 'zoom')
+
+SECTIONS = {
+    'pose': POSE_KEYS,
+    'robot': tuple(key for key in CALIBRATION_FIELDS
+                   if key not in POSE_KEYS + IO_FIELDS + VISION_FIELDS + GUI_FIELDS),
+    'io': IO_FIELDS,
+    'vision': VISION_FIELDS,
+    'gui': GUI_FIELDS,
+}
+LAZY_SECTIONS = ('vision', 'gui')
+
+_SECTION_OF = {key: name for name, keys in SECTIONS.items() for key in keys}
+
+
+class CalibrationError(ValueError):
+    pass
+
+
+class Calibration(dict):
+    """Calibration dict of AR4 whose lazy sections are decoded on first access.
+
+    Reading a key, get, in, iterating or copying resolves the section it belongs to, or every pending section
+    when all keys are involved. Keys are set like in a plain dict. Sections are resolved under a lock, another
+    thread finds every key of a section either pending or decoded.
+    """
+
+    def __init__(self, values=(), pending=None, path=None):
+        super().__init__(values)
+        # raw JSON line of every section not decoded yet
+        self._pending = dict(pending or {})
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __missing__(self, key):
+        self._resolve(_SECTION_OF.get(key))
+        # another thread may have resolved the section since the key was looked up
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        self._resolve(_SECTION_OF.get(key))
+        return dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        self._resolve(_SECTION_OF.get(key))
+        return dict.get(self, key, default)
+
+    def __iter__(self):
+        self.resolve_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.resolve_all()
+        return dict.__len__(self)
+
+    def keys(self):
+        self.resolve_all()
+        return dict.keys(self)
+
+    def values(self):
+        self.resolve_all()
+        return dict.values(self)
+
+    def items(self):
+        self.resolve_all()
+        return dict.items(self)
+
+    def copy(self):
+        self.resolve_all()
+        return dict(dict.items(self))
+
+    def __reduce__(self):
+        return dict, (self.copy(),)
+
+    def pending(self):
+        with self._lock:
+            return tuple(self._pending)
+
+    def resolve_all(self):
+        for name in self.pending():
+            self._resolve(name)
+
+    def snapshot(self):
+        """Plain dict of the decoded values and the JSON lines of the pending sections, nothing is decoded."""
+        with self._lock:
+            return dict(dict.items(self)), {name: self.section_line(name) for name in self._pending}
+
+    def _resolve(self, name):
+        if name not in self._pending:
+            return False
+        with self._lock:
+            line = self._pending.get(name)
+            if line is None:
+                return False
+            for key, value in _decode_section(line, name, self.path).items():
+                dict.setdefault(self, key, value)
+            # the keys are in place before the section stops being pending
+            del self._pending[name]
+        return True
+
+    def section_line(self, name):
+        # the JSON line of section name as save writes it, pending sections are passed through undecoded
+        if name in self._pending:
+            return self._pending[name]
+        values = {key: dict.__getitem__(self, key) for key in SECTIONS[name] if dict.__contains__(self, key)}
+        if name == 'robot':
+            # keys outside the schema are kept with the robot settings
+            values.update((key, value) for key, value in dict.items(self) if key not in _SECTION_OF)
+        return json.dumps({'section': name, 'values': values}, ensure_ascii=False)
+
+
+def _error(path, message):
+    return CalibrationError("{}: {}".format(path, message))
+
+
+def _decode_section(line, name, path):
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise _error(path, "section {} is not valid JSON ({})".format(name, e))
+    values = record.get('values') if isinstance(record, dict) else None
+    if not isinstance(values, dict):
+        raise _error(path, "section {} has no values object".format(name))
+    missing = [key for key in SECTIONS[name] if key not in values]
+    if missing:
+        raise _error(path, "section {} is missing {}".format(name, ", ".join(missing)))
+    for key, value in values.items():
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise _error(path, "{} must be a string or a number, not {!r}".format(key, value))
+    return values
+
+
+def load(path=CALIBRATION_PATH):
+    """Reads a calibration file, raises CalibrationError naming the problem when it is missing or invalid."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except OSError as e:
+        raise _error(path, "cannot read calibration file ({})".format(e.strerror or e))
+    try:
+        header = json.loads(lines[0]) if lines else None
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('schema') != SCHEMA:
+        raise _error(path, "not an AR4 calibration file")
+    version = header.get('version')
+    if version != SCHEMA_VERSION:
+        raise _error(path, "schema version {} is not supported, expected {}".format(version, SCHEMA_VERSION))
+    raw = {}
+    for line in lines[1:]:
+        if not line.strip():
+            continue
+        # the section name is read without decoding the line, lazy sections stay raw
+        start = line.find('"section"')
+        name = line[start:line.find(',', start)].partition(':')[2].strip().strip('"') if start >= 0 else ''
+        if name not in SECTIONS:
+            raise _error(path, "unknown section {!r}".format(name or line[:40]))
+        raw[name] = line
+    missing = [name for name in SECTIONS if name not in raw]
+    if missing:
+        raise _error(path, "missing section {}".format(", ".join(missing)))
+    calibration = Calibration(path=path)
+    for name, line in raw.items():
+        if name in LAZY_SECTIONS:
+            calibration._pending[name] = line
+        else:
+            dict.update(calibration, _decode_section(line, name, path))
+    return calibration
+
+
+def save(calibration, path=CALIBRATION_PATH):
+    if not isinstance(calibration, Calibration):
+        calibration = Calibration(calibration)
+    pending = calibration.pending()
+    missing = [key for key in CALIBRATION_FIELDS
+               if _SECTION_OF[key] not in pending and not dict.__contains__(calibration, key)]
+    if missing:
+        raise CalibrationError("calibration is missing {}".format(", ".join(missing)))
+    header = json.dumps({'schema': SCHEMA, 'version': SCHEMA_VERSION, 'sections': list(SECTIONS)})
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding='utf-8') as f:
+        f.write(header + "\n")
+        for name in SECTIONS:
+            f.write(calibration.section_line(name) + "\n")
+    os.replace(tmp_path, path)
+
+
+class _ValuesUnpickler(pickle.Unpickler):
+    # ARbot.cal only holds a list of strings and numbers, refuse anything that would import code
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError("global {}.{} is not allowed in a calibration file".format(module, name))
+
+
+def import_pickle(path=LEGACY_PATH):
+    """Calibration from the pickled list of an ARbot.cal file of the AR4 GUI."""
+    try:
+        with open(path, "rb") as f:
+            values = _ValuesUnpickler(f).load()
+    except OSError as e:
+        raise _error(path, "cannot read calibration file ({})".format(e.strerror or e))
+    except Exception as e:
+        raise _error(path, "not a pickled calibration list ({})".format(e))
+    if not isinstance(values, (list, tuple)):
+        raise _error(path, "holds a {} instead of the calibration list".format(type(values).__name__))
+    if len(values) < len(CALIBRATION_FIELDS):
+        raise _error(path, "holds {} values, expected {}, the file is from an older AR4 GUI or truncated".format(
+            len(values), len(CALIBRATION_FIELDS)))
+    return Calibration(zip(CALIBRATION_FIELDS, values), path=path)
+
+
+def export_pickle(calibration, path=LEGACY_PATH):
+    # writes calibration as the list the AR4 GUI reads
+    with open(path, "wb") as f:
+        pickle.dump([calibration[key] for key in CALIBRATION_FIELDS], f)
+
+
+def load_or_import(path=CALIBRATION_PATH, legacy_path=LEGACY_PATH):
+    """Loads path, or imports legacy_path into it when that does not exist yet or is newer, e.g. after the GUI
+    calibrated the robot."""
+    legacy_time = os.path.getmtime(legacy_path) if legacy_path and os.path.exists(legacy_path) else None
+    if os.path.exists(path) and (legacy_time is None or os.path.getmtime(path) >= legacy_time):
+        return load(path)
+    if legacy_time is None:
+        raise CalibrationError("No calibration found, neither {} nor {} exists. Calibrate with the AR4 GUI or write "
+                               "a default one with AR4_sim.write_calibration".format(path, legacy_path))
+    calibration = import_pickle(legacy_path)
+    try:
+        save(calibration, path)
+        logger.info("Imported calibration", extra=fields(source=legacy_path, path=path))
+    except OSError as e:
+        logger.warning("Unable to save imported calibration", extra=fields(path=path, error=str(e)))
+    return calibration
+
+
+if __name__ == '__main__':
+    # converts an ARbot.cal of the AR4 GUI, python AR4_calibration.py [ARbot.cal] [ARbot.jsonl]
+    import sys
+
+    source = sys.argv[1] if len(sys.argv) > 1 else LEGACY_PATH
+    target = sys.argv[2] if len(sys.argv) > 2 else CALIBRATION_PATH
+    save(import_pickle(source), target)
+    print("{} -> {}".format(source, target))
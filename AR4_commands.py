@@ -0,0 +1,94 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+# Command strings understood by the Teensy and Arduino firmware, shared by AR4 and AsyncAR4.
+
+
+# ------------------------- #
+#  Setup Commands           #
+# ------------------------- #
+def update_params(calibration, config):
+    j1_enc_mult, j2_enc_mult, j3_enc_mult, j4_enc_mult, j5_enc_mult, j6_enc_mult = map(str, config.enc_mult)
+
+    command = ("UP" + "A" + calibration['TFx'] + "B" + calibration['TFy'] + "C" + calibration['TFz']
+               + "D" + calibration['TFrz'] + "E" + calibration['TFry'] + "F" + calibration['TFrx']
+               + "G" + calibration['J1MotDir'] + "H" + calibration['J2MotDir']
+               + "I" + calibration['J3MotDir'] + "J" + calibration['J4MotDir']
+               + "K" + calibration['J5MotDir'] + "L" + calibration['J6MotDir']
+               + "M" + calibration['J7MotDir'] + "N" + calibration['J8MotDir']
+               + "O" + calibration['J9MotDir'] + "P" + calibration['J1CalDir']
+               + "Q" + calibration['J2CalDir'] + "R" + calibration['J3CalDir']
+               + "S" + calibration['J4CalDir'] + "T" + calibration['J5CalDir']
+               + "U" + calibration['J6CalDir'] + "V" + calibration['J7CalDir']
+               + "W" + calibration['J8CalDir'] + "X" + calibration['J9CalDir']
+               + "Y" + calibration['J1PosLim'] + "Z" + calibration['J1NegLim']
+               + "a" + calibration['J2PosLim'] + "b" + calibration['J2NegLim']
+               + "c" + calibration['J3PosLim'] + "d" + calibration['J3NegLim']
+               + "e" + calibration['J4PosLim'] + "f" + calibration['J4NegLim']
+               + "g" + calibration['J5PosLim'] + "h" + calibration['J5NegLim']
+               + "i" + calibration['J6PosLim'] + "j" + calibration['J6NegLim']
+               + "k" + calibration['J1StepDeg'] + "l" + calibration['J2StepDeg']
+               + "m" + calibration['J3StepDeg'] + "n" + calibration['J4StepDeg']
+               + "o" + calibration['J5StepDeg'] + "p" + calibration['J6StepDeg']
+               + "q" + j1_enc_mult + "r" + j2_enc_mult + "s" + j3_enc_mult + "t" + j4_enc_mult + "u" + j5_enc_mult
+               + "v" + j6_enc_mult + "w" + calibration['J1ΘDHpar'] + "x" + calibration['J2ΘDHpar']
+               + "y" + calibration['J3ΘDHpar'] + "z" + calibration['J4ΘDHpar']
+               + "!" + calibration['J5ΘDHpar'] + "@" + calibration['J6ΘDHpar']
+               + "#" + calibration['J1αDHpar'] + "$" + calibration['J2αDHpar']
+               + "%" + calibration['J3αDHpar'] + "^" + calibration['J4αDHpar']
+               + "&" + calibration['J5αDHpar'] + "*" + calibration['J6αDHpar']
+               + "(" + calibration['J1dDHpar'] + ")" + calibration['J2dDHpar']
+               + " + " + calibration['J3dDHpar'] + "=" + calibration['J4dDHpar']
+               + "," + calibration['J5dDHpar'] + "_" + calibration['J6dDHpar']
+               + "<" + calibration['J1aDHpar'] + ">" + calibration['J2aDHpar']
+               + "?" + calibration['J3aDHpar'] + "{" + calibration['J4aDHpar']
+               + "}" + calibration['J5aDHpar'] + "~" + calibration['J6aDHpar'] + "\n")
+    return command
+
+
+def send_pos(pose):
+    command = ("SP" + "A" + str(pose[0]) + "B" + str(pose[1]) + "C" + str(pose[2])
+               + "D" + str(pose[3]) + "E" + str(pose[4]) + "F" + str(pose[5])
+               + "G" + str(pose[12]) + "H" + str(pose[13]) + "I" + str(pose[14]) + "\n")
+    return command
+
+
+# ---------------------------- #
+#  Calibration Commands        #
+# ---------------------------- #
+# flags holds one '0' or '1' per joint J1 to J9 and selects the joints driven to their limit switch
+def calibrate(calibration, flags):
+    command = ("LL" + "A" + str(flags[0]) + "B" + str(flags[1]) + "C" + str(flags[2])
+               + "D" + str(flags[3]) + "E" + str(flags[4]) + "F" + str(flags[5])
+               + "G" + str(flags[6]) + "H" + str(flags[7]) + "I" + str(flags[8])
+               + "J" + str(calibration['J1calOff']) + "K" + str(calibration['J2calOff'])
+               + "L" + str(calibration['J3calOff']) + "M" + str(calibration['J4calOff'])
+               + "N" + str(calibration['J5calOff']) + "O" + str(calibration['J6calOff'])
+               + "P" + str(calibration['J7calOff']) + "Q" + str(calibration['J8calOff'])
+               + "R" + str(calibration['J9calOff']) + "\n")
+    return command
+
+
+def cal_stage_flags(calibration, stage):
+    suffix = 'CalStatVal' if stage == 1 else 'CalStatVal2'
+    return [calibration['J' + str(joint) + suffix] for joint in range(1, 7)] + [0, 0, 0]
+
+
+# ----------------------- #
+#  IO Commands            #
+# ----------------------- #
+def set_output(output, state):
+    if state:
+        return "ONX" + str(output) + "\n"
+    return "OFX" + str(output) + "\n"
+
+
+def servo(number, position):
+    return "SV" + str(number) + "P" + str(position) + "\n"
+
+
+def set_tcp(x, y, z, rx, ry, rz):
+    return "TFA{:.3f}B{:.3f}C{:.3f}D{:.3f}E{:.3f}F{:.3f}\n".format(x, y, z, rz, ry, rx)
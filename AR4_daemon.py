@@ -0,0 +1,428 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+from AR4_log import logger, fields
+
+
+# Requests and replies are JSON lines on a Unix or TCP socket:
+#   {"id": 7, "method": "move_j", "args": [...], "kwargs": {...}, "priority": 0}
+#   {"id": 7, "result": "A..."}  or  {"id": 7, "error": "...", "type": "OutOfReach"}
+# subscribers also get {"event": "pose", "sample": {...}} lines with every telemetry sample.
+
+# the AR4 methods clients may call, run one at a time by the worker of the daemon
+METHODS = frozenset((
+    'move_j', 'move_l', 'move_r', 'move_a', 'move_c', 'request_pos', 'correct_pos', 'send_pos',
+    'cal_robot_all', 'cal_robot_joint', 'cal_robot_warm', 'set_io_arduino', 'set_io_teensy', 'servo_cmd',
+    'set_tcp', 'start_spline', 'end_spline', 'set_joint_open_loop', 'set_joint_closed_loop', 'test_limit_switches',
+    'read_encoders', 'solve', 'update_params',
+))
+# handled by the daemon itself, acquire waits in the queue like a move
+CONTROL = frozenset(('acquire', 'release', 'subscribe', 'unsubscribe', 'status'))
+
+DEFAULT_ADDRESS = ('127.0.0.1', 5004)
+
+
+class DaemonError(RuntimeError):
+    # an error reply, kind is the name of the exception raised in the daemon
+
+    def __init__(self, message, kind=None):
+        super().__init__(message)
+        self.kind = kind
+
+
+def _plain(value):
+    # numpy values and tuples of AR4 results as JSON
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("Not JSON serializable: " + type(value).__name__)
+
+
+class _Client(object):
+    # one connection, replies from the worker, the broadcaster and its handler are written under lock
+
+    def __init__(self, daemon, wfile, name):
+        self.daemon = daemon
+        self.wfile = wfile
+        self.name = name
+        self.subscribed = False
+        self.connected = True
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        data = (json.dumps(message, default=_plain, separators=(',', ':')) + '\n').encode()
+        with self.lock:
+            if not self.connected:
+                return
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                self.connected = False
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        daemon = self.server.robot_daemon
+        client = daemon._connect(self.wfile, str(self.client_address or 'unix'))
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request is not an object")
+                except ValueError as e:
+                    client.send({'id': None, 'error': "Malformed request: " + str(e), 'type': 'ValueError'})
+                    continue
+                daemon._receive(client, request)
+        finally:
+            daemon._disconnect(client)
+
+
+class RobotDaemon(object):
+    """Owns an opened AR4 and serves it to local clients over a Unix socket or TCP.
+
+    address is the path of a Unix socket or a (host, port) tuple. Requests of all clients go into one queue and
+    a single worker runs them on the robot, the highest priority first, in arrival order within a priority. A
+    client that acquires the robot is the only one served until it releases it or disconnects, the requests of
+    the others wait in the queue. Subscribers get every telemetry sample, polled at telemetry_hz.
+    """
+
+    def __init__(self, robot, address=DEFAULT_ADDRESS, telemetry_hz=20):
+        self.robot = robot
+        self.address = address
+        self.telemetry_hz = telemetry_hz
+        self.owner = None
+        self.clients = []
+        self._queue = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._server = None
+        self._threads = []
+
+    def start(self):
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self._server = socketserver.ThreadingUnixStreamServer(self.address, _Handler)
+        else:
+            self._server = socketserver.ThreadingTCPServer(self.address, _Handler, bind_and_activate=False)
+            self._server.allow_reuse_address = True
+            self._server.server_bind()
+            self._server.server_activate()
+            # the port the system picked when the address asked for port 0
+            self.address = self._server.server_address
+        self._server.daemon_threads = True
+        self._server.robot_daemon = self
+        self._running = True
+        if self.telemetry_hz and self.robot.telemetry is None:
+            self.robot.start_telemetry(self.telemetry_hz)
+        for target, name in ((self._server.serve_forever, "AR4-daemon"), (self._work, "AR4-daemon-worker"),
+                             (self._broadcast, "AR4-daemon-telemetry")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Daemon serving", extra=fields(address=str(self.address)))
+        return self
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._threads[1].join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    # ------------------------- #
+    #  Requests                 #
+    # ------------------------- #
+    def _connect(self, wfile, name):
+        client = _Client(self, wfile, name)
+        with self._cond:
+            self.clients.append(client)
+        return client
+
+    def _disconnect(self, client):
+        # the queued requests of a client that left are dropped, its hold on the robot released
+        with client.lock:
+            client.connected = False
+        with self._cond:
+            self.clients.remove(client)
+            self._queue = [entry for entry in self._queue if entry[2] is not client]
+            if self.owner is client:
+                self.owner = None
+                logger.info("Robot released, client disconnected", extra=fields(client=client.name))
+            self._cond.notify_all()
+
+    def _receive(self, client, request):
+        request_id = request.get('id')
+        method = request.get('method')
+        if method not in METHODS and method not in CONTROL:
+            client.send({'id': request_id, 'error': "Unknown method: " + str(method), 'type': 'ValueError'})
+            return
+        if method in CONTROL and method != 'acquire':
+            client.send({'id': request_id, 'result': self._control(client, method)})
+            return
+        try:
+            priority = int(request.get('priority', 0))
+        except (TypeError, ValueError):
+            client.send({'id': request_id, 'error': "priority must be an integer", 'type': 'ValueError'})
+            return
+        with self._cond:
+            self._queue.append((-priority, next(self._sequence), client, request))
+            self._cond.notify_all()
+
+    def _control(self, client, method):
+        with self._cond:
+            if method == 'release':
+                if self.owner is client:
+                    self.owner = None
+                    self._cond.notify_all()
+                return True
+            if method == 'status':
+                return {'clients': len(self.clients), 'queued': len(self._queue),
+                        'owner': self.owner.name if self.owner is not None else None}
+        client.subscribed = method == 'subscribe'
+        return True
+
+    def _next(self):
+        # the first request of the owner, or of anyone when nobody holds the robot, by priority and arrival
+        runnable = [entry for entry in self._queue if self.owner is None or entry[2] is self.owner]
+        if not runnable:
+            return None
+        entry = min(runnable, key=lambda item: (item[0], item[1]))
+        self._queue.remove(entry)
+        return entry
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: not self._running or self._next_ready())
+                if not self._running:
+                    return
+                _, _, client, request = self._next()
+                if request['method'] == 'acquire':
+                    self.owner = client
+            self._run(client, request)
+
+    def _next_ready(self):
+        return any(self.owner is None or entry[2] is self.owner for entry in self._queue)
+
+    def _run(self, client, request):
+        request_id = request.get('id')
+        method = request['method']
+        if method == 'acquire':
+            client.send({'id': request_id, 'result': True})
+            return
+        try:
+            result = getattr(self.robot, method)(*request.get('args', ()), **request.get('kwargs', {}))
+            if isinstance(result, Future):
+                # a command queued on the pipeline of the robot, the client gets its reply
+                result = result.result()
+            client.send({'id': request_id, 'result': result})
+        except Exception as e:
+            logger.warning("Daemon request failed", extra=fields(client=client.name, method=method, error=str(e)))
+            client.send({'id': request_id, 'error': str(e), 'type': type(e).__name__})
+
+    def _broadcast(self):
+        # one thread hands every telemetry sample to all subscribers
+        while self._running:
+            telemetry = self.robot.telemetry
+            if telemetry is None:
+                with self._cond:
+                    self._cond.wait(.5)
+                continue
+            for sample in telemetry.stream(timeout=.5):
+                message = {'event': 'pose', 'sample': sample._asdict()}
+                for client in list(self.clients):
+                    if client.subscribed:
+                        client.send(message)
+                if not self._running:
+                    return
+
+
+class AR4Client(object):
+    """Connection to a RobotDaemon, the AR4 methods in METHODS are called on it like on the robot.
+
+    Every call blocks until the daemon answered, submit returns a Future instead. priority orders the requests
+    of all clients waiting for the robot, acquire holds the robot for this client only until release. An error
+    in the daemon raises DaemonError with the name of the exception in kind.
+
+        with AR4Client("/tmp/ar4.sock") as robot:
+            robot.move_j(362.295, 148.723, 152.148, 179.997, 0.058, 179.990, speed=40)
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, priority=0, timeout=None):
+        self.priority = priority
+        self.timeout = timeout
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(address)
+        else:
+            self._socket = socket.create_connection(address)
+        self._rfile = self._socket.makefile('rb')
+        self._wfile = self._socket.makefile('wb')
+        self._ids = itertools.count(1)
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._samples = None
+        self._reader = threading.Thread(target=self._read, name="AR4-client", daemon=True)
+        self._reader.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __getattr__(self, name):
+        if name not in METHODS:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+    def submit(self, method, *args, priority=None, **kwargs):
+        request_id = next(self._ids)
+        future = Future()
+        request = {'id': request_id, 'method': method, 'args': args, 'kwargs': kwargs,
+                   'priority': self.priority if priority is None else priority}
+        data = (json.dumps(request, default=_plain, separators=(',', ':')) + '\n').encode()
+        with self._lock:
+            self._futures[request_id] = future
+            self._wfile.write(data)
+            self._wfile.flush()
+        return future
+
+    def call(self, method, *args, priority=None, **kwargs):
+        return self.submit(method, *args, priority=priority, **kwargs).result(self.timeout)
+
+    def acquire(self, priority=None):
+        return self.call('acquire', priority=priority)
+
+    def release(self):
+        return self.call('release')
+
+    def status(self):
+        return self.call('status')
+
+    def subscribe(self, timeout=None):
+        """Generator of the telemetry samples broadcast by the daemon, as dicts, ends after timeout without one."""
+        self._samples = queue.Queue()
+        self.call('subscribe')
+        try:
+            while True:
+                try:
+                    sample = self._samples.get(timeout=timeout)
+                except queue.Empty:
+                    return
+                if sample is None:
+                    return
+                yield sample
+        finally:
+            self._samples = None
+            if self._reader.is_alive():
+                self.call('unsubscribe')
+
+    def close(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.join()
+        self._rfile.close()
+        self._wfile.close()
+        self._socket.close()
+
+    def _read(self):
+        try:
+            for line in self._rfile:
+                message = json.loads(line)
+                if 'event' in message:
+                    samples = self._samples
+                    if samples is not None:
+                        samples.put(message['sample'])
+                    continue
+                with self._lock:
+                    future = self._futures.pop(message.get('id'), None)
+                if future is None:
+                    continue
+                if 'error' in message:
+                    future.set_exception(DaemonError(message['error'], message.get('type')))
+                else:
+                    future.set_result(message.get('result'))
+        except (OSError, ValueError):
+            pass
+        finally:
+            # the daemon went away, nothing pending will be answered
+            with self._lock:
+                futures, self._futures = self._futures, {}
+            for future in futures.values():
+                future.set_exception(DaemonError("Connection to the daemon closed"))
+            if self._samples is not None:
+                self._samples.put(None)
+
+
+if __name__ == '__main__':
+    # python AR4_daemon.py COM3 --unix /tmp/ar4.sock --warm --calibrate warm
+    import argparse
+    import logging
+
+    from AR4_api import AR4
+
+    parser = argparse.ArgumentParser(description="Serve an AR4 to local clients")
+    parser.add_argument('port', help="serial port of the Teensy")
+    parser.add_argument('--gripper', help="serial port of the Arduino IO board")
+    parser.add_argument('--unix', help="path of the Unix socket to serve on, instead of TCP")
+    parser.add_argument('--tcp', default="{}:{}".format(*DEFAULT_ADDRESS), help="host:port to serve on")
+    parser.add_argument('--warm', action='store_true', help="open with a warm start")
+    parser.add_argument('--calibrate', choices=('none', 'warm', 'full'), default='none')
+    parser.add_argument('--telemetry-hz', type=float, default=20)
+    parser.add_argument('--log-file', default="AR4.log")
+    args = parser.parse_args()
+
+    robot = AR4(args.port, log_file=args.log_file, log_level=logging.INFO)
+    robot.open(warm=args.warm)
+    if args.gripper:
+        robot.set_com_gripper(args.gripper)
+    if args.calibrate == 'warm':
+        robot.cal_robot_warm()
+    elif args.calibrate == 'full':
+        robot.cal_robot_all()
+    host, _, tcp_port = args.tcp.rpartition(':')
+    daemon = RobotDaemon(robot, args.unix or (host, int(tcp_port)), args.telemetry_hz)
+    try:
+        daemon.serve_forever()
+    finally:
+        robot.close()
@@ -0,0 +1,145 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import functools
+
+import AR4_commands
+
+
+# The commands of the AR4 as bytes, ready for the port.
+#
+# A move is one bytes % template for the coordinates, formatted straight into bytes, and a memoized suffix with
+# the speed, ramp, wrist and loop mode fields, which hardly ever change between moves. The output, servo and UP
+# commands memoize the AR4_commands builders, python AR4_encoding.py compares the speed of both. The caches are
+# typed: 25 and 25.0, or True and 1, format differently and must not share an entry.
+
+_MOVE_J = b"MJX%.3fY%.3fZ%.3fRz%.3fRy%.3fRx%.3fJ7%.3fJ8%.3fJ9%.3f%s"
+_MOVE_L = b"MLX%.3fY%.3fZ%.3fRz%.3fRy%.3fRx%.3fJ7%.3fJ8%.3fJ9%.3f%s"
+_MOVE_R = b"RJA%.3fB%.3fC%.3fD%.3fE%.3fF%.3fJ7%.3fJ8%.3fJ9%.3f%s"
+_MOVE_C_START = b"MJX%.3fY%.3fZ%.3fRz%.3fRy%.3fRx%.3fTr%.3f%s"
+_MOVE_C = b"MCCx%.3fCy%.3fCz%.3fRz%.3fRy%.3fRx%.3fBx%.3fBy%.3fBz%.3fPx%.3fPy%.3fPz%.3fTr%.3f%s"
+_MOVE_A = b"MAX%.3fY%.3fZ%.3fRz%.3fRy%.3fRx%.3fEx%.3fEy%.3fEz%.3fTr%.3f%s"
+
+# the UP command only changes when the calibration does
+_UPDATE_KEYS = ('TFx', 'TFy', 'TFz', 'TFrz', 'TFry', 'TFrx') + tuple(
+    template.format(joint) for template in ('J{}MotDir', 'J{}CalDir') for joint in range(1, 10)) + tuple(
+    key.format(joint) for joint in range(1, 7) for key in ('J{}PosLim', 'J{}NegLim')) + tuple(
+    template.format(joint) for template in ('J{}StepDeg', 'J{}ΘDHpar', 'J{}αDHpar', 'J{}dDHpar', 'J{}aDHpar')
+    for joint in range(1, 7))
+
+
+@functools.lru_cache(maxsize=256, typed=True)
+def _suffix(spd_prefix, speed, acceleration, deceleration, acc_ramp, wrist_config, loop_mode):
+    return (spd_prefix + str(speed) + "Ac" + str(acceleration) + "Dc" + str(deceleration) + "Rm" + str(acc_ramp)
+            + "W" + wrist_config + "Lm" + loop_mode + "\n").encode()
+
+
+@functools.lru_cache(maxsize=256, typed=True)
+def _suffix_l(spd_prefix, speed, acceleration, deceleration, acc_ramp, rnd, wrist_config, dis_wrist, loop_mode):
+    return (spd_prefix + str(speed) + "Ac" + str(acceleration) + "Dc" + str(deceleration) + "Rm" + str(acc_ramp)
+            + "Rnd" + str(rnd) + "W" + wrist_config + "Lm" + loop_mode + "Q" + str(int(dis_wrist is True))
+            + "\n").encode()
+
+
+def move_j(x, y, z, rx, ry, rz, j7=0.0, j8=0.0, j9=0.0,
+           spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100, wrist_config='F', loop_mode=''):
+    return _MOVE_J % (x, y, z, rz, ry, rx, j7, j8, j9,
+                      _suffix(spd_prefix, speed, acceleration, deceleration, acc_ramp, wrist_config, loop_mode))
+
+
+def move_l(x, y, z, rx, ry, rz, j7=0.0, j8=0.0, j9=0.0,
+           spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100,
+           rnd=0, wrist_config='F', dis_wrist=False, loop_mode=''):
+    return _MOVE_L % (x, y, z, rz, ry, rx, j7, j8, j9, _suffix_l(spd_prefix, speed, acceleration, deceleration,
+                                                                 acc_ramp, rnd, wrist_config, dis_wrist, loop_mode))
+
+
+def move_r(j1, j2, j3, j4, j5, j6, j7=0.0, j8=0.0, j9=0.0,
+           spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100, wrist_config='F', loop_mode=''):
+    return _MOVE_R % (j1, j2, j3, j4, j5, j6, j7, j8, j9,
+                      _suffix(spd_prefix, speed, acceleration, deceleration, acc_ramp, wrist_config, loop_mode))
+
+
+def move_c_start(rx, ry, rz, x_start, y_start, z_start, tr_val,
+                 spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100, wrist_config='F',
+                 loop_mode=''):
+    return _MOVE_C_START % (x_start, y_start, z_start, rz, ry, rx, tr_val,
+                            _suffix(spd_prefix, speed, acceleration, deceleration, acc_ramp, wrist_config, loop_mode))
+
+
+def move_c(x_center, y_center, z_center, rx, ry, rz,
+           x_start, y_start, z_start, x_plain, y_plain, z_plain, tr_val,
+           spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100, wrist_config='F', loop_mode=''):
+    return _MOVE_C % (x_center, y_center, z_center, rz, ry, rx, x_start, y_start, z_start, x_plain, y_plain,
+                      z_plain, tr_val,
+                      _suffix(spd_prefix, speed, acceleration, deceleration, acc_ramp, wrist_config, loop_mode))
+
+
+def move_a(x, y, z, rx, ry, rz, x_end, y_end, z_end, tr_val,
+           spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100, wrist_config='F', loop_mode=''):
+    return _MOVE_A % (x, y, z, rz, ry, rx, x_end, y_end, z_end, tr_val,
+                      _suffix(spd_prefix, speed, acceleration, deceleration, acc_ramp, wrist_config, loop_mode))
+
+
+@functools.lru_cache(maxsize=64, typed=True)
+def set_output(output, state):
+    return AR4_commands.set_output(output, state).encode()
+
+
+@functools.lru_cache(maxsize=1024, typed=True)
+def servo(number, position):
+    return AR4_commands.servo(number, position).encode()
+
+
+@functools.lru_cache(maxsize=8, typed=True)
+def _update_params(values, enc_mult):
+    calibration = dict(zip(_UPDATE_KEYS, values))
+    return AR4_commands.update_params(calibration, _EncoderMultipliers(enc_mult)).encode()
+
+
+class _EncoderMultipliers(object):
+    # the only field of RobotConfig update_params reads
+    def __init__(self, enc_mult):
+        self.enc_mult = enc_mult
+
+
+def update_params(calibration, config):
+    return _update_params(tuple(calibration[key] for key in _UPDATE_KEYS), config.enc_mult)
+
+
+if __name__ == '__main__':
+    # cost of encoding one command, against the string builder of AR4_commands where there is one
+    import timeit
+
+    from AR4_sim import default_calibration
+    from AR4_calibration import CALIBRATION_FIELDS
+    from AR4_state import RobotConfig
+
+    pose = (362.295, 148.723, 152.148, 179.997, 0.058, 179.990)
+    calibration = dict(zip(CALIBRATION_FIELDS, default_calibration()))
+    config = RobotConfig.from_calibration(calibration)
+    cases = (
+        ('move_j', pose + (0.0, 0.0, 0.0, 'Sp', 40, 20, 20, 100, 'F', '000000')),
+        ('move_l', pose + (0.0, 0.0, 0.0, 'Sp', 25, 20, 20, 100, 0, 'F', False, '000000')),
+        ('move_r', (10.0, 20.0, -30.0, 0.0, 50.0, 5.0, 0.0, 0.0, 0.0, 'Sp', 30, 20, 20, 100, 'F', '000000')),
+        ('move_a', pose + (300.0, 100.0, 150.0, 0.0, 'Sp', 25, 20, 20, 100, 'F', '000000')),
+        ('set_output', (8, True)),
+        ('servo', (0, 90)),
+        ('update_params', (calibration, config)),
+    )
+    number = 100000
+    print("{:<16}{:>12}{:>12}".format('command', 'string us', 'encoded us'))
+    for name, args in cases:
+        builder = getattr(AR4_commands, name, None)
+        encoder = globals()[name]
+        count = number // 10 if name == 'update_params' else number
+        encoded = min(timeit.repeat(lambda: encoder(*args), number=count, repeat=5)) / count
+        if builder is None:
+            print("{:<16}{:>12}{:>12.3f}".format(name, '-', encoded * 1e6))
+            continue
+        assert builder(*args).encode() == encoder(*args), name
+        string = min(timeit.repeat(lambda: builder(*args).encode(), number=count, repeat=5)) / count
+        print("{:<16}{:>12.3f}{:>12.3f}".format(name, string * 1e6, encoded * 1e6))
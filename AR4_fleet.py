@@ -0,0 +1,184 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import AR4_api
+import AR4_log
+from AR4_calibration import CALIBRATION_PATH, LEGACY_PATH
+from AR4_log import logger, fields
+from AR4_parser import is_fault
+
+
+# the thread name tells the robots apart in the shared log, every robot runs its commands on "AR4-<name>"
+FLEET_FORMAT = '%(asctime)s,%(msecs)d %(threadName)s %(levelname)s %(message)s'
+
+
+class FleetHalted(RuntimeError):
+    pass
+
+
+class _Arm(object):
+    # one robot with the worker thread that runs its command stream in submission order
+
+    def __init__(self, name, robot):
+        self.name = name
+        self.robot = robot
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AR4-" + name)
+        self.fault = None
+
+
+class Fleet(object):
+    """Several AR4 arms driven concurrently from one process.
+
+    Every robot gets a directory of its own below directory for its calibration and position files and a worker
+    thread that runs its commands in the order they are submitted, so the serial round trips of different arms
+    overlap while the commands of one arm stay sequential. submit returns a Future like MotionPipeline.submit.
+
+    barrier queues a synchronization point on several arms, the commands submitted after it only start when
+    every arm reached it, e.g. to start a coordinated move at the same time. When a command of an arm raises or
+    gets an error reply its stream halts: the commands still queued raise FleetHalted and open barriers are
+    broken, so the other arms do not continue a coordinated sequence without it. clear resumes the arm.
+    """
+
+    def __init__(self, directory=".", log_file="fleet.log", log_level=logging.INFO, barrier_timeout=None):
+        self.directory = directory
+        self.barrier_timeout = barrier_timeout
+        self.arms = {}
+        self._barriers = []
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        if log_file:
+            AR4_log.start(os.path.join(directory, log_file), log_level, file_format=FLEET_FORMAT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __getitem__(self, name):
+        return self.arms[name].robot
+
+    def names(self):
+        return list(self.arms)
+
+    def add(self, name, port, **kwargs):
+        """Adds an AR4 on port whose files live in directory/name, kwargs go to AR4."""
+        if name in self.arms:
+            raise ValueError("Robot already in fleet: " + name)
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, exist_ok=True)
+        kwargs.setdefault('calibration_path', os.path.join(path, CALIBRATION_PATH))
+        kwargs.setdefault('legacy_calibration_path', os.path.join(path, LEGACY_PATH))
+        kwargs.setdefault('position_path', os.path.join(path, "ARbot2.cal"))
+        robot = AR4_api.AR4(port, log_file=None, **kwargs)
+        self.arms[name] = _Arm(name, robot)
+        return robot
+
+    # ------------------------- #
+    #  Command streams          #
+    # ------------------------- #
+    def submit(self, name, method, *args, **kwargs):
+        """Queues robot.method(*args, **kwargs) on the worker of name, method may also be a callable taking
+        the robot as its first argument. Returns a Future of the result."""
+        arm = self.arms[name]
+        function = method if callable(method) else getattr(arm.robot, method)
+        if callable(method):
+            args = (arm.robot,) + args
+        return arm.executor.submit(self._run, arm, function, args, kwargs)
+
+    def broadcast(self, method, *args, names=None, **kwargs):
+        # the same call queued on every arm, dict of futures by name
+        return {name: self.submit(name, method, *args, **kwargs) for name in names or self.arms}
+
+    def run(self, streams):
+        """Queues a list of (method, args, kwargs) calls per name, all arms in parallel, returns the futures."""
+        futures = {}
+        for name, calls in streams.items():
+            futures[name] = [self.submit(name, method, *args, **(kwargs or {})) for method, args, kwargs in calls]
+        return futures
+
+    def barrier(self, names=None):
+        """Synchronization point on names, all arms by default, returns the futures of the waits."""
+        names = list(names or self.arms)
+        barrier = threading.Barrier(len(names))
+        with self._lock:
+            self._barriers.append((frozenset(names), barrier))
+        return {name: self.arms[name].executor.submit(self._wait, self.arms[name], barrier) for name in names}
+
+    def join(self, names=None, timeout=None):
+        # waits until every command queued so far on names has finished
+        futures = [self.arms[name].executor.submit(lambda: None) for name in names or self.arms]
+        done, pending = wait(futures, timeout)
+        return not pending
+
+    def open(self, warm=False, sers=None):
+        """Opens all robots in parallel, sers maps names to serial objects replacing their ports."""
+        sers = sers or {}
+        futures = {name: self.submit(name, 'open', sers.get(name), warm) for name in self.arms}
+        for future in futures.values():
+            future.result()
+
+    def close(self):
+        for arm in self.arms.values():
+            arm.executor.submit(arm.robot.close)
+        for arm in self.arms.values():
+            arm.executor.shutdown(wait=True)
+        self._break_barriers()
+
+    def clear(self, name=None):
+        # resumes halted arms, commands queued while halted were already failed
+        for arm in ([self.arms[name]] if name else self.arms.values()):
+            arm.fault = None
+
+    def faults(self):
+        return {name: arm.fault for name, arm in self.arms.items() if arm.fault is not None}
+
+    def _run(self, arm, function, args, kwargs):
+        if arm.fault is not None:
+            raise FleetHalted("{} halted after: {}".format(arm.name, arm.fault))
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            self._halt(arm, e)
+            raise
+        # error replies are handled by error_handler and returned, the arm halts on them all the same
+        if isinstance(result, str) and is_fault(result):
+            self._halt(arm, result)
+        return result
+
+    def _halt(self, arm, fault):
+        arm.fault = fault
+        logger.error("Fleet command failed, halting the robot", extra=fields(robot=arm.name, fault=str(fault)))
+        self._break_barriers(arm.name)
+
+    def _wait(self, arm, barrier):
+        try:
+            if arm.fault is not None:
+                raise FleetHalted("{} halted after: {}".format(arm.name, arm.fault))
+            barrier.wait(self.barrier_timeout)
+        except Exception as e:
+            if arm.fault is None:
+                arm.fault = e
+            barrier.abort()
+            raise
+        finally:
+            # passed or broken, either way no arm waits on it any more
+            if barrier.broken or barrier.n_waiting == 0:
+                with self._lock:
+                    self._barriers = [entry for entry in self._barriers if entry[1] is not barrier]
+
+    def _break_barriers(self, name=None):
+        # aborts the open barriers of name, or all, so the arms waiting on them halt instead of moving alone
+        with self._lock:
+            broken = [entry for entry in self._barriers if name is None or name in entry[0]]
+            self._barriers = [entry for entry in self._barriers if entry not in broken]
+        for names, barrier in broken:
+            barrier.abort()
@@ -0,0 +1,336 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import collections
+import math
+import re
+
+import numpy as np
+
+import AR4_encoding
+from AR4_log import logger, fields
+from AR4_parser import is_fault
+from AR4_state import RZ
+
+
+RAPID = 'rapid'
+LINEAR = 'linear'
+ARC = 'arc'
+
+SPLINE_START = b"SL\n"
+SPLINE_END = b"SS\n"
+
+# one parsed motion, end and mid are x, y, z in mm in G-code coordinates, mid only for arcs, feed in mm/min
+Move = collections.namedtuple('Move', ('kind', 'end', 'mid', 'feed', 'line'))
+
+_WORD_RE = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+_COMMENT_RE = re.compile(r'\([^)]*\)|;.*')
+
+# G codes that neither move nor change how the coordinates are read: plane XY, dwell, feed per minute, work offset
+# selection. Any other code is refused when its line has axis words, those would otherwise move the arm.
+_IGNORED_CODES = (4, 17, 40, 49, 54, 55, 56, 57, 58, 59, 80, 94)
+# reference point moves, they move the arm without axis words
+_HOMING_CODES = (28, 30)
+
+# largest difference in mm between the distances of the start and the end of an I/J arc to its centre
+ARC_RADIUS_TOLERANCE = .05
+
+
+class GCodeError(ValueError):
+    pass
+
+
+class GCodeAborted(RuntimeError):
+    # the controller reported an error, line is the G-code line of the move, response its reply
+
+    def __init__(self, line, response):
+        super().__init__("G-code aborted at line {}: {}".format(line, response))
+        self.line = line
+        self.response = response
+
+
+# ------------------------- #
+#  Parsing                  #
+# ------------------------- #
+def read(path):
+    """Moves of a G-code file, parsed one line at a time while they are consumed."""
+    with open(path) as f:
+        yield from parse(f)
+
+
+def parse(lines):
+    """Generator of the Moves of G-code lines, an iterable of strings.
+
+    Supports G0 to G3 in the XY plane (G17), arcs by I and J or by R, G20 and G21 units, G90 and G91 positioning,
+    G92 and G92.1 coordinate offsets and F feeds in units per minute. Words that do not move the arm, M, S, T, N,
+    dwells and tool changes, are ignored. Full circles are split in two half arcs. Raises GCodeError naming the line
+    of anything it cannot translate, an unsupported G code with axis words among them.
+    """
+    position = [0.0, 0.0, 0.0]
+    # G92 offset, position minus the coordinates the program uses for it
+    offset = [0.0, 0.0, 0.0]
+    motion = None
+    scale = 1.0
+    relative = False
+    feed = None
+    for number, text in enumerate(lines, start=1):
+        words = _WORD_RE.findall(_COMMENT_RE.sub('', text).upper())
+        if not words:
+            continue
+        values = {}
+        unsupported = []
+        set_offset = False
+        for letter, value in words:
+            if letter == 'G':
+                code = float(value)
+                if code in (0, 1, 2, 3):
+                    motion = int(code)
+                elif code == 20:
+                    scale = 25.4
+                elif code == 21:
+                    scale = 1.0
+                elif code == 90:
+                    relative = False
+                elif code == 91:
+                    relative = True
+                elif code == 92:
+                    set_offset = True
+                elif code == 92.1:
+                    offset = [0.0, 0.0, 0.0]
+                elif code in (18, 19):
+                    raise GCodeError("line {}: only arcs in the XY plane (G17) are supported".format(number))
+                elif code in _HOMING_CODES:
+                    raise GCodeError("line {}: G{} moves to a reference point, which is not supported".format(
+                        number, value))
+                elif code not in _IGNORED_CODES:
+                    unsupported.append(value)
+            else:
+                values[letter] = float(value)
+        if 'F' in values:
+            feed = values['F'] * scale
+        axes = [axis for axis in 'XYZ' if axis in values]
+        if unsupported and axes:
+            raise GCodeError("line {}: G{} with axis words is not supported".format(number, ", G".join(unsupported)))
+        if set_offset:
+            # the current position gets the given coordinates, nothing moves
+            for index, axis in enumerate('XYZ'):
+                if axis in values:
+                    offset[index] = position[index] - values[axis] * scale
+            continue
+        if motion is None or not axes:
+            continue
+        start = list(position)
+        for index, axis in enumerate('XYZ'):
+            if axis in values:
+                position[index] = (start[index] if relative else offset[index]) + values[axis] * scale
+        end = tuple(position)
+        if motion == 0:
+            yield Move(RAPID, end, None, None, number)
+        elif motion == 1:
+            yield Move(LINEAR, end, None, feed, number)
+        else:
+            for move in _arc(start, end, values, scale, motion == 2, feed, number):
+                yield move
+
+
+def _arc(start, end, values, scale, clockwise, feed, number):
+    # the centre from I and J or from R, then one or two arcs given by their mid points
+    if 'I' in values or 'J' in values:
+        cx, cy = start[0] + values.get('I', 0.0) * scale, start[1] + values.get('J', 0.0) * scale
+        radius = math.hypot(start[0] - cx, start[1] - cy)
+        if radius == 0 or abs(math.hypot(end[0] - cx, end[1] - cy) - radius) > ARC_RADIUS_TOLERANCE:
+            raise GCodeError("line {}: the end point of the arc is not on its circle of radius {:.3f}".format(
+                number, radius))
+    elif 'R' in values:
+        cx, cy = _centre(start, end, values['R'] * scale, clockwise, number)
+        radius = math.hypot(start[0] - cx, start[1] - cy)
+    else:
+        raise GCodeError("line {}: arc without I, J or R".format(number))
+    begin = math.atan2(start[1] - cy, start[0] - cx)
+    sweep = math.atan2(end[1] - cy, end[0] - cx) - begin
+    if clockwise:
+        sweep = sweep % -(2 * math.pi) or -2 * math.pi
+    else:
+        sweep = sweep % (2 * math.pi) or 2 * math.pi
+    parts = 2 if abs(sweep) > 1.5 * math.pi else 1
+    for part in range(parts):
+        low, high = part / parts, (part + 1) / parts
+
+        def at(fraction):
+            angle = begin + sweep * fraction
+            return (cx + radius * math.cos(angle), cy + radius * math.sin(angle),
+                    start[2] + (end[2] - start[2]) * fraction)
+
+        yield Move(ARC, end if part == parts - 1 else at(high), at((low + high) / 2), feed, number)
+
+
+def _centre(start, end, radius, clockwise, number):
+    # a negative R is the arc of more than 180 degrees
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    chord = math.hypot(dx, dy)
+    if chord == 0 or chord > 2 * abs(radius) + 1e-6:
+        raise GCodeError("line {}: no arc of radius {} between its end points".format(number, radius))
+    offset = math.sqrt(max(radius * radius - chord * chord / 4, 0.0)) / chord
+    if clockwise == (radius > 0):
+        offset = -offset
+    return start[0] + dx / 2 - dy * offset, start[1] + dy / 2 + dx * offset
+
+
+# ------------------------- #
+#  Streaming                #
+# ------------------------- #
+class GCodeStreamer(object):
+    """Translates Moves to controller commands and streams them through the motion pipeline.
+
+    G-code coordinates are offset by origin, x, y, z, rz, ry, rx of the tool at the G-code zero, whose orientation
+    every move keeps. Feeds become 'Sm' speeds in mm/s, rapids use rapid_speed.
+
+    Runs of collinear G1 moves with the same feed, up to lookahead of them, are merged into one move. Consecutive
+    linear moves are sent as a spline, every corner blended with a rnd of blend_fraction times its shortest
+    adjacent move, capped at max_rnd. Arcs become MA moves, they end the spline.
+
+    run keeps at most window commands queued on the host and max_in_flight sent ahead to the controller, so
+    the controller always has its next move while the file is read no further than that.
+    """
+
+    def __init__(self, origin, wrist_config='F', lookahead=32, collinear_tolerance=.01, blend_fraction=.4,
+                 max_rnd=2.0, default_feed=600.0, rapid_speed=50.0, acceleration=20, deceleration=20, acc_ramp=100):
+        self.origin = np.asarray(origin, dtype=float)
+        self.wrist_config = wrist_config
+        self.lookahead = lookahead
+        self.collinear_tolerance = collinear_tolerance
+        self.blend_fraction = blend_fraction
+        self.max_rnd = max_rnd
+        self.default_feed = default_feed
+        self.rapid_speed = rapid_speed
+        self.acceleration = acceleration
+        self.deceleration = deceleration
+        self.acc_ramp = acc_ramp
+
+    @classmethod
+    def from_calibration(cls, calibration, **kwargs):
+        # the G-code start position of the GUI, GC_ST_E1..E6, plus the offsets GC_SToff_E1..E6
+        origin = [float(calibration['GC_ST_E' + str(i)]) + float(calibration['GC_SToff_E' + str(i)])
+                  for i in range(1, 7)]
+        kwargs.setdefault('wrist_config', str(calibration.get('GC_ST_WC') or 'F'))
+        return cls(origin, **kwargs)
+
+    def merge(self, moves):
+        """Joins runs of collinear linear moves of the same feed, at most lookahead of them, into one move."""
+        position = None
+        run = []
+        for move in moves:
+            if run and move.kind == LINEAR and move.feed == run[0].feed and len(run) < self.lookahead \
+                    and self._collinear(position, run, move.end):
+                run.append(move)
+                continue
+            if run:
+                yield run[-1]._replace(line=run[0].line)
+                position = run[-1].end
+                run = []
+            if move.kind == LINEAR and position is not None:
+                run.append(move)
+            else:
+                yield move
+                position = move.end
+        if run:
+            yield run[-1]._replace(line=run[0].line)
+
+    def _collinear(self, start, run, end):
+        # every point of the run lies within collinear_tolerance of the line from start to end
+        dx, dy, dz = end[0] - start[0], end[1] - start[1], end[2] - start[2]
+        length = math.sqrt(dx * dx + dy * dy + dz * dz)
+        if length == 0:
+            return False
+        for move in run:
+            px, py, pz = move.end[0] - start[0], move.end[1] - start[1], move.end[2] - start[2]
+            along = (px * dx + py * dy + pz * dz) / length
+            if not 0 < along < length:
+                return False
+            if px * px + py * py + pz * pz - along * along > self.collinear_tolerance ** 2:
+                return False
+        return True
+
+    def commands(self, moves, loop_mode='', rz_reference=None):
+        """Generator of (line, command bytes), spline brackets included, line is None for them.
+
+        Like AR4.move_l, rz is flipped when its sign differs from rz_reference.
+        """
+        x0, y0, z0, rz, ry, rx = self.origin.tolist()
+        if rz_reference is not None and np.sign(rz) != np.sign(rz_reference):
+            rz = rz * -1
+        spline = False
+        position = None
+        moves = self.merge(moves)
+        move = next(moves, None)
+        while move is not None:
+            following = next(moves, None)
+            x, y, z = move.end[0] + x0, move.end[1] + y0, move.end[2] + z0
+            if move.kind == LINEAR:
+                linear_next = following is not None and following.kind == LINEAR
+                if not spline and linear_next:
+                    spline = True
+                    yield None, SPLINE_START
+                rnd = self._rnd(position, move.end, following.end) if spline and linear_next else 0
+                yield move.line, AR4_encoding.move_l(x, y, z, rx, ry, rz, 0.0, 0.0, 0.0, 'Sm', self._speed(move.feed),
+                                                     self.acceleration, self.deceleration, self.acc_ramp, rnd,
+                                                     self.wrist_config, False, loop_mode)
+                if spline and not linear_next:
+                    spline = False
+                    yield None, SPLINE_END
+            elif move.kind == RAPID:
+                yield move.line, AR4_encoding.move_l(x, y, z, rx, ry, rz, 0.0, 0.0, 0.0, 'Sm', self.rapid_speed,
+                                                     self.acceleration, self.deceleration, self.acc_ramp, 0,
+                                                     self.wrist_config, False, loop_mode)
+            else:
+                mx, my, mz = move.mid[0] + x0, move.mid[1] + y0, move.mid[2] + z0
+                yield move.line, AR4_encoding.move_a(mx, my, mz, rx, ry, rz, x, y, z, 0.0, 'Sm',
+                                                     self._speed(move.feed), self.acceleration, self.deceleration,
+                                                     self.acc_ramp, self.wrist_config, loop_mode)
+            position = move.end
+            move = following
+
+    def _speed(self, feed):
+        return round((self.default_feed if feed is None else feed) / 60.0, 3)
+
+    def _rnd(self, start, corner, end):
+        # blend radius of the corner between the move from start to corner and the one from corner to end
+        if start is None:
+            return 0
+        shortest = min(math.dist(start, corner), math.dist(corner, end))
+        return round(min(self.blend_fraction * shortest, self.max_rnd), 3)
+
+    def run(self, robot, source, max_in_flight=4, window=64):
+        """Streams source, a path or an iterable of G-code lines, to robot, returns the number of commands sent.
+
+        Uses the pipeline of the robot when it has one, otherwise one is started for the job. An error reply
+        stops the stream with GCodeAborted naming the G-code line.
+        """
+        moves = read(source) if isinstance(source, str) else parse(source)
+        own_pipeline = robot.pipeline is None
+        robot.start_pipeline(max_in_flight)
+        pending = collections.deque()
+        sent = 0
+        try:
+            for line, command in self.commands(moves, robot.loop_mode, robot.state.pose[RZ]):
+                pending.append((line, robot.pipeline.submit(command)))
+                sent += 1
+                # back pressure, the next command is only read once the oldest queued one has been answered
+                while len(pending) >= window:
+                    self._settle(*pending.popleft())
+            while pending:
+                self._settle(*pending.popleft())
+        finally:
+            if own_pipeline:
+                robot.stop_pipeline()
+        logger.info("G-code streamed", extra=fields(commands=sent))
+        return sent
+
+    @staticmethod
+    def _settle(line, future):
+        response = future.result() if not future.cancelled() else None
+        if response is None or is_fault(response):
+            raise GCodeAborted(line, response)
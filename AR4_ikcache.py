@@ -0,0 +1,158 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import collections
+import hashlib
+import json
+import os
+import threading
+
+from AR4_kinematics import OutOfReach
+from AR4_log import logger, fields
+
+
+FORMAT = "ar4-ikcache"
+FORMAT_VERSION = 2
+
+# the move commands carry three decimals, poses closer than that are the same command
+RESOLUTION = .001
+
+
+def geometry_fingerprint(config):
+    # the fields of a RobotConfig that change the solution or the verdict of the inverse kinematics
+    values = (config.dh_theta, config.dh_alpha, config.dh_d, config.dh_a, config.tool_frame, config.pos_lim,
+              config.neg_lim)
+    return hashlib.blake2b(repr(values).encode(), digest_size=16).hexdigest()
+
+
+class IKCache(object):
+    """Bounded LRU cache of inverse kinematics results, by quantized tool pose and wrist configuration.
+
+    Every entry holds the joint angles of a pose, or the message and limit joints of the OutOfReach raised when it
+    can not be reached, so a repeated target is answered without solving again. The entries belong to the geometry
+    of one RobotConfig: when solve gets kinematics of another geometry, after set_tcp or a new calibration, the
+    cache is emptied. With path set, the entries are loaded from that file and save writes them back. Safe to share
+    between threads.
+    """
+
+    def __init__(self, capacity=4096, resolution=RESOLUTION, path=None):
+        self.capacity = capacity
+        self.resolution = resolution
+        self.path = path
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = collections.OrderedDict()
+        self._config = None
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, x, y, z, rx, ry, rz, wrist_config='F'):
+        scale = 1.0 / self.resolution
+        return (wrist_config, round(x * scale), round(y * scale), round(z * scale), round(rx * scale),
+                round(ry * scale), round(rz * scale))
+
+    def solve(self, kinematics, x, y, z, rx, ry, rz, wrist_config='F'):
+        """Joint angles J1..J6 of a tool pose like kinematics.ik, raises OutOfReach when it can not be reached."""
+        if kinematics.config is not self._config:
+            self._check_geometry(kinematics.config)
+        key = self.key(x, y, z, rx, ry, rz, wrist_config)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if result is None:
+            try:
+                result = tuple(float(angle) for angle in kinematics.ik(x, y, z, rx, ry, rz, wrist_config))
+            except OutOfReach as e:
+                result = {'error': str(e), 'joints': list(e.joints)}
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = result
+                if len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        if isinstance(result, dict):
+            raise OutOfReach(result['error'], result['joints'])
+        return result
+
+    def reachable(self, kinematics, x, y, z, rx, ry, rz, wrist_config='F'):
+        try:
+            self.solve(kinematics, x, y, z, rx, ry, rz, wrist_config)
+            return True
+        except OutOfReach:
+            return False
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+    def _check_geometry(self, config):
+        fingerprint = geometry_fingerprint(config)
+        with self._lock:
+            self._config = config
+            if fingerprint == self.fingerprint:
+                return
+            if self._entries:
+                logger.info("Robot geometry changed, IK cache cleared", extra=fields(entries=len(self._entries)))
+                self._entries.clear()
+                self.invalidations += 1
+            self.fingerprint = fingerprint
+
+    # ------------------------- #
+    #  Persistence              #
+    # ------------------------- #
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            header = {'format': FORMAT, 'version': FORMAT_VERSION, 'fingerprint': self.fingerprint,
+                      'resolution': self.resolution}
+            entries = [[list(key), result] for key, result in self._entries.items()]
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps(header, separators=(',', ':')) + '\n')
+                # least recently used first, load keeps the order
+                f.write(json.dumps(entries, separators=(',', ':')) + '\n')
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Unable to save IK cache", extra=fields(path=path, error=str(e)))
+
+    def load(self, path=None):
+        # entries of a file written for another resolution or format are ignored, a stale geometry is cleared by
+        # the first solve
+        path = path or self.path
+        try:
+            with open(path) as f:
+                header = json.loads(f.readline())
+                entries = json.loads(f.readline())
+        except (OSError, ValueError) as e:
+            logger.warning("Unable to read IK cache", extra=fields(path=path, error=str(e)))
+            return
+        if (not isinstance(header, dict) or header.get('format') != FORMAT
+                or header.get('version') != FORMAT_VERSION or header.get('resolution') != self.resolution):
+            logger.warning("IK cache file not usable, ignored", extra=fields(path=path))
+            return
+        with self._lock:
+            self._entries.clear()
+            for key, result in entries[-self.capacity:]:
+                self._entries[(key[0],) + tuple(key[1:])] = result if isinstance(result, dict) else tuple(result)
+            self.fingerprint = header.get('fingerprint')
+            self._config = None
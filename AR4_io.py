@@ -0,0 +1,89 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+import AR4_encoding
+from AR4_transport import BYTE
+
+
+# receive buffer of the Arduino Nano, bytes arriving while it is full are lost
+ARDUINO_RX_BUFFER = 64
+
+
+class IOBatch(object):
+    """Output and servo changes for the IO board collected and sent in one exchange.
+
+    Commands are sent in the order they were added, the board acknowledges each with one byte.
+
+        with robot.io.batch() as io:
+            io.output(8, True).servo(0, 90)
+
+    send blocks until every command is acknowledged, submit hands the batch to the IO thread and returns a Future.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.send()
+
+    def __len__(self):
+        return len(self.commands)
+
+    def output(self, number, state):
+        self.commands.append(AR4_encoding.set_output(number, state))
+        return self
+
+    def servo(self, number, position):
+        self.commands.append(AR4_encoding.servo(number, position))
+        return self
+
+    def send(self):
+        commands, self.commands = self.commands, []
+        return self.channel.send(commands)
+
+    def submit(self):
+        commands, self.commands = self.commands, []
+        return self.channel.submit(commands)
+
+
+class IOChannel(object):
+    """The IO board link of an AR4, with a thread of its own so IO runs while the Teensy link waits on a move.
+
+    Batches are written without waiting for the acknowledgement of every command, at most max_bytes ahead, so
+    they never overrun the receive buffer of the board. The transport lock keeps single commands of AR4, like
+    servo_cmd, and batches from interleaving.
+    """
+
+    def __init__(self, transport, max_bytes=ARDUINO_RX_BUFFER):
+        self.transport = transport
+        self.max_bytes = max_bytes
+        self._executor = None
+
+    def batch(self):
+        return IOBatch(self)
+
+    def send(self, commands):
+        # replies of the commands, in order
+        if not commands:
+            return []
+        return self.transport.exchange_batch(commands, BYTE, max_bytes=self.max_bytes)
+
+    def submit(self, commands):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AR4-io")
+        return self._executor.submit(self.send, list(commands))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,320 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import numpy as np
+
+
+# Angles are in degrees and lengths in mm like everywhere else in the API. Orientations use the Rz, Ry, Rx
+# convention of the controller: R = Rz(rz) . Ry(ry) . Rx(rx). The DH tables use the standard convention
+# T = Rz(theta) . Tz(d) . Tx(a) . Rx(alpha), theta being the joint angle plus the JxΘDHpar offset.
+
+# DH table of a stock AR4 in this convention, J1 to J6. With every joint at 0 the upper arm stands vertical and the
+# forearm and the tool point forward along +X, J2 tilts the arm forward and positive J3 lowers the forearm.
+AR4_DH_THETA = (0.0, -90.0, 180.0, 0.0, 0.0, 0.0)
+AR4_DH_ALPHA = (-90.0, 0.0, 90.0, -90.0, 90.0, 0.0)
+AR4_DH_D = (169.77, 0.0, 0.0, 222.63, 0.0, 36.25)
+AR4_DH_A = (64.2, 305.0, 0.0, 0.0, 0.0, 0.0)
+
+
+class OutOfReach(ValueError):
+    # joints holds the numbers, starting at 1, of the joints past their limits when only the limits are in the way
+
+    def __init__(self, message, joints=()):
+        super().__init__(message)
+        self.joints = tuple(joints)
+
+
+def rotation(rx, ry, rz):
+    a, b, c = np.radians((rx, ry, rz))
+    ca, sa, cb, sb, cc, sc = np.cos(a), np.sin(a), np.cos(b), np.sin(b), np.cos(c), np.sin(c)
+    return np.array([[cc * cb, cc * sb * sa - sc * ca, cc * sb * ca + sc * sa],
+                     [sc * cb, sc * sb * sa + cc * ca, sc * sb * ca - cc * sa],
+                     [-sb, cb * sa, cb * ca]])
+
+
+def pose_matrix(x, y, z, rx, ry, rz):
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation(rx, ry, rz)
+    matrix[:3, 3] = (x, y, z)
+    return matrix
+
+
+def matrix_pose(matrix):
+    # inverse of pose_matrix, returns x, y, z, rx, ry, rz
+    r = matrix[:3, :3]
+    ry = np.arctan2(-r[2, 0], np.hypot(r[0, 0], r[1, 0]))
+    if np.hypot(r[0, 0], r[1, 0]) < 1e-9:
+        # gimbal lock, Ry at +-90, only rz - rx is defined, rx is set to 0
+        rx = 0.0
+        rz = np.arctan2(-r[0, 1], r[1, 1])
+    else:
+        rx = np.arctan2(r[2, 1], r[2, 2])
+        rz = np.arctan2(r[1, 0], r[0, 0])
+    return np.concatenate((matrix[:3, 3], np.degrees((rx, ry, rz))))
+
+
+def dh_matrix(theta, d, a, alpha):
+    t, al = np.radians(theta), np.radians(alpha)
+    ct, st, ca, sa = np.cos(t), np.sin(t), np.cos(al), np.sin(al)
+    return np.array([[ct, -st * ca, st * sa, a * ct],
+                     [st, ct * ca, -ct * sa, a * st],
+                     [0.0, sa, ca, d],
+                     [0.0, 0.0, 0.0, 1.0]])
+
+
+def pose_matrices(poses):
+    # (N, 4, 4) matrices for an (N, 6) array of x, y, z, rx, ry, rz
+    poses = np.asarray(poses, dtype=float)
+    a, b, c = np.radians(poses[:, 3]), np.radians(poses[:, 4]), np.radians(poses[:, 5])
+    ca, sa, cb, sb, cc, sc = np.cos(a), np.sin(a), np.cos(b), np.sin(b), np.cos(c), np.sin(c)
+    matrices = np.zeros((len(poses), 4, 4))
+    matrices[:, 0, 0] = cc * cb
+    matrices[:, 0, 1] = cc * sb * sa - sc * ca
+    matrices[:, 0, 2] = cc * sb * ca + sc * sa
+    matrices[:, 1, 0] = sc * cb
+    matrices[:, 1, 1] = sc * sb * sa + cc * ca
+    matrices[:, 1, 2] = sc * sb * ca - cc * sa
+    matrices[:, 2, 0] = -sb
+    matrices[:, 2, 1] = cb * sa
+    matrices[:, 2, 2] = cb * ca
+    matrices[:, :3, 3] = poses[:, :3]
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def matrix_poses(matrices):
+    # inverse of pose_matrices, with the same gimbal lock handling as matrix_pose
+    r = matrices[:, :3, :3]
+    cos_ry = np.hypot(r[:, 0, 0], r[:, 1, 0])
+    locked = cos_ry < 1e-9
+    ry = np.arctan2(-r[:, 2, 0], cos_ry)
+    rx = np.where(locked, 0.0, np.arctan2(r[:, 2, 1], r[:, 2, 2]))
+    rz = np.where(locked, np.arctan2(-r[:, 0, 1], r[:, 1, 1]), np.arctan2(r[:, 1, 0], r[:, 0, 0]))
+    return np.concatenate((matrices[:, :3, 3], np.degrees(np.stack((rx, ry, rz), axis=1))), axis=1)
+
+
+def dh_matrices(theta, d, a, alpha):
+    # (N, 4, 4) DH transforms for an array of theta and scalar d, a and alpha
+    t, al = np.radians(theta), np.radians(alpha)
+    ct, st, ca, sa = np.cos(t), np.sin(t), np.cos(al), np.sin(al)
+    matrices = np.zeros((len(t), 4, 4))
+    matrices[:, 0, 0] = ct
+    matrices[:, 0, 1] = -st * ca
+    matrices[:, 0, 2] = st * sa
+    matrices[:, 0, 3] = a * ct
+    matrices[:, 1, 0] = st
+    matrices[:, 1, 1] = ct * ca
+    matrices[:, 1, 2] = -ct * sa
+    matrices[:, 1, 3] = a * st
+    matrices[:, 2, 1] = sa
+    matrices[:, 2, 2] = ca
+    matrices[:, 2, 3] = d
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def _wrap(angles):
+    return (np.asarray(angles) + 180.0) % 360.0 - 180.0
+
+
+class Kinematics(object):
+    """Forward and inverse kinematics of the arm, computed on the host from the DH table of a RobotConfig.
+
+    ik solves analytically for the spherical wrist of the AR4 and picks the wrist solution with the same convention
+    as move_j and move_l: wrist_config 'F' when J5 is positive, 'N' when it is negative.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.theta = np.array(config.dh_theta, dtype=float)
+        self.alpha = np.array(config.dh_alpha, dtype=float)
+        self.d = np.array(config.dh_d, dtype=float)
+        self.a = np.array(config.dh_a, dtype=float)
+        x, y, z, rz, ry, rx = config.tool_frame
+        self.tool = pose_matrix(x, y, z, rx, ry, rz)
+        self.tool_inv = np.linalg.inv(self.tool)
+        self.pos_lim = np.array(config.pos_lim, dtype=float)
+        # negative limits are stored as positive magnitudes in the calibration file
+        self.neg_lim = -np.array(config.neg_lim, dtype=float)
+
+    # ------------------------- #
+    #  Forward Kinematics       #
+    # ------------------------- #
+    def joint_frames(self, joints, count=6):
+        # base to frame i transforms for the first count joints
+        frames = []
+        matrix = np.eye(4)
+        for i in range(count):
+            matrix = matrix @ dh_matrix(joints[i] + self.theta[i], self.d[i], self.a[i], self.alpha[i])
+            frames.append(matrix)
+        return frames
+
+    def fk_matrix(self, joints):
+        return self.joint_frames(joints)[5] @ self.tool
+
+    def fk(self, joints):
+        # returns x, y, z, rx, ry, rz of the tool for joint angles J1..J6
+        return matrix_pose(self.fk_matrix(joints))
+
+    def fk_error(self, joints, pose):
+        """Distance in mm and rotation in degrees between the tool pose of joints and pose, x, y, z, rx, ry, rz.
+
+        Given the joint angles and the pose of one controller position reply, it tells whether the host side
+        kinematics agree with the controller.
+        """
+        matrix = self.fk_matrix(joints)
+        target = pose_matrix(*pose)
+        cos_angle = (np.trace(matrix[:3, :3].T @ target[:3, :3]) - 1.0) / 2.0
+        return (float(np.linalg.norm(matrix[:3, 3] - target[:3, 3])),
+                float(np.degrees(np.arccos(np.clip(cos_angle, -1.0, 1.0)))))
+
+    def fk_batch(self, joints):
+        """Tool poses for an (N, 6) array of joint angles.
+
+        Returns an (N, 6) array of x, y, z, rx, ry, rz and a boolean mask of the rows within the joint limits.
+        """
+        joints = np.atleast_2d(np.asarray(joints, dtype=float))[:, :6]
+        matrix = np.broadcast_to(np.eye(4), (len(joints), 4, 4))
+        for i in range(6):
+            matrix = matrix @ dh_matrices(joints[:, i] + self.theta[i], self.d[i], self.a[i], self.alpha[i])
+        return matrix_poses(matrix @ self.tool), self.within_limits_batch(joints)
+
+    # ------------------------- #
+    #  Inverse Kinematics       #
+    # ------------------------- #
+    def ik(self, x, y, z, rx, ry, rz, wrist_config='F', check_limits=True):
+        """Joint angles J1..J6 for a tool pose, raises OutOfReach when the pose can not be reached.
+
+        The first arm solution within the joint limits is used, preferring the shoulder facing the target and the
+        elbow up.
+        """
+        candidates, reached = self._solve(np.array([[x, y, z, rx, ry, rz]], dtype=float), wrist_config)
+        solutions = [candidates[i, 0] for i in range(len(candidates)) if reached[i, 0]]
+        if not solutions:
+            raise OutOfReach("Position Out of Reach: X{:.3f} Y{:.3f} Z{:.3f}".format(x, y, z))
+        if not check_limits:
+            return solutions[0]
+        for joints in solutions:
+            if self.within_limits(joints):
+                return joints
+        violations = self.limit_violations(solutions[0])
+        raise OutOfReach("Position Out of Reach, joint limit of " + ", ".join("J" + str(joint) for joint in violations),
+                         violations)
+
+    def reachable(self, x, y, z, rx, ry, rz, wrist_config='F'):
+        try:
+            self.ik(x, y, z, rx, ry, rz, wrist_config)
+            return True
+        except OutOfReach:
+            return False
+
+    def ik_batch(self, poses, wrist_config='F', processes=None, chunk_size=50000):
+        """Joint angles for an (N, 6) array of x, y, z, rx, ry, rz tool poses.
+
+        wrist_config is 'F', 'N' or an array with one of them per row. Returns an (N, 6) array of joint angles and a
+        boolean mask of the rows that are reachable within the joint limits. Rows that are reachable but only outside
+        the limits hold the preferred solution, unreachable rows are NaN. With processes set, batches larger than
+        chunk_size are split over a process pool of that many workers.
+        """
+        poses = np.atleast_2d(np.asarray(poses, dtype=float))
+        wrist_config = np.broadcast_to(np.asarray(wrist_config), (len(poses),))
+        if processes and len(poses) > chunk_size:
+            from concurrent.futures import ProcessPoolExecutor
+            starts = range(0, len(poses), chunk_size)
+            with ProcessPoolExecutor(processes) as pool:
+                results = list(pool.map(self.ik_batch, [poses[k:k + chunk_size] for k in starts],
+                                        [wrist_config[k:k + chunk_size] for k in starts]))
+            return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+        candidates, reached = self._solve(poses, wrist_config)
+        valid = reached & np.stack([self.within_limits_batch(joints) for joints in candidates])
+        rows = np.arange(len(poses))
+        # first candidate within the limits, else the first reachable one
+        choice = np.where(valid.any(axis=0), valid.argmax(axis=0), reached.argmax(axis=0))
+        joints = candidates[choice, rows]
+        joints[~reached.any(axis=0)] = np.nan
+        return joints, valid.any(axis=0)
+
+    def _solve(self, poses, wrist_config):
+        # every arm solution for every row: (4, N, 6) joint angles and a (4, N) mask of the reachable ones, ordered
+        # front shoulder elbow up, front elbow down, back shoulder elbow up, back elbow down
+        d1, d4, d6 = self.d[0], self.d[3], self.d[5]
+        a1, a2, a3 = self.a[0], self.a[1], self.a[2]
+        target = pose_matrices(poses) @ self.tool_inv
+        wrist = target[:, :3, 3] - d6 * target[:, :3, 2]
+        reach = np.hypot(wrist[:, 0], wrist[:, 1])
+        forearm = np.hypot(a3, d4)
+        psi = np.arctan2(d4, a3)
+        # wrist centre in the plane of the arm, frame 1 has its y axis pointing down
+        py = d1 - wrist[:, 2]
+        heading = np.arctan2(wrist[:, 1], wrist[:, 0])
+        wants_f = np.asarray(wrist_config) == 'F'
+        candidates = []
+        reached = []
+        for theta1, px in ((heading, reach - a1), (heading + np.pi, -reach - a1)):
+            cos_beta = (px * px + py * py - a2 * a2 - forearm * forearm) / (2 * a2 * forearm)
+            ok = np.abs(cos_beta) <= 1.0 + 1e-9
+            beta = np.arccos(np.clip(cos_beta, -1.0, 1.0))
+            elbows = []
+            for sign in (1.0, -1.0):
+                theta2 = np.arctan2(py, px) - np.arctan2(forearm * np.sin(sign * beta), a2 + forearm * np.cos(beta))
+                thetas = np.degrees(np.stack((theta1, theta2, sign * beta + psi), axis=1))
+                t01 = dh_matrices(thetas[:, 0], self.d[0], self.a[0], self.alpha[0])
+                t02 = t01 @ dh_matrices(thetas[:, 1], self.d[1], self.a[1], self.alpha[1])
+                t03 = t02 @ dh_matrices(thetas[:, 2], self.d[2], self.a[2], self.alpha[2])
+                r36 = np.swapaxes(t03[:, :3, :3], 1, 2) @ target[:, :3, :3]
+                thetas = np.concatenate((thetas, self._wrist(r36, wants_f)), axis=1)
+                elbows.append((t02[:, 2, 3], _wrap(thetas - self.theta)))
+            # elbow up first, the elbow is the origin of frame 2
+            up = elbows[0][0] >= elbows[1][0]
+            candidates.append(np.where(up[:, None], elbows[0][1], elbows[1][1]))
+            candidates.append(np.where(up[:, None], elbows[1][1], elbows[0][1]))
+            reached.extend((ok, ok))
+        return np.stack(candidates), np.stack(reached)
+
+    def _wrist(self, r36, wants_f):
+        # R36 = Rz(theta4) . Ry(theta5) . Rz(theta6) for alpha4 = -90 and alpha5 = 90
+        s5 = np.hypot(r36[:, 0, 2], r36[:, 1, 2])
+        c5 = r36[:, 2, 2]
+        theta5 = np.degrees(np.arctan2(s5, c5))
+        # flip to the other wrist solution where the sign of J5 does not match the wrist configuration
+        sign = np.where((_wrap(theta5 - self.theta[4]) > 0) == wants_f, 1.0, -1.0)
+        theta4 = np.degrees(np.arctan2(sign * r36[:, 1, 2], sign * r36[:, 0, 2]))
+        theta6 = np.degrees(np.arctan2(sign * r36[:, 2, 1], -sign * r36[:, 2, 0]))
+        theta5 = sign * theta5
+        # wrist singularity, J4 is kept at 0 and J6 takes the whole rotation
+        singular = s5 < 1e-9
+        theta4 = np.where(singular, 0.0, theta4)
+        theta6 = np.where(singular, np.degrees(np.arctan2(r36[:, 1, 0], r36[:, 0, 0])), theta6)
+        return np.stack((theta4, theta5, theta6), axis=1)
+
+    # ------------------------- #
+    #  Joint Limits             #
+    # ------------------------- #
+    def within_limits(self, joints):
+        joints = np.asarray(joints[:6], dtype=float)
+        return bool(np.all((joints <= self.pos_lim) & (joints >= self.neg_lim)))
+
+    def limit_violations(self, joints):
+        # joint numbers, starting at 1, that are outside their limits
+        joints = np.asarray(joints[:6], dtype=float)
+        return [i + 1 for i in np.flatnonzero((joints > self.pos_lim) | (joints < self.neg_lim))]
+
+    def within_limits_batch(self, joints):
+        joints = np.asarray(joints, dtype=float)[:, :6]
+        return np.all((joints <= self.pos_lim) & (joints >= self.neg_lim), axis=1)
+
+    @staticmethod
+    def wrist_flips(joints, threshold=90.0):
+        """Mask of the rows of a joint path where the wrist flips coming from the previous row.
+
+        A flip is a sign change of J5 or a jump of J4 or J6 larger than threshold degrees.
+        """
+        joints = np.asarray(joints, dtype=float)
+        flips = np.zeros(len(joints), dtype=bool)
+        if len(joints) > 1:
+            step = np.abs(np.diff(joints[:, [3, 5]], axis=0)).max(axis=1)
+            flips[1:] = (np.sign(joints[1:, 4]) != np.sign(joints[:-1, 4])) | (step > threshold)
+        return flips
@@ -0,0 +1,102 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+
+# All modules log to this logger or its children, nothing is configured at import. start hands every record to
+# a queue, a listener thread formats and writes them, so the control thread never waits for the disk or console.
+#
+#   logger.debug("exchange", extra=fields(command="RP", response=reply))
+#
+# is written as "exchange command='RP' response='A0.0B...'". Records below the level are dropped by the
+# isEnabledFor check of the logger before anything is formatted, guard the fields with it on hot paths.
+logger = logging.getLogger("AR4")
+logger.addHandler(logging.NullHandler())
+
+FILE_FORMAT = '%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s'
+DATE_FORMAT = '%H:%M:%S'
+
+_listener = None
+_queue_handler = None
+# file handlers of the listener by absolute path
+_files = {}
+
+
+def fields(**values):
+    # extra argument of a logging call carrying key/value fields
+    return {'fields': values}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Appends the key/value fields of a record to its message."""
+
+    def format(self, record):
+        message = super().format(record)
+        values = getattr(record, 'fields', None)
+        if values:
+            message += " " + " ".join(key + "=" + repr(value) for key, value in values.items())
+        return message
+
+
+def start(filename="AR4.log", level=logging.INFO, console=True, file_format=FILE_FORMAT):
+    """Log the AR4 logger to filename and, with console, INFO and above to stdout from a background thread.
+
+    Records do not propagate to the root logger while started. The logger belongs to the process, not to one AR4:
+    calling start again sets the level and adds filename when it is a new file, which from then on gets the
+    records of every AR4 as well. The console is only set up by the first call.
+    """
+    global _listener, _queue_handler
+    logger.setLevel(level)
+    handlers = []
+    if filename and os.path.abspath(filename) not in _files:
+        file_handler = logging.FileHandler(filename, mode='a')
+        file_handler.setFormatter(KeyValueFormatter(file_format, DATE_FORMAT))
+        _files[os.path.abspath(filename)] = file_handler
+        handlers.append(file_handler)
+    if _listener is not None:
+        if handlers:
+            # the listener thread reads the handlers for every record, the new tuple takes effect at once
+            _listener.handlers = _listener.handlers + tuple(handlers)
+        return _listener
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(KeyValueFormatter('%(message)s'))
+        # commands and replies only go to the file
+        console_handler.setLevel(logging.INFO)
+        handlers.append(console_handler)
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    logger.addHandler(_queue_handler)
+    logger.propagate = False
+    atexit.register(stop)
+    return _listener
+
+
+def stop():
+    # writes the records still queued and stops the listener thread
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    logger.removeHandler(_queue_handler)
+    logger.propagate = True
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+    _queue_handler = None
+    _files.clear()
+
+
+def set_level(level):
+    logger.setLevel(level)
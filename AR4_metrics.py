@@ -0,0 +1,191 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import bisect
+import threading
+import time
+
+
+# upper bounds in seconds of the exchange time histogram, moves can take many seconds
+BUCKETS = (.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGES = ('encode', 'write', 'wait', 'read', 'parse')
+
+# layout of the per port and command statistics list
+_COUNT, _ENCODE, _WRITE, _WAIT, _READ, _PARSE, _BYTES_OUT, _BYTES_IN, _TOTAL, _BUCKET = range(10)
+
+
+class Metrics(object):
+    """Counters, histograms and a ring buffer of the last samples of every serial exchange.
+
+    exchange is called by SerialTransport and MotionPipeline for every command with the time spent encoding,
+    writing, waiting for the first reply byte and reading the rest of the reply, parse by AR4.parse_response.
+    Recording a sample only appends to preallocated lists and updates a few numbers, so it can stay enabled.
+    Updates are not locked, two threads recording at the same moment may lose a count, never corrupt the data.
+
+    prometheus returns everything in the Prometheus text exposition format, serve exposes it over http.
+    """
+
+    def __init__(self, capacity=4096, buckets=BUCKETS):
+        self.capacity = capacity
+        self.buckets = tuple(buckets)
+        self._bucket_count = len(self.buckets) + 1
+        self.ring = [None] * capacity
+        self.recorded = 0
+        self.errors = {}
+        self.timeouts = {}
+        self.speed_violations = 0
+        self._stats = {}
+        self._last = None
+        self._server = None
+
+    def reset(self):
+        self.ring = [None] * self.capacity
+        self.recorded = 0
+        self.errors = {}
+        self.timeouts = {}
+        self.speed_violations = 0
+        self._stats = {}
+        self._last = None
+
+    # ------------------------- #
+    #  Recording                #
+    # ------------------------- #
+    def exchange(self, port, command, encode, write, wait, read, bytes_out, bytes_in):
+        total = encode + write + wait + read
+        sample = [time.time(), port, command, encode, write, wait, read, 0.0, bytes_out, bytes_in]
+        self.ring[self.recorded % self.capacity] = sample
+        self.recorded += 1
+        self._last = sample
+        stats = self._stats.get((port, command))
+        if stats is None:
+            stats = self._stats[(port, command)] = [0, 0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0.0] + [0] * self._bucket_count
+        stats[_COUNT] += 1
+        stats[_ENCODE] += encode
+        stats[_WRITE] += write
+        stats[_WAIT] += wait
+        stats[_READ] += read
+        stats[_BYTES_OUT] += bytes_out
+        stats[_BYTES_IN] += bytes_in
+        stats[_TOTAL] += total
+        stats[_BUCKET + bisect.bisect_left(self.buckets, total)] += 1
+
+    def parse(self, seconds, speed_violation=False):
+        # parse time of the reply of the last exchange
+        sample = self._last
+        if sample is not None:
+            sample[7] = seconds
+            self._stats[(sample[1], sample[2])][_PARSE] += seconds
+        if speed_violation:
+            self.speed_violations += 1
+
+    def error(self, code):
+        self.errors[code] = self.errors.get(code, 0) + 1
+
+    def timeout(self, port, command):
+        self.timeouts[(port, command)] = self.timeouts.get((port, command), 0) + 1
+
+    # ------------------------- #
+    #  Export                   #
+    # ------------------------- #
+    def samples(self):
+        # recorded samples oldest first, at most capacity
+        start = max(0, self.recorded - self.capacity)
+        fields = ('time', 'port', 'command') + STAGES + ('bytes_out', 'bytes_in')
+        return [dict(zip(fields, self.ring[i % self.capacity])) for i in range(start, self.recorded)]
+
+    def snapshot(self):
+        commands = {}
+        for (port, command), stats in list(self._stats.items()):
+            count = stats[_COUNT]
+            commands[port + ':' + command] = {
+                'count': count,
+                'mean_seconds': {stage: stats[_ENCODE + i] / count for i, stage in enumerate(STAGES)},
+                'bytes_out': stats[_BYTES_OUT], 'bytes_in': stats[_BYTES_IN],
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], stats[_BUCKET:])),
+            }
+        return {'commands': commands, 'errors': dict(self.errors),
+                'timeouts': {port + ':' + command: count for (port, command), count in self.timeouts.items()},
+                'speed_violations': self.speed_violations}
+
+    def prometheus(self):
+        lines = []
+        stats = sorted(self._stats.items())
+
+        def header(name, kind, text):
+            lines.append("# HELP " + name + " " + text)
+            lines.append("# TYPE " + name + " " + kind)
+
+        header('ar4_exchange_seconds', 'histogram', "Time from encoding a command to its complete reply.")
+        for (port, command), values in stats:
+            labels = 'port="' + port + '",command="' + command + '"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, values[_BUCKET:]):
+                cumulative += count
+                lines.append('ar4_exchange_seconds_bucket{' + labels + ',le="' + repr(bound) + '"} '
+                             + str(cumulative))
+            lines.append('ar4_exchange_seconds_bucket{' + labels + ',le="+Inf"} ' + str(values[_COUNT]))
+            lines.append('ar4_exchange_seconds_sum{' + labels + '} ' + repr(values[_TOTAL]))
+            lines.append('ar4_exchange_seconds_count{' + labels + '} ' + str(values[_COUNT]))
+        header('ar4_stage_seconds_total', 'counter', "Time spent per stage of the exchanges.")
+        for (port, command), values in stats:
+            for i, stage in enumerate(STAGES):
+                lines.append('ar4_stage_seconds_total{port="' + port + '",command="' + command + '",stage="'
+                             + stage + '"} ' + repr(values[_ENCODE + i]))
+        for name, index, text in (('ar4_bytes_written_total', _BYTES_OUT, "Bytes written to the port."),
+                                  ('ar4_bytes_read_total', _BYTES_IN, "Bytes read from the port.")):
+            header(name, 'counter', text)
+            for (port, command), values in stats:
+                lines.append(name + '{port="' + port + '",command="' + command + '"} ' + str(values[index]))
+        header('ar4_timeouts_total', 'counter', "Commands without a reply within their deadline.")
+        for (port, command), count in sorted(self.timeouts.items()):
+            lines.append('ar4_timeouts_total{port="' + port + '",command="' + command + '"} ' + str(count))
+        header('ar4_errors_total', 'counter', "Error replies of the controller by error code.")
+        for code, count in sorted(self.errors.items()):
+            lines.append('ar4_errors_total{code="' + code + '"} ' + str(count))
+        header('ar4_speed_violations_total', 'counter', "Replies reporting a speed violation.")
+        lines.append('ar4_speed_violations_total ' + str(self.speed_violations))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9464, address=''):
+        """Serves prometheus on http://address:port/metrics from a daemon thread, returns the server."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="AR4-metrics", daemon=True).start()
+        return self._server
+
+    def stop_serving(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+if __name__ == '__main__':
+    # cost of recording one sample, python AR4_metrics.py
+    import timeit
+
+    metrics = Metrics()
+    number = 200000
+    seconds = min(timeit.repeat(lambda: metrics.exchange('teensy', 'MJ', 2e-6, 1e-5, 3e-4, 2e-5, 80, 100),
+                                number=number, repeat=5))
+    print("exchange {:>8.3f} us/sample".format(seconds / number * 1e6))
+    seconds = min(timeit.repeat(lambda: metrics.parse(4e-6), number=number, repeat=5))
+    print("parse    {:>8.3f} us/sample".format(seconds / number * 1e6))
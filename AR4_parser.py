@@ -0,0 +1,131 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import re
+
+from AR4_state import J1, J2, J3, J4, J5, J6, X, Y, Z, RX, RY, RZ, J7, J8, J9
+
+
+# The position reply of the Teensy, one tag letter in front of every field:
+#   A..F  joint angles J1..J6
+#   G H I X, Y, Z
+#   J K L Rz, Ry, Rx
+#   M     speed violation, '1' when the requested speed could not be reached
+#   N     debug text
+#   O     error flag, empty when the move succeeded
+#   P Q R external axes J7..J9
+FIELD_TAGS = 'ABCDEFGHIJKLMNOPQR'
+FIELD_NAMES = ('J1', 'J2', 'J3', 'J4', 'J5', 'J6', 'X', 'Y', 'Z', 'Rz', 'Ry', 'Rx',
+               'speed violation', 'debug', 'flag', 'J7', 'J8', 'J9')
+# pose index of the numeric fields in reply order
+POSE_INDEX = (J1, J2, J3, J4, J5, J6, X, Y, Z, RZ, RY, RX, J7, J8, J9)
+
+# the character class only splits the fields, float() validates every number
+_NUMBER = r'([-+.\de ]+)'
+_POSITION_RE = re.compile('A' + _NUMBER + 'B' + _NUMBER + 'C' + _NUMBER + 'D' + _NUMBER + 'E' + _NUMBER
+                          + 'F' + _NUMBER + 'G' + _NUMBER + 'H' + _NUMBER + 'I' + _NUMBER + 'J' + _NUMBER
+                          + 'K' + _NUMBER + 'L' + _NUMBER + r'M([01 ]*)N([^O]*)O([^P]*)P' + _NUMBER
+                          + 'Q' + _NUMBER + 'R' + _NUMBER + r'$')
+# one joint of a TL or RE reply, "J1 = 1000   J2 = 1000 ..."
+_JOINT_VALUE_RE = re.compile(r'J(\d)\s*=\s*(-?\d+)')
+
+
+class ResponseParseError(ValueError):
+    pass
+
+
+def parse_position(response, pose):
+    """Parse a position reply into pose in a single pass.
+
+    The numeric fields are written into pose, an array of POSE_SIZE floats laid out like RobotState.pose, which is
+    only modified when the whole reply is valid. Returns (speed_violation, flag) where speed_violation is a bool
+    and flag the stripped error flag. Raises ResponseParseError naming the offending field when the reply is malformed.
+    """
+    match = _POSITION_RE.match(response)
+    if match is None:
+        raise ResponseParseError(_diagnose(response))
+    values = match.groups()
+    try:
+        # one slice assignment in pose order: J1..J6, X, Y, Z, Rx, Ry, Rz, J7..J9
+        pose[:] = (float(values[0]), float(values[1]), float(values[2]), float(values[3]), float(values[4]),
+                   float(values[5]), float(values[6]), float(values[7]), float(values[8]), float(values[11]),
+                   float(values[10]), float(values[9]), float(values[15]), float(values[16]), float(values[17]))
+    except ValueError:
+        raise ResponseParseError(_diagnose(response))
+    return values[12].strip() == '1', values[14].strip()
+
+
+def is_fault(response):
+    """True for an error reply and for a position reply whose error flag is set, the move did not complete."""
+    if response[:1] == 'E':
+        return True
+    match = _POSITION_RE.match(response)
+    return match is not None and match.group(15).strip() != ''
+
+
+def parse_joint_values(response, count=6):
+    """Parse the per joint integers of a TL or RE reply into a tuple ordered J1 to J<count>.
+
+    Raises ResponseParseError naming the first joint missing from the reply.
+    """
+    values = {int(joint): int(value) for joint, value in _JOINT_VALUE_RE.findall(response)}
+    for joint in range(1, count + 1):
+        if joint not in values:
+            raise ResponseParseError("Reply has no value for J{}: {!r}".format(joint, response))
+    return tuple(values[joint] for joint in range(1, count + 1))
+
+
+def _diagnose(response):
+    # only runs for malformed replies, walks the tags in order to name the first field that is wrong
+    if response[:1] == 'E':
+        return "Error reply instead of a position: " + repr(response)
+    position = 0
+    for index, tag in enumerate(FIELD_TAGS):
+        if response[position:position + 1] != tag:
+            return ("Malformed position reply, expected tag '" + tag + "' for " + FIELD_NAMES[index]
+                    + " at offset " + str(position) + ": " + repr(response))
+        if index + 1 < len(FIELD_TAGS):
+            end = response.find(FIELD_TAGS[index + 1], position + 1)
+            if end < 0:
+                return ("Malformed position reply, missing tag '" + FIELD_TAGS[index + 1] + "' for "
+                        + FIELD_NAMES[index + 1] + ": " + repr(response))
+        else:
+            end = len(response)
+        field = response[position + 1:end]
+        if tag not in 'MNO' and not _is_number(field):
+            return ("Malformed position reply, " + FIELD_NAMES[index] + " is not a number: "
+                    + repr(field) + " in " + repr(response))
+        position = end
+    return "Malformed position reply: " + repr(response)
+
+
+def _is_number(field):
+    try:
+        float(field)
+        return True
+    except ValueError:
+        return False
+
+
+def _parse_legacy(response, pose):
+    # the find based parser AR4.parse_response used before, kept for the benchmark below
+    indices = [response.find(tag) for tag in FIELD_TAGS] + [len(response)]
+    for field, pose_index in zip((0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 15, 16, 17), POSE_INDEX):
+        pose[pose_index] = float(response[indices[field] + 1:indices[field + 1]].strip())
+    return response[indices[12] + 1:indices[13]].strip() == '1', response[indices[14] + 1:indices[15]].strip()
+
+
+if __name__ == '__main__':
+    # micro-benchmark, python AR4_parser.py
+    import timeit
+    import numpy as np
+
+    line = "A-0.012B-32.445C44.123D0.051E78.321F-0.123G362.295H148.723I152.148J179.990K0.058L179.997M0NOP0.0Q0.0R0.0"
+    buffer = np.zeros(15)
+    for name, function in (("parse_position", parse_position), ("legacy find", _parse_legacy)):
+        number = 100000
+        seconds = min(timeit.repeat(lambda: function(line, buffer), number=number, repeat=5))
+        print("{:<16}{:>10.0f} lines/s {:>8.2f} us/line".format(name, number / seconds, seconds / number * 1e6))
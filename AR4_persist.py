@@ -0,0 +1,156 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import atexit
+import os
+import pickle
+import threading
+import time
+
+from AR4_calibration import Calibration
+from AR4_log import logger, fields
+from AR4_state import POSE_KEYS, pose_fields
+
+
+SYNC = 'sync'
+WRITE_BEHIND = 'write_behind'
+OFF = 'off'
+
+POSITION_FIELDS = POSE_KEYS
+# key of the JSON lines of the calibration sections that were never decoded, by section name
+PENDING_SECTIONS = '_sections'
+
+
+class PositionStore(object):
+    """Persists the robot position after every parsed response.
+
+    policy SYNC writes on every save, WRITE_BEHIND hands the snapshot to a background thread that writes at most
+    once per min_interval, so rapid updates coalesce into one write of the latest state, OFF never writes.
+    Every write goes to a temporary file that is renamed over the target, a crash never leaves a half written file.
+    With positions_only only the POSITION_FIELDS are stored instead of the whole calibration dict.
+
+    save only copies the pose array, the dict that is written is built by the thread that writes it. Lazy sections
+    of a Calibration that are still pending are written as their JSON lines under PENDING_SECTIONS, undecoded, and
+    load hands them back as pending sections.
+    """
+
+    def __init__(self, path="ARbot2.cal", policy=WRITE_BEHIND, positions_only=False, min_interval=.5, fsync=True):
+        if policy not in (SYNC, WRITE_BEHIND, OFF):
+            raise ValueError("Unknown persistence policy: " + str(policy))
+        self.path = path
+        self.policy = policy
+        self.positions_only = positions_only
+        self.min_interval = min_interval
+        self.fsync = fsync
+        self.writes = 0
+        self._latest = None
+        self._cond = threading.Condition()
+        self._writing = False
+        self._thread = None
+        self._running = False
+        if policy == WRITE_BEHIND:
+            # registered once, flush has nothing to do when no snapshot is pending
+            atexit.register(self.flush)
+
+    def save(self, calibration, pose=None):
+        if self.policy == OFF:
+            return
+        snapshot = (calibration, None if pose is None else pose.copy())
+        if self.policy == SYNC:
+            self._write(snapshot)
+            return
+        with self._cond:
+            self._latest = snapshot
+            if self._thread is None:
+                self._start()
+            self._cond.notify_all()
+
+    def load(self):
+        # the data of the last write, None when there is no readable file
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Unable to read position data", extra=fields(path=self.path, error=str(e)))
+            return None
+        if isinstance(data, dict) and PENDING_SECTIONS in data:
+            return Calibration(data, pending=data.pop(PENDING_SECTIONS), path=self.path)
+        return data
+
+    def flush(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._writing)
+            snapshot, self._latest = self._latest, None
+            if snapshot is not None:
+                self._write(snapshot)
+
+    def close(self):
+        if self.policy == WRITE_BEHIND:
+            # atexit holds the bound method, a closed store must not stay alive until exit
+            atexit.unregister(self.flush)
+        self.flush()
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="AR4-position-store", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._latest is not None or not self._running)
+                if not self._running:
+                    return
+            # let rapid updates pile up, only the last snapshot of the interval is written
+            time.sleep(self.min_interval)
+            with self._cond:
+                snapshot, self._latest = self._latest, None
+                self._writing = snapshot is not None
+            if snapshot is not None:
+                try:
+                    self._write(snapshot)
+                finally:
+                    with self._cond:
+                        self._writing = False
+                        self._cond.notify_all()
+
+    def _build(self, snapshot):
+        calibration, pose = snapshot
+        if self.positions_only:
+            if pose is not None:
+                return pose_fields(pose)
+            return {key: calibration[key] for key in POSITION_FIELDS if key in calibration}
+        if isinstance(calibration, Calibration):
+            data, pending = calibration.snapshot()
+            if pending:
+                data[PENDING_SECTIONS] = pending
+        else:
+            data = dict(calibration)
+        if pose is not None:
+            data.update(pose_fields(pose))
+        return data
+
+    def _write(self, snapshot):
+        tmp_path = self.path + ".tmp"
+        try:
+            data = self._build(snapshot)
+            with open(tmp_path, "wb") as f:
+                pickle.dump(data, f)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.writes += 1
+        except Exception as e:
+            logger.error("Unable to save position data", extra=fields(path=self.path, error=str(e)))
@@ -0,0 +1,182 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import collections
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from AR4_log import logger, fields
+from AR4_parser import is_fault
+from AR4_transport import ReplyTimeout
+
+
+class MotionPipeline(object):
+    """Queued command submission with a bounded number of commands in flight.
+
+    A writer thread sends queued commands as long as fewer than max_in_flight replies are outstanding, a reader
+    thread matches every reply to its command in order and resolves the future returned by submit with the
+    response string. Replies go through parse_response and error_handler of the robot like in blocking mode.
+
+    When a reply reports an error, commands that are still queued are cancelled, the replies of commands already
+    sent are collected and only then error_handler runs, so its recovery commands do not race the pipeline.
+    """
+
+    def __init__(self, robot, max_in_flight=2):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.robot = robot
+        self.transport = robot.transport
+        self.max_in_flight = max_in_flight
+        self._queue = queue.Queue()
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._fault = None
+        self._holding = None
+        self._running = True
+        self._writer = threading.Thread(target=self._write_loop, name="AR4-pipeline-writer", daemon=True)
+        self._reader = threading.Thread(target=self._read_loop, name="AR4-pipeline-reader", daemon=True)
+        # an exchange in progress, e.g. a telemetry poll, ends before the pipeline threads use the port, exchanges
+        # that come later find the pipeline and drain it first
+        with self.transport.lock:
+            self.transport.pipeline = self
+        self._writer.start()
+        self._reader.start()
+
+    def submit(self, command):
+        if not self._running:
+            raise RuntimeError("Pipeline is stopped")
+        future = Future()
+        with self._cond:
+            self._queue.put((command, future))
+        return future
+
+    def in_flight(self):
+        with self._cond:
+            return len(self._pending)
+
+    def drain(self):
+        # called by blocking exchanges, they may only talk to the controller once nothing is outstanding
+        if threading.current_thread() is self._reader:
+            return
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue.unfinished_tasks == 0 and not self._pending)
+
+    def stop(self):
+        self.drain()
+        self._running = False
+        self._queue.put(None)
+        with self._cond:
+            self._cond.notify_all()
+        self._writer.join()
+        self._reader.join()
+        self.transport.pipeline = None
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            command, future = item
+            with self._cond:
+                self._holding = future
+                self._cond.wait_for(lambda: len(self._pending) < self.max_in_flight and self._fault is None)
+                self._holding = None
+                if not future.set_running_or_notify_cancel():
+                    self._queue.task_done()
+                    self._cond.notify_all()
+                    continue
+                self._pending.append((command, future, self._write(command)))
+                self._queue.task_done()
+                self._cond.notify_all()
+
+    def _read_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or not self._running)
+                if not self._pending:
+                    return
+            try:
+                response = str(self.transport.read_line(.1).strip(), 'utf-8')
+            except ReplyTimeout:
+                continue
+            with self._cond:
+                command, future, timing = self._pending.popleft()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("pipelined exchange", extra=fields(port=self.transport.name, command=command.strip(),
+                                                                response=response))
+            if timing is not None:
+                encode, write, written, bytes_out, prefix = timing
+                self.transport.metrics.exchange(self.transport.name, prefix, encode, write,
+                                                time.perf_counter() - written, 0.0, bytes_out, len(response) + 1)
+            try:
+                if is_fault(response):
+                    self._hold(command, future, response)
+                else:
+                    self.robot.parse_response(response)
+                    future.set_result(response)
+            except Exception as e:
+                logger.error("Pipeline failed handling reply", extra=fields(command=command.strip(), error=str(e)))
+                future.set_exception(e)
+            self._release()
+
+    def _write(self, command):
+        # writes command, a string or encoded bytes, returns the timing recorded with its reply when the transport
+        # has metrics
+        if self.transport.metrics is None:
+            self.transport.write(command)
+            return None
+        start = time.perf_counter()
+        data = command.encode() if isinstance(command, str) else command
+        encoded = time.perf_counter()
+        self.transport.write(data)
+        written = time.perf_counter()
+        return encoded - start, written - encoded, written, len(data), data[:2].decode('ascii', 'replace')
+
+    def _hold(self, command, future, response):
+        with self._cond:
+            if self._fault is None:
+                self._fault = []
+                if self._holding is not None:
+                    self._holding.cancel()
+                self._cancel_queued()
+            self._fault.append((command, future, response))
+
+    def _cancel_queued(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is None:
+                self._queue.put(None)
+                self._queue.task_done()
+                return
+            item[1].cancel()
+            self._queue.task_done()
+
+    def _release(self):
+        with self._cond:
+            faults = self._fault if not self._pending else None
+        if faults:
+            logger.warning("Pipeline cancelled queued commands after controller error",
+                           extra=fields(responses=[response for command, future, response in faults]))
+            for command, future, response in faults:
+                try:
+                    if response[:1] == 'E':
+                        self.robot.error_handler(response)
+                    else:
+                        self.robot.parse_response(response)
+                    future.set_result(response)
+                except Exception as e:
+                    future.set_exception(e)
+        with self._cond:
+            if faults:
+                self._fault = None
+            self._cond.notify_all()
@@ -0,0 +1,355 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import hashlib
+import inspect
+import json
+import os
+import time
+
+import numpy as np
+
+import AR4_api
+import AR4_encoding
+from AR4_kinematics import OutOfReach
+from AR4_log import logger, fields
+from AR4_parser import is_fault
+from AR4_state import RZ
+from AR4_transport import BYTE
+
+
+# Compiled program file, the header line is JSON, the encoded commands of all steps follow it back to back:
+#
+#   {"format": "ar4-program", "version": 1, "digest": "...", "loop_mode": "000000", "rz_sign": null,
+#    "steps": [[kind, length, value], ...]}
+#
+# MOTION steps are one command answered with a position line, ACK steps one Teensy command answered with a byte,
+# IO steps value commands for the IO board sent as one batch, WAIT steps no bytes and value seconds.
+FORMAT = "ar4-program"
+FORMAT_VERSION = 1
+PROGRAM_CACHE = "ar4_programs"
+
+MOTION, ACK, IO, WAIT = 'motion', 'ack', 'io', 'wait'
+
+# AR4 methods a program can hold, with the command builders of their encoded commands
+_MOVES = {
+    'move_j': (AR4_encoding.move_j,),
+    'move_l': (AR4_encoding.move_l,),
+    'move_r': (AR4_encoding.move_r,),
+    'move_c': (AR4_encoding.move_c_start, AR4_encoding.move_c),
+    'move_a': (AR4_encoding.move_a,),
+}
+_IO = ('set_io_teensy', 'set_io_arduino', 'servo_cmd')
+
+
+class ProgramError(ValueError):
+    pass
+
+
+class ProgramAborted(RuntimeError):
+    # the controller reported an error, step is the index of the compiled step, response its reply
+
+    def __init__(self, step, response):
+        super().__init__("Program aborted at step {}: {}".format(step, response))
+        self.step = step
+        self.response = response
+
+
+def _plain(value):
+    # numpy scalars from kinematics or trajectories recorded as the python numbers they hold
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class Program(object):
+    """A motion job declared once, compiled to the encoded controller commands and replayed.
+
+    The methods take the arguments of the AR4 methods of the same name, a script written against a robot records
+    a program when it is handed a Program instead. wait replaces time.sleep between moves.
+
+        program = Program()
+        program.move_j(362.295, 148.723, 152.148, 179.997, 0.058, 179.990, speed=40)
+        program.set_io_arduino(8, True)
+        program.wait(1)
+        program.run(robot)
+    """
+
+    def __init__(self, steps=None):
+        self.steps = [list(step) for step in steps or ()]
+
+    def _add(self, name, args, kwargs):
+        signature = inspect.signature(getattr(AR4_api.AR4, name))
+        bound = signature.bind(None, *args, **kwargs)
+        arguments = {key: _plain(value) for key, value in list(bound.arguments.items())[1:]}
+        self.steps.append([name, arguments])
+        return self
+
+    def move_j(self, *args, **kwargs):
+        return self._add('move_j', args, kwargs)
+
+    def move_l(self, *args, **kwargs):
+        return self._add('move_l', args, kwargs)
+
+    def move_r(self, *args, **kwargs):
+        return self._add('move_r', args, kwargs)
+
+    def move_c(self, *args, **kwargs):
+        return self._add('move_c', args, kwargs)
+
+    def move_a(self, *args, **kwargs):
+        return self._add('move_a', args, kwargs)
+
+    def set_io_teensy(self, output, state):
+        return self._add('set_io_teensy', (output, state), {})
+
+    def set_io_arduino(self, output, state):
+        return self._add('set_io_arduino', (output, state), {})
+
+    def servo_cmd(self, number, position):
+        return self._add('servo_cmd', (number, position), {})
+
+    def wait(self, seconds):
+        self.steps.append(['wait', {'seconds': float(seconds)}])
+        return self
+
+    # ------------------------- #
+    #  Compilation              #
+    # ------------------------- #
+    def digest(self, robot):
+        """Content hash of the program and everything its compiled form depends on in robot."""
+        config = robot.config
+        content = json.dumps({
+            'version': FORMAT_VERSION,
+            'steps': self.steps,
+            'loop_mode': robot.loop_mode,
+            'rz_sign': self._rz_sign(robot),
+            'config': None if config is None else [getattr(config, name) for name in config.__slots__],
+        }, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _rz_sign(self, robot):
+        # sign of the current rz when a move_l comes before any move fixing the rz reference, None otherwise
+        for name, arguments in self.steps:
+            if name == 'move_l':
+                return float(np.sign(robot.state.pose[RZ]))
+            if name in _MOVES:
+                return None
+        return None
+
+    def compile(self, robot, check=True):
+        """Encodes every step for the current loop mode and rz of robot, checks the moves against the joint
+        limits with its kinematics, raises OutOfReach naming the step."""
+        kinematics = robot.kinematics if check and robot.config is not None else None
+        rz_reference = robot.state.pose[RZ]
+        loop_mode = robot.loop_mode
+        chunks = []
+        steps = []
+        for index, (name, arguments) in enumerate(self.steps):
+            if name == 'wait':
+                steps.append([WAIT, 0, arguments['seconds']])
+            elif name in _IO:
+                command = self._io_command(name, arguments)
+                chunks.append(command)
+                if name == 'set_io_teensy':
+                    steps.append([ACK, len(command), 1])
+                elif steps and steps[-1][0] == IO:
+                    # consecutive IO board commands go out as one batch
+                    steps[-1][1] += len(command)
+                    steps[-1][2] += 1
+                else:
+                    steps.append([IO, len(command), 1])
+            elif name in _MOVES:
+                arguments = dict(arguments)
+                if name == 'move_l' and np.sign(arguments['rz']) != np.sign(rz_reference):
+                    arguments['rz'] = arguments['rz'] * -1
+                if kinematics is not None:
+                    self._check(kinematics, index, name, arguments)
+                for builder in _MOVES[name]:
+                    parameters = inspect.signature(builder).parameters
+                    command = builder(**{key: value for key, value in arguments.items() if key in parameters},
+                                      loop_mode=loop_mode)
+                    chunks.append(command)
+                    steps.append([MOTION, len(command), 0])
+                rz_reference = self._rz_after(robot, name, arguments, rz_reference)
+            else:
+                raise ProgramError("Unknown program step {}: {}".format(index, name))
+        return CompiledProgram(self.digest(robot), b''.join(chunks), steps, loop_mode, self._rz_sign(robot))
+
+    @staticmethod
+    def _io_command(name, arguments):
+        if name == 'servo_cmd':
+            return AR4_encoding.servo(arguments['number'], arguments['position'])
+        return AR4_encoding.set_output(arguments['output'], arguments['state'])
+
+    @staticmethod
+    def _check(kinematics, index, name, arguments):
+        try:
+            if name in ('move_j', 'move_l'):
+                kinematics.ik(arguments['x'], arguments['y'], arguments['z'], arguments['rx'], arguments['ry'],
+                              arguments['rz'], arguments.get('wrist_config', 'F'))
+            elif name == 'move_r':
+                joints = [arguments['j' + str(joint)] for joint in range(1, 7)]
+                violations = kinematics.limit_violations(joints)
+                if violations:
+                    raise OutOfReach("Position Out of Reach, joint limit of " + ", ".join(
+                        "J" + str(joint) for joint in violations), violations)
+        except OutOfReach as e:
+            raise OutOfReach("step {} {}: {}".format(index, name, e), e.joints)
+
+    @staticmethod
+    def _rz_after(robot, name, arguments, rz_reference):
+        # rz the robot reports after the move, the reference of the next move_l
+        if name == 'move_r':
+            if robot.config is None:
+                return rz_reference
+            return robot.kinematics.fk([arguments['j' + str(joint)] for joint in range(1, 7)])[5]
+        return arguments['rz']
+
+    def load_or_compile(self, robot, cache_dir=PROGRAM_CACHE):
+        """The compiled program from cache_dir when it holds one with the same digest, compiled and stored
+        there otherwise."""
+        digest = self.digest(robot)
+        path = os.path.join(cache_dir, digest + ".ar4p")
+        if os.path.exists(path):
+            try:
+                return CompiledProgram.load(path, digest)
+            except ProgramError as e:
+                logger.warning("Compiling again, cached program unusable", extra=fields(path=path, error=str(e)))
+        compiled = self.compile(robot)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            compiled.save(path)
+        except OSError as e:
+            logger.warning("Unable to cache compiled program", extra=fields(path=path, error=str(e)))
+        return compiled
+
+    def run(self, robot, max_in_flight=1, cache_dir=PROGRAM_CACHE):
+        compiled = self.load_or_compile(robot, cache_dir) if cache_dir else self.compile(robot)
+        return replay(robot, compiled, max_in_flight)
+
+
+class CompiledProgram(object):
+    """The encoded commands of a Program, split into the steps replay sends."""
+
+    def __init__(self, digest, buffer, steps, loop_mode, rz_sign=None):
+        self.digest = digest
+        self.buffer = bytes(buffer)
+        self.steps = [tuple(step) for step in steps]
+        self.loop_mode = loop_mode
+        self.rz_sign = rz_sign
+        self.plan = self._plan()
+
+    def __len__(self):
+        return len(self.steps)
+
+    def _plan(self):
+        # (kind, payload, value) per step, IO payloads are the tuple of their commands
+        plan = []
+        offset = 0
+        for kind, length, value in self.steps:
+            payload = self.buffer[offset:offset + length]
+            offset += length
+            if kind == IO:
+                payload = tuple(line + b'\n' for line in payload.split(b'\n')[:-1])
+                if len(payload) != value:
+                    raise ProgramError("IO step holds {} commands, expected {}".format(len(payload), value))
+            plan.append((kind, payload, value))
+        if offset != len(self.buffer):
+            raise ProgramError("Program buffer holds {} bytes, the steps {}".format(len(self.buffer), offset))
+        return plan
+
+    def save(self, path):
+        header = json.dumps({'format': FORMAT, 'version': FORMAT_VERSION, 'digest': self.digest,
+                             'loop_mode': self.loop_mode, 'rz_sign': self.rz_sign,
+                             'steps': [list(step) for step in self.steps]}, separators=(',', ':'))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header.encode() + b'\n')
+            f.write(self.buffer)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, digest=None):
+        with open(path, "rb") as f:
+            data = f.read()
+        line, _, buffer = data.partition(b'\n')
+        try:
+            header = json.loads(line)
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get('format') != FORMAT:
+            raise ProgramError(path + ": not a compiled AR4 program")
+        if header.get('version') != FORMAT_VERSION:
+            raise ProgramError("{}: program format version {} is not supported".format(path, header.get('version')))
+        if digest is not None and header.get('digest') != digest:
+            raise ProgramError(path + ": digest does not match the program")
+        return cls(header['digest'], buffer, header['steps'], header['loop_mode'], header.get('rz_sign'))
+
+
+def replay(robot, compiled, max_in_flight=1):
+    """Streams a compiled program to robot, returns the number of steps sent.
+
+    Motion replies go through parse_response like the AR4 move methods, an error reply stops the program with
+    ProgramAborted. With max_in_flight above 1 moves are pipelined, IO and waits start once the moves before them
+    are done.
+    """
+    if compiled.loop_mode != robot.loop_mode:
+        raise ProgramError("Program compiled for loop mode {}, robot is in {}".format(compiled.loop_mode,
+                                                                                      robot.loop_mode))
+    if compiled.rz_sign is not None and float(np.sign(robot.state.pose[RZ])) != compiled.rz_sign:
+        raise ProgramError("Program compiled for the other sign of rz, compile it again")
+    if any(kind == IO for kind, payload, value in compiled.plan) and robot.io is None:
+        raise ProgramError("Program uses the IO board, call set_com_gripper first")
+    if max_in_flight > 1:
+        return _replay_pipelined(robot, compiled, max_in_flight)
+    transport = robot.transport
+    for index, (kind, payload, value) in enumerate(compiled.plan):
+        if kind == MOTION:
+            response = str(transport.exchange(payload).strip(), 'utf-8')
+            if response[:1] == 'E':
+                robot.error_handler(response)
+                raise ProgramAborted(index, response)
+            robot.parse_response(response)
+            if is_fault(response):
+                raise ProgramAborted(index, response)
+        elif kind == ACK:
+            transport.exchange(payload, BYTE)
+        elif kind == IO:
+            robot.io.send(payload)
+        else:
+            time.sleep(value)
+    return len(compiled.plan)
+
+
+def _replay_pipelined(robot, compiled, max_in_flight):
+    own_pipeline = robot.pipeline is None
+    robot.start_pipeline(max_in_flight)
+    pending = []
+
+    def settle():
+        robot.pipeline.drain()
+        for index, future in pending:
+            response = future.result() if not future.cancelled() else None
+            if response is None or is_fault(response):
+                raise ProgramAborted(index, response)
+        del pending[:]
+
+    try:
+        for index, (kind, payload, value) in enumerate(compiled.plan):
+            if kind == MOTION:
+                pending.append((index, robot.pipeline.submit(payload)))
+                continue
+            settle()
+            if kind == ACK:
+                robot.transport.exchange(payload, BYTE)
+            elif kind == IO:
+                robot.io.send(payload)
+            else:
+                time.sleep(value)
+        settle()
+    finally:
+        if own_pipeline:
+            robot.stop_pipeline()
+    return len(compiled.plan)
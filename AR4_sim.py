@@ -0,0 +1,583 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import os
+import pickle
+import queue
+import random
+import re
+import threading
+import time
+
+import numpy as np
+
+from AR4_calibration import CALIBRATION_FIELDS
+from AR4_io import ARDUINO_RX_BUFFER
+from AR4_kinematics import Kinematics, OutOfReach, AR4_DH_THETA, AR4_DH_ALPHA, AR4_DH_D, AR4_DH_A
+from AR4_log import logger, fields
+from AR4_state import RobotConfig, encoder_counts
+from AR4_trajectory import LINEAR_MAX_SPEED, LINEAR_MAX_ACCELERATION, _trapezoid_time
+
+
+# Simulated Teensy 4.1 controller for running AR4 without hardware, e.g.
+#
+#   robot = AR4_api.AR4("sim")
+#   robot.open(LoopbackSerial(SimController()))
+#
+# or, for programs that open a port by name, PtyBridge(SimController()).port on POSIX.
+
+
+# joint speed and acceleration at 100 %, used for the motion time of MJ and RJ
+JOINT_MAX_SPEED = 90.0            # deg/s
+JOINT_MAX_ACCELERATION = 180.0    # deg/s^2
+
+# replies of the commands that only acknowledge, the host reads a single byte
+ACK = b'1'
+
+ERROR_CODES = ('EL', 'EC', 'ER', 'EB')
+
+# move fields, longest tags first so Rnd is not read as Rz and J7 not as J
+_MOVE_FIELD_RE = re.compile(r'(Rnd|R[zyx]|J[789]|S[psm]|Ac|Dc|Rm|Tr|Lm|[CBPE][xyz]|[XYZQA-I])(-?[\d.]*)|W([FN]?)')
+_CALIBRATE_RE = re.compile(r'LLA(\d)B(\d)C(\d)D(\d)E(\d)F(\d)G(\d)H(\d)I(\d)')
+# tags of the UP command in the order of AR4_commands.update_params
+_UPDATE_TAGS = tuple('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz!@#$%^&*()') + (' + ',) + tuple('=,_<>?{}~')
+
+
+def default_calibration():
+    # calibration list in the order of the ARbot.cal file, with the default AR4 DH table and limits
+    values = dict.fromkeys(CALIBRATION_FIELDS, '0')
+    joints = range(1, 7)
+    values['J5AngCur'] = '90'                                            # tool pointing down
+    values.update(('J{}CalStatVal'.format(j), '1') for j in joints)
+    for j, pos_lim, neg_lim in zip(joints, ('170', '90', '52', '165', '105', '155'),
+                                   ('170', '42', '89', '165', '105', '155')):
+        values['J{}PosLim'.format(j)] = pos_lim
+        values['J{}NegLim'.format(j)] = neg_lim
+    for template, column in (('J{}StepDeg', ('44.4444', '55.5555', '55.5555', '42.7266', '21.8602', '22.2222')),
+                             ('J{}DriveMS', ('400',) * 6),
+                             ('J{}EncCPR', ('4000',) * 6),
+                             ('J{}ΘDHpar', AR4_DH_THETA),
+                             ('J{}αDHpar', AR4_DH_ALPHA),
+                             ('J{}dDHpar', AR4_DH_D),
+                             ('J{}aDHpar', AR4_DH_A)):
+        values.update((template.format(j), '{:g}'.format(float(value))) for j, value in zip(joints, column))
+    return [values[key] for key in CALIBRATION_FIELDS]
+
+
+def write_calibration(path="ARbot.cal", values=None):
+    with open(path, "wb") as f:
+        pickle.dump(default_calibration() if values is None else values, f)
+
+
+def parse_update_params(command):
+    # RobotConfig from an UP command, the fields the command does not carry are zero
+    values = []
+    position = 2
+    for index, tag in enumerate(_UPDATE_TAGS):
+        position = command.index(tag, position) + len(tag)
+        end = command.find(_UPDATE_TAGS[index + 1], position) if index + 1 < len(_UPDATE_TAGS) else len(command)
+        values.append(float(command[position:end]))
+    return RobotConfig(tool_frame=values[0:6], mot_dir=[int(v) for v in values[6:15]],
+                       cal_dir=[int(v) for v in values[15:24]], pos_lim=values[24:36:2], neg_lim=values[25:36:2],
+                       step_deg=values[36:42], enc_mult=values[42:48], dh_theta=values[48:54],
+                       dh_alpha=values[54:60], dh_d=values[60:66], dh_a=values[66:72], cal_offset=[0.0] * 9)
+
+
+class SimController(object):
+    """Simulated AR4 controller, answers the command strings of AR4_commands like the Teensy firmware.
+
+    handle takes one command line and returns the reply bytes and the time the controller needs before it
+    answers: latency for every command, plus the motion time of moves computed from the speed, acceleration
+    and deceleration fields with a trapezoidal profile, scaled by time_scale (0 answers moves at once).
+
+    With the DH table of the UP command, or config, moves are solved with Kinematics, so targets out of reach
+    or beyond the joint limits get ER and EL replies like on the robot. Further errors are injected with inject,
+    or at random with fault_rate, seeded for reproducible runs. With solve False the UP command is ignored and
+    moves only update the Cartesian pose, which keeps the cost of the simulator out of benchmarks.
+
+    encoders hold the RE counts. They read 0 after power up, LL sets them from the angle of the homed joints and
+    with kinematics they follow the moves, while SP only changes the pose the controller believes in.
+    """
+
+    def __init__(self, config=None, latency=.0005, latencies=None, time_scale=1.0, fault_rate=0.0, seed=None,
+                 solve=True, max_joint_speed=JOINT_MAX_SPEED, max_joint_acceleration=JOINT_MAX_ACCELERATION,
+                 max_linear_speed=LINEAR_MAX_SPEED, max_linear_acceleration=LINEAR_MAX_ACCELERATION):
+        self.latency = latency
+        self.solve = solve
+        self.latencies = dict(latencies or {})
+        self.time_scale = time_scale
+        self.fault_rate = fault_rate
+        self.max_joint_speed = max_joint_speed
+        self.max_joint_acceleration = max_joint_acceleration
+        self.max_linear_speed = max_linear_speed
+        self.max_linear_acceleration = max_linear_acceleration
+        self.joints = np.zeros(9)
+        self.cartesian = np.zeros(6)
+        self.kinematics = None
+        self.spline_active = False
+        self.speed_violation = False
+        self.outputs = {}
+        self.servos = {}
+        self.encoders = [0] * 6
+        self.limit_switches = [0] * 6
+        self.commands = 0
+        self._injected = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        if config is not None:
+            self.configure(config)
+
+    def configure(self, config):
+        self.kinematics = Kinematics(config)
+        self.cartesian[:] = self.kinematics.fk(self.joints[:6])
+
+    def inject(self, code, prefix=None, count=1, joint=1):
+        """Answer the next count commands starting with prefix, any move when prefix is None, with an error.
+
+        code is EL, EC, ER or EB, joint selects the axis of a limit or collision error.
+        """
+        if code not in ERROR_CODES:
+            raise ValueError("Unknown error code: " + str(code))
+        with self._lock:
+            self._injected.append([code, prefix, count, joint])
+
+    # ------------------------- #
+    #  Command Handling         #
+    # ------------------------- #
+    def handle(self, command):
+        if isinstance(command, (bytes, bytearray)):
+            command = command.decode('utf-8', 'replace')
+        command = command.strip()
+        prefix = command[:2]
+        self.commands += 1
+        delay = self.latencies.get(prefix, self.latency)
+        error = self._error_for(prefix)
+        if error is not None:
+            return error, delay
+        handler = self._HANDLERS.get(prefix)
+        if handler is None:
+            logger.warning("Simulator ignored unknown command", extra=fields(command=command))
+            return b'', delay
+        try:
+            reply, motion = handler(self, command)
+        except OutOfReach as e:
+            reply, motion = self._reach_error(e), 0.0
+        return reply, delay + motion * self.time_scale
+
+    def _error_for(self, prefix):
+        with self._lock:
+            for entry in self._injected:
+                code, match, count, joint = entry
+                if (match is None and prefix in _MOVES) or match == prefix:
+                    entry[2] -= 1
+                    if entry[2] <= 0:
+                        self._injected.remove(entry)
+                    return self._error_reply(code, joint)
+        if self.fault_rate and prefix in _MOVES and self._random.random() < self.fault_rate:
+            return self._error_reply(self._random.choice(('EL', 'EC', 'ER')), self._random.randint(1, 6))
+        return None
+
+    @staticmethod
+    def _error_reply(code, joint):
+        if code == 'EL':
+            return ('EL' + ''.join('1' if i == joint else '0' for i in range(1, 10)) + '\n').encode()
+        if code == 'EC':
+            return ('EC' + ''.join('1' if i == joint else '0' for i in range(1, 7)) + '\n').encode()
+        return (code + '\n').encode()
+
+    @staticmethod
+    def _reach_error(error):
+        # ik names the violated joints when the pose is reachable but outside the limits
+        if error.joints:
+            return ('EL' + ''.join('1' if i in error.joints else '0' for i in range(1, 10)) + '\n').encode()
+        return b'ER\n'
+
+    def position_reply(self, flag=''):
+        j = self.joints
+        x, y, z, rx, ry, rz = self.cartesian
+        return ("A{:.3f}B{:.3f}C{:.3f}D{:.3f}E{:.3f}F{:.3f}G{:.3f}H{:.3f}I{:.3f}J{:.3f}K{:.3f}L{:.3f}"
+                "M{}NO{}P{:.3f}Q{:.3f}R{:.3f}\n").format(j[0], j[1], j[2], j[3], j[4], j[5], x, y, z, rz, ry, rx,
+                                                        int(self.speed_violation), flag, j[6], j[7], j[8]).encode()
+
+    # ---- moves ---- #
+    def _move_j(self, command):
+        fields = _move_fields(command)
+        target = self._pose(fields)
+        joints = self._solve(target, fields)
+        return self._joint_move(joints, fields, target)
+
+    def _move_r(self, command):
+        fields = _move_fields(command)
+        joints = np.array([fields.get(tag, 0.0) for tag in 'ABCDEF'])
+        if self.kinematics is not None:
+            violations = self.kinematics.limit_violations(joints)
+            if violations:
+                raise OutOfReach("joint limit of " + ", ".join("J" + str(joint) for joint in violations), violations)
+        target = self.kinematics.fk(joints) if self.kinematics is not None else self.cartesian.copy()
+        return self._joint_move(joints, fields, target)
+
+    def _move_l(self, command):
+        fields = _move_fields(command)
+        target = self._pose(fields)
+        joints = self._solve(target, fields)
+        distance = float(np.linalg.norm(target[:3] - self.cartesian[:3]))
+        seconds = self._linear_time(distance, fields)
+        self._arrive(joints, target, fields)
+        return self.position_reply(), seconds
+
+    def _move_a(self, command):
+        # arc from the current position over X, Y, Z to Ex, Ey, Ez, timed along the two chords
+        fields = _move_fields(command)
+        mid = np.array([fields['X'], fields['Y'], fields['Z']])
+        target = self._pose(fields)
+        target[:3] = fields['Ex'], fields['Ey'], fields['Ez']
+        joints = self._solve(target, fields)
+        distance = float(np.linalg.norm(mid - self.cartesian[:3]) + np.linalg.norm(target[:3] - mid))
+        seconds = self._linear_time(distance, fields)
+        self._arrive(joints, target, fields)
+        return self.position_reply(), seconds
+
+    def _move_c(self, command):
+        # full circle around Cx, Cy, Cz through the start point Bx, By, Bz, ends where it started
+        fields = _move_fields(command)
+        center = np.array([fields['Cx'], fields['Cy'], fields['Cz']])
+        start = np.array([fields['Bx'], fields['By'], fields['Bz']])
+        seconds = self._linear_time(2.0 * np.pi * float(np.linalg.norm(start - center)), fields)
+        return self.position_reply(), seconds
+
+    def _pose(self, fields):
+        return np.array([fields['X'], fields['Y'], fields['Z'], fields['Rx'], fields['Ry'], fields['Rz']])
+
+    def _solve(self, target, fields):
+        if self.kinematics is None:
+            return self.joints[:6].copy()
+        return self.kinematics.ik(*target, wrist_config=fields.get('W') or 'F')
+
+    def _joint_move(self, joints, fields, target):
+        travel = float(np.max(np.abs(joints - self.joints[:6]))) if len(joints) else 0.0
+        speed, acceleration, deceleration = self._profile(fields, self.max_joint_speed, self.max_joint_acceleration)
+        seconds = speed if fields.get('unit') == 's' else _trapezoid_time(travel, speed, acceleration, deceleration)
+        self._arrive(joints, target, fields)
+        return self.position_reply(), seconds
+
+    def _linear_time(self, distance, fields):
+        speed, acceleration, deceleration = self._profile(fields, self.max_linear_speed, self.max_linear_acceleration)
+        if fields.get('unit') == 's':
+            return speed
+        if self.spline_active:
+            # segments of a spline blend into each other, no ramp between them
+            return distance / speed if speed > 0 else 0.0
+        return _trapezoid_time(distance, speed, acceleration, deceleration)
+
+    def _profile(self, fields, max_speed, max_acceleration):
+        unit = fields.get('unit', 'p')
+        speed = fields.get('speed', 25.0)
+        if unit == 'p':
+            speed = max_speed * speed / 100.0
+        self.speed_violation = unit == 'm' and speed > max_speed
+        speed = min(speed, max_speed) if unit != 's' else speed
+        acceleration = max_acceleration * fields.get('Ac', 20.0) / 100.0
+        deceleration = max_acceleration * fields.get('Dc', 20.0) / 100.0
+        return speed, max(acceleration, 1e-6), max(deceleration, 1e-6)
+
+    def _arrive(self, joints, target, fields):
+        if self.kinematics is not None:
+            # the encoders count the travel, whatever pose the controller was told with SP
+            moved = np.subtract(encoder_counts(self.kinematics.config, joints),
+                                encoder_counts(self.kinematics.config, self.joints[:6]))
+            self.encoders = [count + int(delta) for count, delta in zip(self.encoders, moved)]
+        self.joints[:6] = joints
+        for index, tag in enumerate(('J7', 'J8', 'J9'), start=6):
+            self.joints[index] = fields.get(tag, self.joints[index])
+        self.cartesian[:] = target
+
+    # ---- position and setup ---- #
+    def _request_pos(self, command):
+        return self.position_reply(), 0.0
+
+    def _send_pos(self, command):
+        fields = _move_fields(command)
+        self.joints[:] = [fields.get(tag, 0.0) for tag in 'ABCDEFGHI']
+        if self.kinematics is not None:
+            self.cartesian[:] = self.kinematics.fk(self.joints[:6])
+        return ACK, 0.0
+
+    def _update_params(self, command):
+        if not self.solve:
+            return ACK, 0.0
+        try:
+            self.configure(parse_update_params(command))
+        except (ValueError, IndexError) as e:
+            logger.warning("Simulator could not read UP command, kinematics disabled", extra=fields(error=str(e)))
+            self.kinematics = None
+        return ACK, 0.0
+
+    def _set_tcp(self, command):
+        fields = re.match(r'TFA(.*)B(.*)C(.*)D(.*)E(.*)F(.*)$', command)
+        if fields is not None and self.kinematics is not None:
+            x, y, z, rz, ry, rx = map(float, fields.groups())
+            self.configure(self.kinematics.config.replace(tool_frame=(x, y, z, rz, ry, rx)))
+        return ACK, 0.0
+
+    def _calibrate(self, command):
+        flags = _CALIBRATE_RE.match(command)
+        if flags is None:
+            return b'EA0\n', 0.0
+        homed = [flag == '1' for flag in flags.groups()]
+        count = sum(homed)
+        counts = [1000] * 6 if self.kinematics is None else encoder_counts(self.kinematics.config, self.joints[:6])
+        self.encoders = [counts[i] if homed[i] else self.encoders[i] for i in range(6)]
+        # every joint drives to its limit switch and back, about two seconds each at full speed
+        return self.position_reply(), 2.0 * count
+
+    def _start_spline(self, command):
+        self.spline_active = True
+        return self.position_reply(), 0.0
+
+    def _stop_spline(self, command):
+        self.spline_active = False
+        return self.position_reply(), 0.0
+
+    # ---- io ---- #
+    def _output(self, command):
+        self.outputs[command[3:]] = command[:2] == 'ON'
+        return ACK, 0.0
+
+    def _servo(self, command):
+        number, _, position = command[2:].partition('P')
+        self.servos[number] = position
+        return ACK, 0.0
+
+    def _test_limits(self, command):
+        return ("   ".join("J{} = {}".format(i, state) for i, state in enumerate(self.limit_switches, 1))
+                + "\n").encode(), 0.0
+
+    def _set_encoders(self, command):
+        self.encoders = [1000] * 6
+        return ACK, 0.0
+
+    def _read_encoders(self, command):
+        return ("   ".join("J{} = {}".format(i, count) for i, count in enumerate(self.encoders, 1))
+                + "\n").encode(), 0.0
+
+    _HANDLERS = {
+        'MJ': _move_j, 'ML': _move_l, 'RJ': _move_r, 'MC': _move_c, 'MA': _move_a,
+        'RP': _request_pos, 'CP': _request_pos, 'SP': _send_pos, 'UP': _update_params, 'TF': _set_tcp,
+        'LL': _calibrate, 'SL': _start_spline, 'SS': _stop_spline,
+        'ON': _output, 'OF': _output, 'SV': _servo, 'TL': _test_limits, 'SE': _set_encoders, 'RE': _read_encoders,
+    }
+
+
+_MOVES = ('MJ', 'ML', 'RJ', 'MC', 'MA')
+
+
+def _move_fields(command):
+    fields = {}
+    for match in _MOVE_FIELD_RE.finditer(command, 2):
+        tag, value, wrist = match.groups()
+        if tag is None:
+            fields['W'] = wrist
+        elif tag[0] == 'S' and len(tag) == 2 and tag[1] in 'psm':
+            fields['unit'] = 's' if tag == 'Ss' else tag[1]
+            fields['speed'] = float(value) if value else 0.0
+        elif tag == 'Lm':
+            fields[tag] = value
+        elif value:
+            fields[tag] = float(value)
+    return fields
+
+
+class IOBoardSim(object):
+    """Stand-in for the Arduino IO board of the gripper, answers ON, OF and SV with one byte like the board.
+
+    latency is the time the board needs per command, link_latency the round trip of the USB serial adapter, paid
+    once per write however many commands it carries. With rx_buffer set, bytes written while that many are
+    waiting to be read by the board are lost and counted in overruns, like on the board. Unknown commands get no
+    reply.
+    """
+
+    def __init__(self, latency=.0002, link_latency=0.0, rx_buffer=ARDUINO_RX_BUFFER):
+        self.latency = latency
+        self.link_latency = link_latency
+        self.rx_buffer = rx_buffer
+        self.outputs = {}
+        self.servos = {}
+        self.commands = 0
+        self.overruns = 0
+        self.history = []
+
+    def handle(self, command):
+        if isinstance(command, (bytes, bytearray)):
+            command = command.decode('utf-8', 'replace')
+        command = command.strip()
+        prefix = command[:2]
+        if prefix in ('ON', 'OF'):
+            self.outputs[command[3:]] = prefix == 'ON'
+        elif prefix == 'SV':
+            number, _, position = command[2:].partition('P')
+            self.servos[number] = position
+        else:
+            logger.warning("IO board ignored unknown command", extra=fields(command=command))
+            return b'', self.latency
+        self.commands += 1
+        self.history.append(command)
+        return ACK, self.latency
+
+
+class _Runner(object):
+    # executes commands one after the other like the controller and delivers every reply after its delay
+
+    def __init__(self, controller, deliver):
+        self.controller = controller
+        self.deliver = deliver
+        self._lines = queue.Queue()
+        self._partial = bytearray()
+        # bytes received and not yet taken by the controller, for its receive buffer
+        self._waiting = 0
+        self._feed_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="AR4-sim", daemon=True)
+        self._thread.start()
+
+    def feed(self, data):
+        with self._feed_lock:
+            rx_buffer = getattr(self.controller, 'rx_buffer', None)
+            if rx_buffer is not None and self._waiting + len(data) > rx_buffer:
+                self.controller.overruns += 1
+                data = data[:max(rx_buffer - self._waiting, 0)]
+            self._waiting += len(data)
+            self._partial += data
+            arrival = time.monotonic() + getattr(self.controller, 'link_latency', 0.0)
+            while True:
+                index = self._partial.find(b'\n')
+                if index < 0:
+                    return
+                self._lines.put((bytes(self._partial[:index]), arrival))
+                del self._partial[:index + 1]
+
+    def stop(self):
+        self._lines.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._lines.get()
+            if item is None:
+                return
+            line, arrival = item
+            wait = arrival - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            with self._feed_lock:
+                self._waiting -= len(line) + 1
+            reply, delay = self.controller.handle(line)
+            if delay > 0:
+                time.sleep(delay)
+            if reply:
+                self.deliver(reply)
+
+
+class LoopbackSerial(object):
+    """pyserial compatible port connected to a SimController, pass it to AR4.open or SerialTransport."""
+
+    def __init__(self, controller=None, port="sim", baudrate=9600):
+        self.controller = controller if controller is not None else SimController()
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = None
+        self.is_open = True
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+        self._runner = _Runner(self.controller, self._deliver)
+
+    def _deliver(self, data):
+        with self._cond:
+            self._buffer += data
+            self._cond.notify_all()
+
+    @property
+    def in_waiting(self):
+        return len(self._buffer)
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        self._runner.feed(data)
+        return len(data)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cond:
+            while not self._buffer:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return b''
+                self._cond.wait(remaining)
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            return data
+
+    def readline(self):
+        line = bytearray()
+        while not line.endswith(b'\n'):
+            data = self.read(1)
+            if not data:
+                break
+            line += data
+        return bytes(line)
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._buffer.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self._runner.stop()
+
+
+class PtyBridge(object):
+    """Serves a SimController on a pseudo terminal, open port with serial.Serial or AR4 like a real controller.
+
+    POSIX only.
+    """
+
+    def __init__(self, controller=None):
+        import tty
+        self.controller = controller if controller is not None else SimController()
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._runner = _Runner(self.controller, self._deliver)
+        self._thread = threading.Thread(target=self._read_loop, name="AR4-sim-pty", daemon=True)
+        self._thread.start()
+
+    def _deliver(self, data):
+        os.write(self._master, data)
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+            if data:
+                self._runner.feed(data)
+
+    def close(self):
+        self._running = False
+        self._runner.stop()
+        os.close(self._slave)
+        os.close(self._master)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
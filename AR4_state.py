@@ -0,0 +1,132 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import numpy as np
+
+
+# index of every value in RobotState.pose
+J1, J2, J3, J4, J5, J6 = range(0, 6)
+X, Y, Z, RX, RY, RZ = range(6, 12)
+J7, J8, J9 = range(12, 15)
+POSE_SIZE = 15
+
+# calibration keys holding the pose, in pose order
+POSE_KEYS = ('J1AngCur', 'J2AngCur', 'J3AngCur', 'J4AngCur', 'J5AngCur', 'J6AngCur',
+             'XcurPos', 'YcurPos', 'ZcurPos', 'RxcurPos', 'RycurPos', 'RzcurPos',
+             'J7PosCur', 'J8PosCur', 'J9PosCur')
+
+
+def pose_fields(pose):
+    # the pose in the format of the calibration dict, angles and positions as strings, external axes as floats
+    values = {key: str(float(pose[index])) for index, key in enumerate(POSE_KEYS[:J7])}
+    values.update({key: float(pose[index]) for index, key in enumerate(POSE_KEYS[J7:], start=J7)})
+    return values
+
+
+def encoder_angles(config, counts):
+    # J1..J6 angles of RE encoder counts, the firmware counts enc_mult per step from the negative limit on
+    return tuple(count / (mult * step) - neg
+                 for count, mult, step, neg in zip(counts, config.enc_mult, config.step_deg, config.neg_lim))
+
+
+def encoder_counts(config, angles):
+    return tuple(int(round((angle + neg) * step * mult))
+                 for angle, mult, step, neg in zip(angles, config.enc_mult, config.step_deg, config.neg_lim))
+
+
+def _floats(calibration, template, joints):
+    return tuple(float(calibration[template.format(joint)]) for joint in joints)
+
+
+class RobotConfig(object):
+    """Static robot configuration, parsed once from the calibration dict and immutable afterwards.
+
+    Per joint values are tuples ordered J1 to J6, or J1 to J9 for the values that also exist for the external axes.
+    Use replace to derive a configuration with some fields changed, e.g. after a new tool frame is set.
+    """
+
+    __slots__ = ('dh_theta', 'dh_alpha', 'dh_d', 'dh_a', 'tool_frame', 'mot_dir', 'cal_dir',
+                 'pos_lim', 'neg_lim', 'step_deg', 'enc_mult', 'cal_offset')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, tuple(fields[name]))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RobotConfig is immutable, use replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError("RobotConfig is immutable, use replace()")
+
+    def __eq__(self, other):
+        return isinstance(other, RobotConfig) and all(getattr(self, name) == getattr(other, name)
+                                                      for name in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        return "RobotConfig(" + ", ".join(name + "=" + repr(getattr(self, name)) for name in self.__slots__) + ")"
+
+    def __reduce__(self):
+        # pickled by field values, __setattr__ would refuse the default slot restore
+        return _restore_config, ({name: getattr(self, name) for name in self.__slots__},)
+
+    def replace(self, **changes):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return RobotConfig(**fields)
+
+    @classmethod
+    def from_calibration(cls, calibration):
+        six = range(1, 7)
+        nine = range(1, 10)
+        drive_ms = _floats(calibration, 'J{}DriveMS', six)
+        enc_cpr = _floats(calibration, 'J{}EncCPR', six)
+        return cls(dh_theta=_floats(calibration, 'J{}ΘDHpar', six),
+                   dh_alpha=_floats(calibration, 'J{}αDHpar', six),
+                   dh_d=_floats(calibration, 'J{}dDHpar', six),
+                   dh_a=_floats(calibration, 'J{}aDHpar', six),
+                   # x, y, z, rz, ry, rx like the TF command and the tool frame of update_params
+                   tool_frame=tuple(float(calibration[key]) for key in ('TFx', 'TFy', 'TFz', 'TFrz', 'TFry', 'TFrx')),
+                   mot_dir=tuple(int(float(calibration['J{}MotDir'.format(joint)])) for joint in nine),
+                   cal_dir=tuple(int(float(calibration['J{}CalDir'.format(joint)])) for joint in nine),
+                   pos_lim=_floats(calibration, 'J{}PosLim', six),
+                   neg_lim=_floats(calibration, 'J{}NegLim', six),
+                   step_deg=_floats(calibration, 'J{}StepDeg', six),
+                   enc_mult=tuple(cpr / ms for cpr, ms in zip(enc_cpr, drive_ms)),
+                   cal_offset=_floats(calibration, 'J{}calOff', nine))
+
+
+def _restore_config(fields):
+    return RobotConfig(**fields)
+
+
+class RobotState(object):
+    """Live robot pose, updated in place from every position reply.
+
+    pose is one preallocated float array: joints J1 to J6, then X, Y, Z, Rx, Ry, Rz and the external axes J7 to J9.
+    joints, cartesian and external are views on it.
+    """
+
+    __slots__ = ('pose', 'joints', 'cartesian', 'external', 'wrist_config', 'speed_violation', 'flag')
+
+    def __init__(self):
+        self.pose = np.zeros(POSE_SIZE)
+        self.joints = self.pose[J1:J6 + 1]
+        self.cartesian = self.pose[X:RZ + 1]
+        self.external = self.pose[J7:J9 + 1]
+        self.wrist_config = ''
+        self.speed_violation = False
+        self.flag = ''
+
+    def load(self, calibration):
+        for index, key in enumerate(POSE_KEYS):
+            try:
+                self.pose[index] = float(calibration[key])
+            except (KeyError, TypeError, ValueError):
+                self.pose[index] = 0.0
+        self.wrist_config = "F" if self.pose[J5] > 0 else "N"
@@ -0,0 +1,123 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import collections
+import threading
+import time
+
+from AR4_log import logger, fields
+
+
+# one parsed position frame, pose is laid out like RobotState.pose
+PoseSample = collections.namedtuple('PoseSample', ('time', 'sequence', 'pose', 'wrist_config', 'speed_violation',
+                                                   'flag'))
+
+
+class Telemetry(object):
+    """Latest pose and a bounded history of every position frame the robot parsed.
+
+    AR4.parse_response publishes every position reply, of moves, request_pos, the pipeline and the poller, so
+    subscribers never send commands of their own. The Teensy firmware does not stream positions by itself, the
+    poller thread started by start asks for one with RP at rate_hz whenever the port is idle. During a blocking
+    move the controller only answers when the move is done, the poller skips those ticks.
+
+    latest and the ring are written without locks, a reader gets a complete sample or the one before it.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.published = 0
+        self._latest = None
+        self._ring = [None] * capacity
+        self._cond = threading.Condition()
+        self._subscribers = 0
+        self._closed = False
+        self._robot = None
+        self._rate_hz = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def publish(self, state):
+        sequence = self.published
+        sample = PoseSample(time.time(), sequence, tuple(state.pose.tolist()), state.wrist_config,
+                            state.speed_violation, state.flag)
+        self._ring[sequence % self.capacity] = sample
+        self._latest = sample
+        self.published = sequence + 1
+        if self._subscribers:
+            with self._cond:
+                self._cond.notify_all()
+
+    def latest(self):
+        return self._latest
+
+    def samples(self, since=None):
+        # samples still in the ring, oldest first, only those after sequence number since when given
+        end = self.published
+        start = max(end - self.capacity, 0 if since is None else since + 1)
+        return [sample for sample in (self._ring[i % self.capacity] for i in range(start, end))
+                if sample is not None and sample.sequence >= start]
+
+    def stream(self, timeout=None, history=False):
+        """Generator of samples as they are published, ends after timeout seconds without one or on close.
+
+        A subscriber that falls more than capacity samples behind skips the samples it missed.
+        """
+        next_sequence = max(self.published - self.capacity, 0) if history else self.published
+        with self._cond:
+            self._subscribers += 1
+        try:
+            while True:
+                with self._cond:
+                    if not self._cond.wait_for(lambda: self.published > next_sequence or self._closed, timeout):
+                        return
+                if self.published <= next_sequence:
+                    return
+                for sample in self.samples(next_sequence - 1):
+                    next_sequence = sample.sequence + 1
+                    yield sample
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+    # ------------------------- #
+    #  Poller                   #
+    # ------------------------- #
+    def start(self, robot, rate_hz=50):
+        self._robot = robot
+        self._rate_hz = rate_hz
+        self._closed = False
+        self._stop.clear()
+        if rate_hz and self._thread is None:
+            self._thread = threading.Thread(target=self._poll, name="AR4-telemetry", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _poll(self):
+        period = 1.0 / self._rate_hz
+        next_tick = time.monotonic()
+        while not self._stop.wait(max(0.0, next_tick - time.monotonic())):
+            next_tick = max(next_tick + period, time.monotonic())
+            robot = self._robot
+            # pipelined commands report their own positions, a busy port will report one when it is done
+            if robot.pipeline is not None or not robot.transport.lock.acquire(blocking=False):
+                continue
+            try:
+                # checked again under the lock, a pipeline registers itself while holding it
+                if robot.transport.pipeline is None:
+                    robot.request_pos()
+            except Exception as e:
+                logger.warning("Telemetry position request failed", extra=fields(error=str(e)))
+            finally:
+                robot.transport.lock.release()
@@ -0,0 +1,222 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import math
+
+import numpy as np
+
+import AR4_encoding
+from AR4_kinematics import OutOfReach
+from AR4_state import RZ
+
+
+# linear speed and acceleration at 100 %, only used to estimate the cycle time of 'Sp' moves
+LINEAR_MAX_SPEED = 250.0          # mm/s
+LINEAR_MAX_ACCELERATION = 500.0   # mm/s^2
+
+# columns of a waypoint row
+_POSITION = slice(0, 3)
+_ORIENTATION = slice(3, 6)
+_EXTERNAL = slice(6, 9)
+
+
+class Trajectory(object):
+    """A linear path through Cartesian waypoints, sent to the controller as one spline.
+
+    Waypoints are x, y, z, rx, ry, rz and optionally j7, j8, j9 like the arguments of move_l. Before sending,
+    optimize drops waypoints closer than merge_tolerance mm to the previous one and waypoints that lie within
+    collinear_tolerance mm of the straight line between their neighbours, and every remaining corner gets a rnd
+    blend radius of blend_fraction times its shortest adjacent segment, capped at max_rnd mm.
+
+    run brackets the move_l commands with start_spline and end_spline and submits them through the motion
+    pipeline, so the controller blends from one segment into the next instead of stopping at every waypoint.
+    """
+
+    def __init__(self, spd_prefix='Sp', speed=25, acceleration=20, deceleration=20, acc_ramp=100, wrist_config='F',
+                 dis_wrist=False, merge_tolerance=0.5, collinear_tolerance=0.1, angle_tolerance=0.5,
+                 blend_fraction=0.4, max_rnd=20.0):
+        self.spd_prefix = spd_prefix
+        self.speed = speed
+        self.acceleration = acceleration
+        self.deceleration = deceleration
+        self.acc_ramp = acc_ramp
+        self.wrist_config = wrist_config
+        self.dis_wrist = dis_wrist
+        self.merge_tolerance = merge_tolerance
+        self.collinear_tolerance = collinear_tolerance
+        self.angle_tolerance = angle_tolerance
+        self.blend_fraction = blend_fraction
+        self.max_rnd = max_rnd
+        self.waypoints = np.empty((0, 9))
+        self.rnd = np.empty(0)
+
+    def __len__(self):
+        return len(self.waypoints)
+
+    def add(self, x, y, z, rx, ry, rz, j7=0.0, j8=0.0, j9=0.0):
+        self.extend([(x, y, z, rx, ry, rz, j7, j8, j9)])
+        return self
+
+    def extend(self, waypoints):
+        # rows of x, y, z, rx, ry, rz with optional j7, j8, j9
+        rows = np.atleast_2d(np.asarray(waypoints, dtype=float))
+        if rows.shape[1] not in (6, 9):
+            raise ValueError("Waypoints need 6 or 9 values, got " + str(rows.shape[1]))
+        if rows.shape[1] == 6:
+            rows = np.hstack((rows, np.zeros((len(rows), 3))))
+        self.waypoints = np.vstack((self.waypoints, rows))
+        self.rnd = np.empty(0)
+        return self
+
+    # ------------------------- #
+    #  Path Optimization        #
+    # ------------------------- #
+    def optimize(self):
+        """Merge near duplicate and collinear waypoints and choose the blend radius of every corner.
+
+        Returns the number of waypoints that were removed.
+        """
+        count = len(self.waypoints)
+        if count > 2:
+            self.waypoints = self.waypoints[self._keep()]
+        self.rnd = self._blend_radii()
+        return count - len(self.waypoints)
+
+    def _keep(self):
+        points = self.waypoints
+        keep = [0]
+        for i in range(1, len(points)):
+            if self._same(points[keep[-1]], points[i]) and i < len(points) - 1:
+                continue
+            if i < len(points) - 1 and self._covered(points[keep[-1]], points[keep[-1] + 1:i + 1], points[i + 1]):
+                continue
+            keep.append(i)
+        # the last waypoint always stays, it replaces a kept point that merely duplicates it
+        if len(keep) > 1 and self._same(points[keep[-2]], points[keep[-1]]):
+            del keep[-2]
+        return keep
+
+    def _same(self, a, b):
+        return (np.linalg.norm(a[_POSITION] - b[_POSITION]) < self.merge_tolerance
+                and np.all(np.abs(_angle_difference(a[_ORIENTATION], b[_ORIENTATION])) < self.angle_tolerance)
+                and np.all(np.abs(a[_EXTERNAL] - b[_EXTERNAL]) < self.merge_tolerance))
+
+    def _covered(self, start, skipped, end):
+        # True when the straight move from start to end passes every skipped waypoint within the tolerances
+        direction = end[_POSITION] - start[_POSITION]
+        length = np.dot(direction, direction)
+        if length == 0.0:
+            return False
+        offsets = skipped[:, _POSITION] - start[_POSITION]
+        t = np.clip(offsets @ direction / length, 0.0, 1.0)
+        deviation = np.linalg.norm(offsets - t[:, None] * direction, axis=1)
+        if np.any(deviation > self.collinear_tolerance):
+            return False
+        # orientation and external axes are interpolated along the segment as well
+        orientation = start[_ORIENTATION] + t[:, None] * _angle_difference(end[_ORIENTATION], start[_ORIENTATION])
+        if np.any(np.abs(_angle_difference(skipped[:, _ORIENTATION], orientation)) > self.angle_tolerance):
+            return False
+        external = start[_EXTERNAL] + t[:, None] * (end[_EXTERNAL] - start[_EXTERNAL])
+        return not np.any(np.abs(skipped[:, _EXTERNAL] - external) > self.merge_tolerance)
+
+    def _blend_radii(self):
+        rnd = np.zeros(len(self.waypoints))
+        if len(self.waypoints) > 2:
+            lengths = self.segment_lengths()
+            rnd[1:-1] = np.minimum(self.max_rnd, self.blend_fraction * np.minimum(lengths[:-1], lengths[1:]))
+        return np.round(rnd, 1)
+
+    def segment_lengths(self):
+        return np.linalg.norm(np.diff(self.waypoints[:, _POSITION], axis=0), axis=1)
+
+    # ------------------------- #
+    #  Cycle Time               #
+    # ------------------------- #
+    def cycle_time(self, blended=True, max_speed=LINEAR_MAX_SPEED, max_acceleration=LINEAR_MAX_ACCELERATION):
+        """Estimated time in seconds to run the path.
+
+        blended assumes the spline keeps the speed through every corner and only ramps up at the start and down at
+        the end, with blended False every segment accelerates and stops like separate move_l calls. max_speed and
+        max_acceleration are the linear speed and acceleration at 100 %, the result is an estimate, not a promise
+        of the controller.
+        """
+        lengths = self.segment_lengths()
+        if not len(lengths):
+            return 0.0
+        if self.spd_prefix == 'Ss':
+            # speed is the duration of every move in seconds
+            return float(self.speed * len(lengths))
+        speed = self.speed if self.spd_prefix == 'Sm' else max_speed * self.speed / 100.0
+        acceleration = max_acceleration * self.acceleration / 100.0
+        deceleration = max_acceleration * self.deceleration / 100.0
+        if blended:
+            return _trapezoid_time(float(lengths.sum()), speed, acceleration, deceleration)
+        return sum(_trapezoid_time(float(length), speed, acceleration, deceleration) for length in lengths)
+
+    # ------------------------- #
+    #  Emission                 #
+    # ------------------------- #
+    def check_reach(self, kinematics):
+        # raises OutOfReach before anything is sent when a waypoint can not be reached within the joint limits
+        joints, valid = kinematics.ik_batch(self.waypoints[:, :6], self.wrist_config)
+        if not np.all(valid):
+            index = int(np.argmin(valid))
+            x, y, z = self.waypoints[index, _POSITION]
+            raise OutOfReach("Position Out of Reach: waypoint {} X{:.3f} Y{:.3f} Z{:.3f}".format(index, x, y, z))
+
+    def commands(self, loop_mode='', rz_reference=None):
+        """The encoded move_l commands of the path, without the spline brackets.
+
+        Like AR4.move_l, rz is flipped when its sign differs from the previous one, starting from rz_reference.
+        """
+        if len(self.rnd) != len(self.waypoints):
+            self.rnd = self._blend_radii()
+        commands = []
+        for (x, y, z, rx, ry, rz, j7, j8, j9), rnd in zip(self.waypoints.tolist(), self.rnd.tolist()):
+            if rz_reference is not None and np.sign(rz) != np.sign(rz_reference):
+                rz = rz * -1
+            rz_reference = rz
+            commands.append(AR4_encoding.move_l(x, y, z, rx, ry, rz, j7, j8, j9, self.spd_prefix, self.speed,
+                                                self.acceleration, self.deceleration, self.acc_ramp, rnd,
+                                                self.wrist_config, self.dis_wrist, loop_mode))
+        return commands
+
+    def run(self, robot, max_in_flight=4, check_reach=True):
+        """Send the path to the robot as one spline block and return the futures of the commands.
+
+        Uses the pipeline of the robot when it has one, otherwise a pipeline is started for the block and stopped
+        again once all replies are in.
+        """
+        if len(self.waypoints) < 2:
+            raise ValueError("A trajectory needs at least two waypoints")
+        if check_reach:
+            self.check_reach(robot.kinematics)
+        commands = self.commands(robot.loop_mode, robot.state.pose[RZ])
+        own_pipeline = robot.pipeline is None
+        robot.start_pipeline(max_in_flight)
+        try:
+            futures = [robot.start_spline()]
+            futures += [robot.send_command(command) for command in commands]
+            futures.append(robot.end_spline())
+        finally:
+            if own_pipeline:
+                robot.stop_pipeline()
+        return futures
+
+
+def _angle_difference(a, b):
+    return (np.asarray(a) - b + 180.0) % 360.0 - 180.0
+
+
+def _trapezoid_time(length, speed, acceleration, deceleration):
+    # time to travel length with a trapezoidal speed profile, triangular when the top speed is never reached
+    if length <= 0.0:
+        return 0.0
+    ramp = speed * speed / 2.0 * (1.0 / acceleration + 1.0 / deceleration)
+    if ramp <= length:
+        return speed / acceleration + speed / deceleration + (length - ramp) / speed
+    peak = math.sqrt(2.0 * length / (1.0 / acceleration + 1.0 / deceleration))
+    return peak / acceleration + peak / deceleration
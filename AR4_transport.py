@@ -0,0 +1,209 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import logging
+import threading
+import time
+
+from AR4_log import logger, fields
+
+
+LINE = 'line'
+BYTE = 'byte'
+_DEFAULT = object()
+
+
+class ReplyTimeout(Exception):
+    pass
+
+
+class SerialTransport(object):
+    """Request/reply framing on top of a pyserial port.
+
+    Replies are framed by their terminator and read as soon as the bytes arrive, the only wait is the
+    per-command deadline. Stale input is discarded before a command is written, never after, so a fast
+    reply from the controller can not be thrown away.
+
+    With metrics set, every exchange is recorded in that AR4_metrics.Metrics under the given name.
+    Exchanges from different threads are serialised by lock.
+    """
+
+    # reply deadline in seconds per command prefix, None waits until the controller answers
+    DEFAULT_TIMEOUTS = {
+        'MJ': None, 'ML': None, 'RJ': None, 'MC': None, 'MA': None,
+        'LL': None, 'SL': None, 'SS': None, 'CP': None,
+    }
+
+    def __init__(self, ser, terminator=b'\n', timeouts=None, default_timeout=5.0, poll_interval=.05,
+                 metrics=None, name='teensy'):
+        self.ser = ser
+        self.metrics = metrics
+        self.name = name
+        self.terminator = terminator
+        self.timeouts = dict(self.DEFAULT_TIMEOUTS)
+        if timeouts is not None:
+            self.timeouts.update(timeouts)
+        self.default_timeout = default_timeout
+        self.poll_interval = poll_interval
+        self.pipeline = None
+        self._buffer = bytearray()
+        self._arrival = None
+        self.lock = threading.RLock()
+
+    def timeout_for(self, command):
+        if isinstance(command, (bytes, bytearray)):
+            command = command[:2].decode('ascii', 'replace')
+        return self.timeouts.get(command[:2], self.default_timeout)
+
+    def discard_stale(self):
+        self._buffer.clear()
+        if self.ser.in_waiting:
+            self.ser.reset_input_buffer()
+
+    def write(self, command):
+        if isinstance(command, str):
+            command = command.encode()
+        self.ser.write(command)
+
+    def exchange(self, command, reply=LINE, timeout=_DEFAULT):
+        if self.pipeline is not None:
+            self.pipeline.drain()
+        with self.lock:
+            self.discard_stale()
+            if self.metrics is not None:
+                response = self._measured_exchange(command, reply, timeout)
+            else:
+                response = self._exchange(command, reply, timeout)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("exchange", extra=fields(port=self.name, command=command.strip(), response=response))
+        return response
+
+    def _exchange(self, command, reply, timeout):
+        self.write(command)
+        if reply is None:
+            return None
+        if timeout is _DEFAULT:
+            timeout = self.timeout_for(command)
+        if reply == BYTE:
+            return self.read_bytes(1, timeout)
+        return self.read_line(timeout)
+
+    def _measured_exchange(self, command, reply, timeout):
+        start = time.perf_counter()
+        data = command.encode() if isinstance(command, str) else bytes(command)
+        encoded = time.perf_counter()
+        self.ser.write(data)
+        written = time.perf_counter()
+        prefix = data[:2].decode('ascii', 'replace')
+        response = b''
+        if reply is not None:
+            if timeout is _DEFAULT:
+                timeout = self.timeouts.get(prefix, self.default_timeout)
+            self._arrival = None
+            try:
+                if reply == BYTE:
+                    response = self.read_bytes(1, timeout)
+                else:
+                    response = self.read_line(timeout)
+            except ReplyTimeout:
+                self.metrics.timeout(self.name, prefix)
+                raise
+        done = time.perf_counter()
+        arrival = self._arrival or done
+        self.metrics.exchange(self.name, prefix, encoded - start, written - encoded, arrival - written,
+                              done - arrival, len(data), len(response) + (reply == LINE) * len(self.terminator))
+        return None if reply is None else response
+
+    def exchange_batch(self, commands, reply=BYTE, timeout=_DEFAULT, max_bytes=None):
+        """Writes commands back to back and returns one reply per command, in order.
+
+        The controller works through them from its receive buffer, so a batch costs one turnaround instead of one
+        per command. max_bytes bounds the bytes written ahead of their replies, e.g. to the receive buffer of the
+        controller, longer batches go out in chunks. timeout is per command, the deadline of a chunk their sum.
+        """
+        data = [command.encode() if isinstance(command, str) else bytes(command) for command in commands]
+        if self.pipeline is not None:
+            self.pipeline.drain()
+        replies = []
+        with self.lock:
+            self.discard_stale()
+            start = 0
+            while start < len(data):
+                end = start + 1
+                size = len(data[start])
+                while end < len(data) and (max_bytes is None or size + len(data[end]) <= max_bytes):
+                    size += len(data[end])
+                    end += 1
+                replies.extend(self._batch_chunk(data[start:end], reply, timeout))
+                start = end
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("batch exchange", extra=fields(port=self.name, commands=[c.strip() for c in data],
+                                                        responses=replies))
+        return replies
+
+    def _batch_chunk(self, chunk, reply, timeout):
+        start = time.perf_counter()
+        payload = b''.join(chunk)
+        encoded = time.perf_counter()
+        self.ser.write(payload)
+        written = time.perf_counter()
+        if timeout is _DEFAULT:
+            timeouts = [self.timeout_for(command) for command in chunk]
+            timeout = None if None in timeouts else sum(timeouts)
+        else:
+            timeout = None if timeout is None else timeout * len(chunk)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._arrival = None
+        replies = []
+        try:
+            for _ in chunk:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+                replies.append(self.read_bytes(1, remaining) if reply == BYTE else self.read_line(remaining))
+        except ReplyTimeout:
+            if self.metrics is not None:
+                self.metrics.timeout(self.name, 'batch')
+            raise
+        if self.metrics is not None:
+            done = time.perf_counter()
+            arrival = self._arrival or done
+            self.metrics.exchange(self.name, 'batch', encoded - start, written - encoded, arrival - written,
+                                  done - arrival, len(payload),
+                                  sum(len(r) for r in replies) + (reply == LINE) * len(self.terminator) * len(chunk))
+        return replies
+
+    def read_line(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            index = self._buffer.find(self.terminator)
+            if index >= 0:
+                line = bytes(self._buffer[:index])
+                del self._buffer[:index + len(self.terminator)]
+                return line
+            self._fill(deadline)
+
+    def read_bytes(self, size=1, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self._buffer) < size:
+            self._fill(deadline)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def _fill(self, deadline):
+        if deadline is None:
+            timeout = None
+        else:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ReplyTimeout("No reply from controller within deadline, received: "
+                                   + repr(bytes(self._buffer)))
+            timeout = min(remaining, self.poll_interval)
+        if self.ser.timeout != timeout:
+            self.ser.timeout = timeout
+        data = self.ser.read(max(1, self.ser.in_waiting))
+        if data and self._arrival is None:
+            self._arrival = time.perf_counter()
+        self._buffer += data
@@ -0,0 +1,311 @@
+__author__ = "Jona Gladines <<jona.gladines@uantwerpen.be>>"
+__copyright__ = "Copyright (C) 2024 Jona Gladines"
+__license__ = "Public Domain"
+__version__ = "0.1"
+
+
+import math
+
+import numpy as np
+
+from AR4_calibration import CalibrationError
+
+
+# batches larger than this find their nearest neighbours through a grid instead of comparing every point
+GRID_THRESHOLD = 256
+# and only try the 2-opt moves that connect a point with one of its nearest neighbours
+NEIGHBOURS = 10
+
+
+class PixelMap(object):
+    """Linear mapping of camera pixels to robot XY in mm, per axis, like the vision calibration of the AR4 GUI.
+
+    Two reference points are known in pixels and in robot coordinates, the origin and the end of the calibrated
+    area. The camera axes are expected to be parallel to the robot axes, a mirrored axis has a negative scale.
+    """
+
+    def __init__(self, pixel_origin, robot_origin, pixel_end, robot_end):
+        self.pixel_origin = np.asarray(pixel_origin, dtype=float)
+        self.robot_origin = np.asarray(robot_origin, dtype=float)
+        pixel_range = np.asarray(pixel_end, dtype=float) - self.pixel_origin
+        if not np.all(pixel_range):
+            raise CalibrationError("Vision calibration has the same origin and end pixel on an axis")
+        self.scale = (np.asarray(robot_end, dtype=float) - self.robot_origin) / pixel_range
+
+    @classmethod
+    def from_calibration(cls, calibration):
+        """The VisOrig and VisEnd pixel and mm fields, or the VisX/VisRobX reference points when those are unset."""
+        def point(*keys):
+            return [float(calibration[key]) for key in keys]
+
+        try:
+            return cls(point('VisOrigXpix', 'VisOrigYpix'), point('VisOrigXmm', 'VisOrigYmm'),
+                       point('VisEndXpix', 'VisEndYpix'), point('VisEndXmm', 'VisEndYmm'))
+        except CalibrationError:
+            return cls(point('VisX1Val', 'VisY1Val'), point('VisRobX1Val', 'VisRobY1Val'),
+                       point('VisX2Val', 'VisY2Val'), point('VisRobX2Val', 'VisRobY2Val'))
+
+    def to_robot(self, pixels):
+        # (N, 2) pixel coordinates to (N, 2) robot x, y
+        return self.robot_origin + (np.atleast_2d(np.asarray(pixels, dtype=float)) - self.pixel_origin) * self.scale
+
+    def to_pixels(self, points):
+        return self.pixel_origin + (np.atleast_2d(np.asarray(points, dtype=float)) - self.robot_origin) / self.scale
+
+
+# ------------------------- #
+#  Pick Ordering            #
+# ------------------------- #
+def path_length(points, order, start=None):
+    path = np.asarray(points, dtype=float)[order]
+    if start is not None:
+        path = np.vstack((np.asarray(start, dtype=float)[:2], path))
+    return float(np.linalg.norm(np.diff(path, axis=0), axis=1).sum())
+
+
+def order_picks(points, start=None, two_opt=True, max_passes=20):
+    """Visiting order of (N, 2) points that keeps the travel short, an array of indices.
+
+    A nearest neighbour tour from start, or from the first point, is improved with 2-opt until a pass finds no
+    shorter path or after max_passes. The path is open, it ends at the last pick. Beyond GRID_THRESHOLD points
+    the tour is built on a grid index and 2-opt only reconnects points with their NEIGHBOURS nearest points.
+    """
+    points = np.asarray(points, dtype=float)[:, :2]
+    if len(points) < 2:
+        return np.arange(len(points))
+    origin = points[0] if start is None else np.asarray(start, dtype=float)[:2]
+    large = len(points) > GRID_THRESHOLD
+    order = _Grid(points).tour(origin) if large else _nearest_neighbour(points, origin)
+    if two_opt:
+        start = None if start is None else origin
+        if large:
+            order = _two_opt_neighbours(points, order, start, max_passes, _neighbours(points, NEIGHBOURS))
+        else:
+            order = _two_opt(points, order, start, max_passes)
+    return order
+
+
+def _nearest_neighbour(points, origin):
+    remaining = np.ones(len(points), dtype=bool)
+    order = np.empty(len(points), dtype=int)
+    position = origin
+    for step in range(len(points)):
+        distance = np.einsum('ij,ij->i', points - position, points - position)
+        distance[~remaining] = np.inf
+        index = int(np.argmin(distance))
+        order[step] = index
+        remaining[index] = False
+        position = points[index]
+    return order
+
+
+def _two_opt(points, order, start, max_passes):
+    # reverses the segment path[i..j] whenever that shortens the path, all j of an i are compared at once
+    path = points[order]
+    order = order.copy()
+    if start is not None:
+        path = np.vstack((start, path))
+        order = np.concatenate(([-1], order))
+    count = len(path)
+    first = 1 if start is not None else 0
+    for _ in range(max_passes):
+        improved = False
+        for i in range(first, count - 1):
+            j = np.arange(i + 1, count)
+            inner = j < count - 1
+            # new edges path[i-1]-path[j] and path[i]-path[j+1], the old path[i-1]-path[i] and path[j]-path[j+1]
+            delta = np.zeros(len(j))
+            if i > 0:
+                delta += np.linalg.norm(path[j] - path[i - 1], axis=1) - np.linalg.norm(path[i] - path[i - 1])
+            after = j[inner]
+            delta[inner] += np.linalg.norm(path[after + 1] - path[i], axis=1) - np.linalg.norm(
+                path[after + 1] - path[after], axis=1)
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                end = j[best] + 1
+                path[i:end] = path[i:end][::-1].copy()
+                order[i:end] = order[i:end][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return order[first:]
+
+
+def _two_opt_neighbours(points, order, start, max_passes, neighbours):
+    # the same moves for large batches, only those where path[j] is one of the nearest points of path[i-1], so
+    # every i compares a few candidates, in plain python which is faster than numpy for so few
+    xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+    if start is not None:
+        xs.append(float(start[0]))
+        ys.append(float(start[1]))
+    # the start, when given, is the extra last point and stays in front
+    path = ([len(points)] if start is not None else []) + order.tolist()
+    first = 1 if start is not None else 0
+    count = len(path)
+    where = [0] * len(xs)
+    for position, point in enumerate(path):
+        where[point] = position
+    neighbours = neighbours.tolist()
+    hypot = math.hypot
+    for _ in range(max_passes):
+        improved = False
+        for i in range(max(first, 1), count - 1):
+            a, b = path[i - 1], path[i]
+            if a == len(points):
+                continue
+            ax, ay, bx, by = xs[a], ys[a], xs[b], ys[b]
+            old = hypot(bx - ax, by - ay)
+            best, best_delta = None, -1e-9
+            for c in neighbours[a]:
+                j = where[c]
+                if j <= i:
+                    continue
+                delta = hypot(xs[c] - ax, ys[c] - ay) - old
+                if j < count - 1:
+                    d = path[j + 1]
+                    delta += hypot(xs[d] - bx, ys[d] - by) - hypot(xs[d] - xs[c], ys[d] - ys[c])
+                if delta < best_delta:
+                    best, best_delta = j, delta
+            if best is not None:
+                path[i:best + 1] = path[i:best + 1][::-1]
+                for position in range(i, best + 1):
+                    where[path[position]] = position
+                improved = True
+        if not improved:
+            break
+    return np.array(path[first:], dtype=int)
+
+
+def _neighbours(points, count):
+    # the count nearest other points of every point, distances computed in chunks to bound the memory
+    count = min(count, len(points) - 1)
+    result = np.empty((len(points), count), dtype=int)
+    for low in range(0, len(points), 1024):
+        chunk = points[low:low + 1024]
+        distance = np.einsum('ijk,ijk->ij', chunk[:, None] - points[None], chunk[:, None] - points[None])
+        distance[np.arange(len(chunk)), np.arange(low, low + len(chunk))] = np.inf
+        result[low:low + len(chunk)] = np.argpartition(distance, count - 1, axis=1)[:, :count]
+    return result
+
+
+class _Grid(object):
+    # uniform grid over the points, nearest neighbour tour in about N * sqrt(N) instead of N * N
+
+    def __init__(self, points):
+        self.points = points
+        self.low = points.min(axis=0)
+        span = float(np.max(points.max(axis=0) - self.low))
+        self.cell = span / math.sqrt(len(points)) if span > 0 else 1.0
+        cells = np.floor((points - self.low) / self.cell).astype(int)
+        self.extent = int(cells.max()) + 1
+        self.buckets = {}
+        for index, (cx, cy) in enumerate(cells.tolist()):
+            self.buckets.setdefault((cx, cy), []).append(index)
+
+    def tour(self, origin):
+        order = np.empty(len(self.points), dtype=int)
+        position = np.asarray(origin, dtype=float)
+        for step in range(len(self.points)):
+            index = self._nearest(position)
+            order[step] = index
+            cell = tuple(np.floor((self.points[index] - self.low) / self.cell).astype(int).tolist())
+            bucket = self.buckets[cell]
+            bucket.remove(index)
+            if not bucket:
+                del self.buckets[cell]
+            position = self.points[index]
+        return order
+
+    def _nearest(self, position):
+        cx, cy = np.floor((position - self.low) / self.cell).astype(int).tolist()
+        best, best_distance = None, math.inf
+        # a point in ring k is at least (k - 1) cells away, stop once that exceeds the best distance found
+        for ring in range(0, self.extent + max(abs(cx), abs(cy)) + 1):
+            if best is not None and (ring - 1) * self.cell > best_distance:
+                break
+            for cell in self._ring(cx, cy, ring):
+                for index in self.buckets.get(cell, ()):
+                    distance = math.hypot(*(self.points[index] - position))
+                    if distance < best_distance:
+                        best, best_distance = index, distance
+        return best
+
+    @staticmethod
+    def _ring(cx, cy, ring):
+        if ring == 0:
+            return [(cx, cy)]
+        cells = [(cx + dx, cy + dy) for dx in (-ring, ring) for dy in range(-ring, ring + 1)]
+        cells += [(cx + dx, cy + dy) for dy in (-ring, ring) for dx in range(-ring + 1, ring)]
+        return cells
+
+
+# ------------------------- #
+#  Pick Plans               #
+# ------------------------- #
+class PickPlan(object):
+    """Robot positions of detected parts in the order they are picked, and the moves that pick them.
+
+    points are robot x, y in mm, angles the rotation of every part in degrees, added to rz. With pick_180 a part
+    turned more than 90 degrees is picked the other way round, so the wrist never turns more than 90 degrees.
+    """
+
+    def __init__(self, points, angles=None, start=None, pick_180=False, two_opt=True):
+        self.points = np.atleast_2d(np.asarray(points, dtype=float))[:, :2]
+        angles = np.zeros(len(self.points)) if angles is None else np.asarray(angles, dtype=float)
+        if pick_180:
+            angles = (angles + 90.0) % 180.0 - 90.0
+        self.angles = angles
+        self.start = None if start is None else np.asarray(start, dtype=float)[:2]
+        self.order = order_picks(self.points, self.start, two_opt)
+
+    def __len__(self):
+        return len(self.points)
+
+    @classmethod
+    def from_pixels(cls, calibration, pixels, angles=None, start=None, two_opt=True):
+        """Plan for parts detected at (N, 2) pixels, mapped with the vision fields of calibration.
+
+        start is the robot x, y the tour begins at, with pickClosestVal set it begins at the part closest to it,
+        otherwise at the first part detected. pick180Val enables pick_180.
+        """
+        points = PixelMap.from_calibration(calibration).to_robot(pixels)
+        if str(calibration.get('pickClosestVal', '0')) != '1':
+            start = None
+        return cls(points, angles, start, str(calibration.get('pick180Val', '0')) == '1', two_opt)
+
+    def length(self):
+        return path_length(self.points, self.order, self.start)
+
+    def steps(self, z, rx, ry, rz, approach=50.0, place=None, grip_output=None, speed=25, approach_speed=None,
+              wrist_config='F'):
+        """The calls picking every part, a list of (method, args, kwargs) like Fleet.run takes.
+
+        Every pick is a move_j above the part, approach mm higher than z, a move_l down, the grip output switched
+        on when grip_output is set and a move_l back up. place is the x, y, z, rx, ry, rz the parts are brought
+        to, approached the same way, where the grip output is switched off again.
+        """
+        approach_speed = speed if approach_speed is None else approach_speed
+        steps = []
+
+        def visit(x, y, height, rx_, ry_, rz_, grip):
+            steps.append(('move_j', (x, y, height + approach, rx_, ry_, rz_),
+                          {'speed': speed, 'wrist_config': wrist_config}))
+            steps.append(('move_l', (x, y, height, rx_, ry_, rz_),
+                          {'speed': approach_speed, 'wrist_config': wrist_config}))
+            if grip_output is not None:
+                steps.append(('set_io_arduino', (grip_output, grip), {}))
+            steps.append(('move_l', (x, y, height + approach, rx_, ry_, rz_),
+                          {'speed': approach_speed, 'wrist_config': wrist_config}))
+
+        for index in self.order.tolist():
+            x, y = self.points[index].tolist()
+            visit(x, y, z, rx, ry, rz + float(self.angles[index]), True)
+            if place is not None:
+                px, py, pz, prx, pry, prz = place
+                visit(px, py, pz, prx, pry, prz, False)
+        return steps
+
+    def run(self, target, *args, **kwargs):
+        """Calls the steps on target, an AR4 or an AR4_program.Program, arguments like steps."""
+        for method, call_args, call_kwargs in self.steps(*args, **kwargs):
+            getattr(target, method)(*call_args, **call_kwargs)
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# the AR4 modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AR4_api
+from AR4_sim import SimController, LoopbackSerial, write_calibration
+
+
+@pytest.fixture
+def sim_robot(tmp_path, monkeypatch):
+    # an AR4 connected to a simulator without motion delays, working in tmp_path
+    monkeypatch.chdir(tmp_path)
+    write_calibration()
+    robot = AR4_api.AR4("sim")
+    robot.open(LoopbackSerial(SimController(time_scale=0.0)))
+    yield robot
+    robot.close()
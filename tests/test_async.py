@@ -0,0 +1,31 @@
+import asyncio
+
+from AR4_async import AsyncAR4
+from AR4_sim import SimController, LoopbackSerial, write_calibration
+
+
+def test_async_robot_on_the_simulator(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_calibration()
+
+    async def session():
+        robot = AsyncAR4("sim")
+        await robot.open(LoopbackSerial(SimController(time_scale=0.0)))
+        try:
+            assert robot.robot.params_fingerprint is not None
+            await robot.cal_robot_all()
+            x, y, z, rx, ry, rz = (await robot.request_pos())[:6]
+            response = await robot.move_r(5, 0, 0, 0, 0, 0)
+            assert response.startswith('A'), response
+            assert robot.robot.state.pose[0] == 5
+            response = await robot.move_j(x, y, z, rx, ry, rz)
+            assert response.startswith('A'), response
+            assert abs(robot.robot.state.pose[0]) < 1e-3
+            # a new tool frame invalidates the parameters the controller holds
+            await robot.set_tcp(0, 0, 50, 0, 0, 0)
+            assert robot.robot.params_fingerprint is None
+            assert robot.robot.config.tool_frame == (0, 0, 50, 0, 0, 0)
+        finally:
+            await robot.close()
+
+    asyncio.run(session())
@@ -0,0 +1,43 @@
+import threading
+
+import AR4_calibration
+from AR4_calibration import CALIBRATION_FIELDS, LAZY_SECTIONS, Calibration
+from AR4_persist import PositionStore, SYNC
+from AR4_sim import default_calibration
+
+
+def _load(tmp_path):
+    path = str(tmp_path / "ARbot.jsonl")
+    AR4_calibration.save(Calibration(zip(CALIBRATION_FIELDS, default_calibration())), path)
+    return AR4_calibration.load(path)
+
+
+def test_position_store_keeps_lazy_sections_pending(tmp_path):
+    calibration = _load(tmp_path)
+    store = PositionStore(str(tmp_path / "ARbot2.cal"), policy=SYNC)
+    store.save(calibration)
+    assert calibration.pending() == LAZY_SECTIONS
+    loaded = store.load()
+    assert loaded.pending() == LAZY_SECTIONS
+    assert loaded['curTheme'] == calibration['curTheme']
+    assert loaded['J1AngCur'] == calibration['J1AngCur']
+
+
+def test_resolve_from_several_threads(tmp_path):
+    for attempt in range(20):
+        calibration = _load(tmp_path)
+        errors = []
+
+        def read():
+            try:
+                calibration['mX1val']
+            except KeyError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        assert 'vision' not in calibration.pending()
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from AR4_daemon import RobotDaemon, AR4Client, DaemonError
+
+
+@pytest.fixture
+def daemon(sim_robot):
+    daemon = RobotDaemon(sim_robot, ('127.0.0.1', 0), telemetry_hz=50).start()
+    yield daemon
+    daemon.shutdown()
+
+
+def _client(daemon, **kwargs):
+    return AR4Client(daemon.address, timeout=5, **kwargs)
+
+
+def _wait_queued(client, queued):
+    deadline = time.monotonic() + 2
+    while client.status()['queued'] != queued:
+        assert time.monotonic() < deadline
+        time.sleep(.01)
+
+
+def test_round_trip(daemon, sim_robot):
+    with _client(daemon) as client:
+        pose = client.request_pos()
+        assert pose[:-1] == pytest.approx(sim_robot.request_pos()[:-1])
+        assert client.move_r(1, 0, 0, 0, 0, 0).startswith('A')
+        # pipelined moves return Futures in the daemon, the client gets the reply
+        sim_robot.start_pipeline()
+        assert client.move_r(-1, 0, 0, 0, 0, 0).startswith('A')
+
+
+def test_error_replies(daemon):
+    with _client(daemon) as client:
+        with pytest.raises(DaemonError) as error:
+            client.call('move_j')
+        assert error.value.kind == 'TypeError'
+        with pytest.raises(DaemonError) as error:
+            client.call('close')
+        assert error.value.kind == 'ValueError'
+        # the connection still serves after an error
+        assert client.status()['clients'] == 1
+
+
+def test_priority_and_acquire(daemon):
+    with _client(daemon) as owner, _client(daemon) as other:
+        assert owner.acquire()
+        order = []
+        low = other.submit('request_pos', priority=0)
+        high = other.submit('request_pos', priority=5)
+        low.add_done_callback(lambda future: order.append('low'))
+        high.add_done_callback(lambda future: order.append('high'))
+        # the owner is served while the requests of the other client wait
+        assert owner.request_pos()
+        _wait_queued(other, 2)
+        assert not low.done() and not high.done()
+        assert owner.release()
+        low.result(5)
+        high.result(5)
+        assert order == ['high', 'low']
+
+
+def test_disconnect_drops_queued_requests(daemon):
+    with _client(daemon) as owner:
+        owner.acquire()
+        other = _client(daemon)
+        other.submit('request_pos')
+        _wait_queued(owner, 1)
+        other.close()
+        _wait_queued(owner, 0)
+        assert owner.status()['clients'] == 1
+
+
+def test_telemetry_reaches_subscribers(daemon):
+    with _client(daemon) as client:
+        sample = next(client.subscribe(timeout=2))
+        assert len(sample['pose']) == len(daemon.robot.state.pose)
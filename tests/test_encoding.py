@@ -0,0 +1,29 @@
+import pytest
+
+import AR4_encoding
+
+
+POSE = (362.295, 148.723, 152.148, 179.997, 0.058, 179.990)
+COORDINATES = b"X362.295Y148.723Z152.148Rz179.990Ry0.058Rx179.997J70.000J80.000J90.000"
+
+CASES = [
+    ('move_j', [(POSE + (0.0, 0.0, 0.0, 'Sp', 25, 20, 20, 100, 'F', ''),
+                 b"MJ" + COORDINATES + b"Sp25Ac20Dc20Rm100WFLm\n"),
+                (POSE + (0.0, 0.0, 0.0, 'Sp', 25.0, 20, 20, 100, 'F', ''),
+                 b"MJ" + COORDINATES + b"Sp25.0Ac20Dc20Rm100WFLm\n")]),
+    ('move_l', [(POSE + (0.0, 0.0, 0.0, 'Sp', 25, 20, 20, 100, 0, 'F', True, ''),
+                 b"ML" + COORDINATES + b"Sp25Ac20Dc20Rm100Rnd0WFLmQ1\n"),
+                (POSE + (0.0, 0.0, 0.0, 'Sp', 25, 20, 20, 100, 0.0, 'F', 1, ''),
+                 b"ML" + COORDINATES + b"Sp25Ac20Dc20Rm100Rnd0.0WFLmQ0\n")]),
+    ('set_output', [((1, True), b"ONX1\n"), ((1.0, True), b"ONX1.0\n"), ((True, 1), b"ONXTrue\n")]),
+    ('servo', [((0, 25), b"SV0P25\n"), ((0, 25.0), b"SV0P25.0\n"), ((False, 25), b"SVFalseP25\n")]),
+]
+
+
+@pytest.mark.parametrize('name, calls', CASES)
+@pytest.mark.parametrize('reverse', (False, True))
+def test_output_does_not_depend_on_call_order(name, calls, reverse):
+    # arguments that compare equal but format differently must not share a cache entry
+    encoder = getattr(AR4_encoding, name)
+    for args, expected in (reversed(calls) if reverse else calls):
+        assert encoder(*args) == expected
@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+
+import pytest
+
+from AR4_fleet import Fleet, FleetHalted
+from AR4_sim import SimController, LoopbackSerial, write_calibration
+
+
+@pytest.fixture
+def controllers():
+    return {name: SimController(time_scale=0.0) for name in ('a', 'b')}
+
+
+@pytest.fixture
+def fleet(tmp_path, controllers):
+    fleet = Fleet(str(tmp_path), log_file=None)
+    for name in controllers:
+        fleet.add(name, "sim-" + name)
+        write_calibration(os.path.join(str(tmp_path), name, "ARbot.cal"))
+    fleet.open(sers={name: LoopbackSerial(controller) for name, controller in controllers.items()})
+    yield fleet
+    fleet.close()
+
+
+def test_arms_run_on_their_own_workers_and_meet_at_barriers(fleet):
+    threads = fleet.broadcast(lambda robot: threading.current_thread().name)
+    assert threads['a'].result().startswith("AR4-a") and threads['b'].result().startswith("AR4-b")
+    events = []
+    fleet.submit('a', lambda robot: time.sleep(.2) or events.append('a done'))
+    fleet.barrier()
+    fleet.submit('b', lambda robot: events.append('b after barrier'))
+    assert fleet.join(timeout=5)
+    assert events == ['a done', 'b after barrier']
+    assert fleet.faults() == {}
+
+
+def test_fault_on_one_arm_halts_the_other(fleet, controllers):
+    fleet.broadcast('cal_robot_all')
+    controllers['b'].inject('EL', prefix='RJ', joint=2)
+    before = fleet.submit('a', 'move_r', 5, 0, 0, 0, 0, 0)
+    faulted = fleet.submit('b', 'move_r', 5, 0, 0, 0, 0, 0)
+    waits = fleet.barrier()
+    after = fleet.submit('a', 'move_r', 10, 0, 0, 0, 0, 0)
+
+    assert before.result().startswith('A')
+    assert faulted.result() == 'EL010000000'
+    # the barrier breaks instead of letting a continue the coordinated sequence alone
+    for future in waits.values():
+        with pytest.raises((threading.BrokenBarrierError, FleetHalted)):
+            future.result()
+    with pytest.raises(FleetHalted):
+        after.result()
+    assert sorted(fleet.faults()) == ['a', 'b']
+    assert fleet['a'].state.pose[0] == pytest.approx(5)
+
+    fleet.clear()
+    assert fleet.submit('a', 'move_r', 10, 0, 0, 0, 0, 0).result().startswith('A')
@@ -0,0 +1,29 @@
+import pytest
+
+from AR4_gcode import parse, GCodeError, LINEAR, ARC
+
+
+def test_unsupported_code_with_axis_words_is_refused():
+    with pytest.raises(GCodeError, match='line 2'):
+        list(parse(['G1 X10 Y10 F600', 'G10 L2 P1 X0 Y0']))
+    with pytest.raises(GCodeError, match='line 2'):
+        list(parse(['G1 X10 Y10 F600', 'G28 X0 Y0']))
+
+
+def test_words_that_do_not_move_are_ignored():
+    moves = list(parse(['G17 G21 G90 G94', 'M3 S1000', 'G4 P1', 'G54', 'G1 X10 F600']))
+    assert [move.end for move in moves] == [(10.0, 0.0, 0.0)]
+
+
+def test_g92_offsets_the_coordinates():
+    moves = list(parse(['G1 X10 Y20 Z5 F600', 'G92 X0 Y0 Z0', 'G1 X1', 'G92.1', 'G1 X1']))
+    assert [move.kind for move in moves] == [LINEAR] * 3
+    assert moves[1].end == (11.0, 20.0, 5.0)
+    assert moves[2].end == (1.0, 20.0, 5.0)
+
+
+def test_arc_end_must_lie_on_the_circle():
+    moves = list(parse(['G1 X10 Y0 F600', 'G2 X0 Y10 I-10 J0']))
+    assert moves[-1].kind == ARC
+    with pytest.raises(GCodeError, match='line 2'):
+        list(parse(['G1 X10 Y0 F600', 'G2 X0 Y12 I-10 J0']))
@@ -0,0 +1,29 @@
+import pytest
+
+from AR4_ikcache import IKCache
+
+
+@pytest.fixture
+def robot(sim_robot):
+    sim_robot.ik_cache = IKCache()
+    return sim_robot
+
+
+def test_rejections_follow_the_controller_codes(robot):
+    assert robot.kinematics_checked == (robot.config, True)
+    x, y, z, rx, ry, rz = robot.kinematics.fk([0, 0, 80, 0, 30, 0])
+    exchanges = robot.metrics.recorded
+    assert robot.move_j(x, y, z, rx, ry, rz, wrist_config='F') == 'EL001000000'
+    assert robot.move_j(2000, 0, 0, 0, 0, 0) == 'ER'
+    assert robot.ik_cache.stats()['misses'] == 2
+    # answered on the host, nothing was sent
+    assert robot.metrics.recorded == exchanges
+
+
+def test_no_rejection_before_the_kinematics_agree(robot):
+    # a DH table the controller does not use, the next reply disagrees with it
+    robot.config = robot.config.replace(dh_theta=(0, -90, 0, 0, 0, 180))
+    robot.request_pos()
+    assert robot.kinematics_checked == (robot.config, False)
+    robot.move_j(2000, 0, 0, 0, 0, 0)
+    assert robot.ik_cache.stats()['misses'] == 0
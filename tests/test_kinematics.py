@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from AR4_kinematics import Kinematics, AR4_DH_THETA, AR4_DH_ALPHA, AR4_DH_D, AR4_DH_A
+from AR4_state import RobotConfig
+
+
+# the targets of Example.py, taught on an AR4: x, y, z, rx, ry, rz as passed to move_j and move_l, wrist config
+EXAMPLE_POSES = [
+    (362.295, 148.723, 152.148, 179.997, 0.058, 179.990, 'F'),
+    (362.347, 148.746, 72.901, 179.981, 0.091, 179.968, 'F'),
+    (362.366, 148.751, 157.191, 179.983, 0.094, 179.990, 'F'),
+    (398.521, 147.901, 192.077, -154.794, 87.618, -156.102, 'N'),
+    (398.486, -159.466, 192.096, -154.749, 87.652, -156.052, 'N'),
+    (293.975, -158.974, 157.285, -179.523, 1.119, -179.158, 'F'),
+    (294.049, -159.015, 75.139, -179.505, 1.148, -179.157, 'F'),
+    (294.071, -159.029, 158.539, -179.504, 1.144, -179.138, 'F'),
+    (453.084, 0.201, 158.609, -179.454, 1.245, -179.055, 'F'),
+    (20.025, 0.255, 666.752, -0.389, 1.309, -0.918, 'N'),
+    (132.288, 0.167, 512.871, -2.670, 67.958, -2.794, 'N'),
+]
+
+
+@pytest.fixture
+def kinematics():
+    config = RobotConfig(dh_theta=AR4_DH_THETA, dh_alpha=AR4_DH_ALPHA, dh_d=AR4_DH_D, dh_a=AR4_DH_A,
+                         tool_frame=(0,) * 6, mot_dir=(0,) * 9, cal_dir=(0,) * 9,
+                         pos_lim=(170, 90, 52, 165, 105, 155), neg_lim=(170, 42, 89, 165, 105, 155),
+                         step_deg=(1,) * 6, enc_mult=(1,) * 6, cal_offset=(0,) * 9)
+    return Kinematics(config)
+
+
+def test_zero_joints_face_forward(kinematics):
+    x, y, z, rx, ry, rz = kinematics.fk([0] * 6)
+    assert x == pytest.approx(64.2 + 222.63 + 36.25)
+    assert y == pytest.approx(0, abs=1e-9)
+    assert z == pytest.approx(169.77 + 305)
+
+
+@pytest.mark.parametrize('pose', EXAMPLE_POSES)
+def test_example_poses_round_trip(kinematics, pose):
+    x, y, z, rx, ry, rz, wrist_config = pose
+    joints = kinematics.ik(x, y, z, rx, ry, rz, wrist_config)
+    assert kinematics.within_limits(joints)
+    assert (joints[4] > 0) == (wrist_config == 'F')
+    distance, angle = kinematics.fk_error(joints, (x, y, z, rx, ry, rz))
+    assert distance < 1e-3
+    assert angle < 1e-3
+
+
+def test_fk_error_of_controller_reply(kinematics):
+    joints = (10.0, 20.0, -30.0, 5.0, 40.0, 15.0)
+    pose = kinematics.fk(joints)
+    assert kinematics.fk_error(joints, pose) == pytest.approx((0, 0), abs=1e-6)
+    moved = np.array(pose)
+    moved[0] += 3.0
+    moved[5] += 2.0
+    distance, angle = kinematics.fk_error(joints, moved)
+    assert distance == pytest.approx(3.0)
+    assert angle == pytest.approx(2.0)
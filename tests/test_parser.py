@@ -0,0 +1,19 @@
+import pytest
+
+from AR4_parser import is_fault
+
+
+POSITION = ("A-0.012B-32.445C44.123D0.051E78.321F-0.123G362.295H148.723I152.148J179.990K0.058L179.997"
+            "M0N{}O{}P0.0Q0.0R0.0")
+
+
+@pytest.mark.parametrize('response, fault', [
+    (POSITION.format('', ''), False),
+    (POSITION.format('debug', ' '), False),
+    (POSITION.format('', 'EL'), True),
+    ('EL000100000', True),
+    ('ER', True),
+    ('TL J1 = 1000   J2 = 1000', False),
+])
+def test_is_fault(response, fault):
+    assert is_fault(response) is fault
@@ -0,0 +1,15 @@
+import gc
+import weakref
+
+from AR4_persist import PositionStore, WRITE_BEHIND
+
+
+def test_closed_store_is_released(tmp_path):
+    store = PositionStore(str(tmp_path / "ARbot2.cal"), policy=WRITE_BEHIND, min_interval=0.0)
+    store.save({'J1AngCur': 1.0})
+    store.close()
+    assert store.load() == {'J1AngCur': 1.0}
+    reference = weakref.ref(store)
+    del store
+    gc.collect()
+    assert reference() is None
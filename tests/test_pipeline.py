@@ -0,0 +1,19 @@
+import threading
+
+
+def test_pipeline_waits_for_exchange_in_progress(sim_robot):
+    robot = sim_robot
+    try:
+        # a telemetry poll holds the port lock for its exchange
+        robot.transport.lock.acquire()
+        started = threading.Thread(target=robot.start_pipeline)
+        started.start()
+        started.join(.2)
+        assert started.is_alive()
+        assert robot.transport.pipeline is None
+        robot.transport.lock.release()
+        started.join(1.0)
+        assert robot.transport.pipeline is robot.pipeline is not None
+        assert robot.move_r(1, 0, 0, 0, 0, 0).result(1.0).startswith('A')
+    finally:
+        robot.stop_pipeline()
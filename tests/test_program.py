@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from AR4_program import Program, ProgramAborted, ProgramError, PROGRAM_CACHE, MOTION, ACK, WAIT, replay
+from AR4_state import X, RZ
+
+from test_kinematics import EXAMPLE_POSES
+
+
+def _program():
+    program = Program()
+    for move, (x, y, z, rx, ry, rz, wrist_config) in zip((program.move_j, program.move_l), EXAMPLE_POSES):
+        move(x, y, z, rx, ry, rz, speed=40, wrist_config=wrist_config)
+    program.set_io_teensy(1, True)
+    program.wait(0)
+    program.move_r(5, 0, 0, 0, 0, 0)
+    return program
+
+
+def test_compile(sim_robot):
+    compiled = _program().compile(sim_robot)
+    assert [step[0] for step in compiled.steps] == [MOTION, MOTION, ACK, WAIT, MOTION]
+    assert compiled.buffer.startswith(b"MJX362.295Y148.723Z152.148Rz179.990")
+    assert compiled.plan[2][1] == b"ONX1\n"
+
+
+@pytest.mark.parametrize('max_in_flight', (1, 2))
+def test_replay(sim_robot, max_in_flight):
+    sim_robot.cal_robot_all()
+    assert _program().run(sim_robot, max_in_flight=max_in_flight, cache_dir=None) == 5
+    assert sim_robot.state.pose[0] == pytest.approx(5)
+    assert sim_robot.pipeline is None
+
+
+def test_recompile_hits_the_cache(sim_robot, monkeypatch):
+    program = _program()
+    compiled = program.load_or_compile(sim_robot)
+    assert os.listdir(PROGRAM_CACHE) == [compiled.digest + ".ar4p"]
+    monkeypatch.setattr(Program, 'compile', lambda self, robot, check=True: pytest.fail("compiled again"))
+    cached = _program().load_or_compile(sim_robot, PROGRAM_CACHE)
+    assert cached.digest == compiled.digest
+    assert cached.buffer == compiled.buffer
+
+
+def test_rz_sign(sim_robot):
+    program = Program()
+    x, y, z, rx, ry, rz, _ = EXAMPLE_POSES[1]
+    program.move_l(x, y, z, rx, ry, rz)
+    sim_robot.state.pose[RZ] = 179.0
+    positive = program.compile(sim_robot, check=False)
+    sim_robot.state.pose[RZ] = -179.0
+    negative = program.compile(sim_robot, check=False)
+    # like AR4.move_l, the sign of rz follows the current one
+    assert b"Rz179.968" in positive.buffer and b"Rz-179.968" in negative.buffer
+    assert positive.digest != negative.digest
+    with pytest.raises(ProgramError):
+        replay(sim_robot, positive)
+
+
+@pytest.mark.parametrize('max_in_flight', (1, 2))
+def test_error_reply_aborts(sim_robot, max_in_flight):
+    sim_robot.cal_robot_all()
+    sim_robot.ser.controller.inject('EL', prefix='ML', joint=2)
+    with pytest.raises(ProgramAborted) as aborted:
+        _program().run(sim_robot, max_in_flight=max_in_flight, cache_dir=None)
+    assert aborted.value.step == 1
+    assert aborted.value.response == 'EL010000000'
+    # the move before the error was done
+    assert sim_robot.state.pose[X] == pytest.approx(EXAMPLE_POSES[0][0], abs=1e-3)
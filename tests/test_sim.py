@@ -0,0 +1,13 @@
+from test_kinematics import EXAMPLE_POSES
+
+
+def test_example_sequence(sim_robot):
+    # the moves of Example.py against the simulator with its default calibration
+    robot = sim_robot
+    robot.cal_robot_all()
+    moves = (robot.move_j, robot.move_l, robot.move_l, robot.move_j, robot.move_l, robot.move_j, robot.move_l,
+             robot.move_l, robot.move_j, robot.move_j, robot.move_j)
+    for move, (x, y, z, rx, ry, rz, wrist_config) in zip(moves, EXAMPLE_POSES):
+        response = move(x, y, z, rx, ry, rz, speed=40, wrist_config=wrist_config)
+        assert response.startswith('A'), response
+        assert abs(robot.state.pose[6] - x) < 1e-3
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from AR4_vision import PixelMap, PickPlan, GRID_THRESHOLD, order_picks, path_length, _nearest_neighbour
+
+
+def test_reference_points_map_onto_each_other():
+    # the camera y axis points the other way than the robot y axis
+    pixel_map = PixelMap((100, 50), (200, 100), (600, 450), (450, -100))
+    assert pixel_map.to_robot([(100, 50), (600, 450)]) == pytest.approx(np.array([(200, 100), (450, -100)]))
+    assert pixel_map.to_robot((350, 250)) == pytest.approx(np.array([(325, 0)]))
+    assert pixel_map.to_pixels([(325, 0)]) == pytest.approx(np.array([(350, 250)]))
+
+
+def test_from_calibration_falls_back_to_the_reference_fields():
+    calibration = {'VisOrigXpix': 0, 'VisOrigYpix': 0, 'VisOrigXmm': 0, 'VisOrigYmm': 0,
+                   'VisEndXpix': 0, 'VisEndYpix': 0, 'VisEndXmm': 0, 'VisEndYmm': 0,
+                   'VisX1Val': '10', 'VisY1Val': '20', 'VisRobX1Val': '300', 'VisRobY1Val': '50',
+                   'VisX2Val': '110', 'VisY2Val': '220', 'VisRobX2Val': '350', 'VisRobY2Val': '150'}
+    pixel_map = PixelMap.from_calibration(calibration)
+    assert pixel_map.to_robot([(110, 220)]) == pytest.approx(np.array([(350, 150)]))
+    calibration.update(VisEndXpix=100, VisEndYpix=100, VisEndXmm=100, VisEndYmm=100)
+    assert PixelMap.from_calibration(calibration).scale == pytest.approx([1, 1])
+
+
+@pytest.mark.parametrize('count', (12, 60, GRID_THRESHOLD + 100))
+def test_order_is_a_short_permutation(count):
+    points = np.random.RandomState(count).uniform(0, 300, (count, 2))
+    start = (-10.0, -10.0)
+    order = order_picks(points, start)
+    assert sorted(order.tolist()) == list(range(count))
+    tour = _nearest_neighbour(points, np.asarray(start))
+    assert path_length(points, order, start) <= path_length(points, tour, start) + 1e-9
+    assert order_picks(points, start, two_opt=False).tolist() == tour.tolist()
+
+
+def test_pick_180_folds_the_angles():
+    angles = [0, 45, 100, -135, 180]
+    assert PickPlan([(0, 0)] * 5, angles).angles.tolist() == angles
+    assert PickPlan([(0, 0)] * 5, angles, pick_180=True).angles.tolist() == [0, 45, -80, 45, 0]
+
+
+def test_steps_pick_and_place_in_order():
+    plan = PickPlan([(100, 0), (10, 0)], angles=[5, 0], start=(0, 0))
+    assert plan.order.tolist() == [1, 0]
+    steps = plan.steps(20, 180, 0, 170, approach=30, place=(0, 200, 40, 180, 0, 170), grip_output=8, speed=40)
+    assert [method for method, args, kwargs in steps] == ['move_j', 'move_l', 'set_io_arduino', 'move_l'] * 4
+    assert steps[0] == ('move_j', (10, 0, 50, 180, 0, 170), {'speed': 40, 'wrist_config': 'F'})
+    assert steps[2] == ('set_io_arduino', (8, True), {})
+    assert steps[6] == ('set_io_arduino', (8, False), {})
+    assert steps[9][1] == (100, 0, 20, 180, 0, 175)
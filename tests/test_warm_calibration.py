@@ -0,0 +1,49 @@
+import pytest
+
+from AR4_api import WARM_CAL_TOLERANCE
+
+
+@pytest.fixture
+def calls(sim_robot, monkeypatch):
+    # the calibration and SP commands cal_robot_warm sends, by method name
+    calls = []
+    for name in ('cal_robot_all', 'cal_robot_joint', 'send_pos'):
+        method = getattr(sim_robot, name)
+        monkeypatch.setattr(sim_robot, name,
+                            lambda *args, _name=name, _method=method: calls.append((_name,) + args) or _method(*args))
+    return calls
+
+
+def _saved(robot):
+    # what the next open reads back from the position file
+    robot.pos_store.flush()
+    return robot.pos_store.load()
+
+
+def test_no_saved_position_calibrates_all(sim_robot, calls):
+    assert sim_robot.saved_position is None
+    failed = sim_robot.cal_robot_warm()
+    assert sorted(failed) == [1, 2, 3, 4, 5, 6]
+    assert calls == [('cal_robot_all',)]
+
+
+def test_matching_encoders_only_send_the_pose(sim_robot, calls):
+    sim_robot.cal_robot_all()
+    sim_robot.move_r(10, -5, 20, 0, 30, 0)
+    sim_robot.saved_position = _saved(sim_robot)
+    del calls[:]
+    assert sim_robot.cal_robot_warm() == {}
+    assert calls == [('send_pos',)]
+    assert sim_robot.calibrated
+
+
+def test_drifted_joint_is_homed_alone(sim_robot, calls):
+    sim_robot.cal_robot_all()
+    sim_robot.move_r(10, -5, 20, 0, 30, 0)
+    saved = _saved(sim_robot)
+    saved['J3AngCur'] = str(float(saved['J3AngCur']) + 10 * WARM_CAL_TOLERANCE)
+    sim_robot.saved_position = saved
+    del calls[:]
+    failed = sim_robot.cal_robot_warm()
+    assert list(failed) == [3]
+    assert calls == [('send_pos',), ('cal_robot_joint', 3)]